@@ -0,0 +1,322 @@
+import os
+import hmac
+import time
+import asyncio
+import hashlib
+import datetime
+import importlib
+import httpx
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal
+import models
+from cache import make_cache_key
+from jobs import JobRunner, submit_job, JOB_FAILED
+from media import content_store, StoreWriter, UPLOAD_CHUNK_SIZE
+
+# Configuration
+AVATAR_RENDERER = os.getenv("AVATAR_RENDERER", "local")  # "local" or "package.module:ClassName"
+AVATAR_RENDER_CONCURRENCY = int(os.getenv("AVATAR_RENDER_CONCURRENCY", "2"))  # renders in flight per process
+AVATAR_POLL_INTERVAL = float(os.getenv("AVATAR_POLL_INTERVAL", "5"))  # seconds between renderer status polls
+AVATAR_RENDER_TIMEOUT = float(os.getenv("AVATAR_RENDER_TIMEOUT", "1800"))
+AVATAR_MAX_VIDEO_BYTES = int(os.getenv("AVATAR_MAX_VIDEO_BYTES", str(2 * 1024 ** 3)))
+# Renderer webhooks: both must be set, otherwise completion is detected by polling alone
+AVATAR_CALLBACK_BASE_URL = os.getenv("AVATAR_CALLBACK_BASE_URL", "").rstrip("/")
+AVATAR_WEBHOOK_SECRET = os.getenv("AVATAR_WEBHOOK_SECRET", "")
+# Local stand-in renderer
+AVATAR_LOCAL_RENDER_SECONDS = float(os.getenv("AVATAR_LOCAL_RENDER_SECONDS", "3"))
+AVATAR_LOCAL_VIDEO_BYTES = int(os.getenv("AVATAR_LOCAL_VIDEO_BYTES", str(2 * 1024 * 1024)))
+
+RENDER_JOB_KIND = "avatar.render"
+RENDER_QUEUED = "queued"
+RENDER_SUBMITTED = "submitted"
+RENDER_RENDERING = "rendering"
+RENDER_DOWNLOADING = "downloading"
+RENDER_SUCCEEDED = "succeeded"
+RENDER_FAILED = "failed"
+RENDER_MEDIA_TYPE = "video/mp4"
+
+# Webhooks received in this worker wake the waiting job at once; other workers notice via callback_at
+CALLBACK_RECHECK_INTERVAL = 1.0
+RENDER_SUBMIT_GRACE = datetime.timedelta(seconds=60)
+
+
+def render_key(text: str, avatar_id: str, voice_id: str) -> str:
+    return make_cache_key(text=text, avatar_id=avatar_id, voice_id=voice_id)
+
+
+def video_url(render_id: int) -> str:
+    return f"/api/avatar/renders/{render_id}/video"
+
+
+def webhook_token(key: str) -> str:
+    return hmac.new(AVATAR_WEBHOOK_SECRET.encode(), key.encode(), hashlib.sha256).hexdigest()
+
+
+def callback_url(render: models.AvatarRender) -> Optional[str]:
+    if not (AVATAR_CALLBACK_BASE_URL and AVATAR_WEBHOOK_SECRET):
+        return None
+    return f"{AVATAR_CALLBACK_BASE_URL}/api/avatar/renders/{render.id}/webhook?token={webhook_token(render.render_key)}"
+
+
+# --- Renderers ---
+
+class RenderHTTP:
+    """Pooled client for renderer APIs and video downloads; closed in the lifespan."""
+    _client: Optional[httpx.AsyncClient] = None
+
+    @classmethod
+    def client(cls) -> httpx.AsyncClient:
+        if cls._client is None or cls._client.is_closed:
+            cls._client = httpx.AsyncClient(timeout=httpx.Timeout(60, connect=10), follow_redirects=True)
+        return cls._client
+
+    @classmethod
+    async def stop(cls):
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+
+
+@dataclass
+class RenderStatus:
+    state: str  # "running", "succeeded" or "failed"
+    progress: float = 0.0
+    video_url: Optional[str] = None
+    error: Optional[str] = None
+
+
+class AvatarRenderer:
+    """A digital-human rendering service: submit a task, poll it, download the result."""
+
+    async def submit(self, text: str, avatar_id: str, voice_id: str, callback_url: Optional[str]) -> str:
+        """Starts a render and returns the renderer's task id."""
+        raise NotImplementedError
+
+    async def status(self, task_id: str) -> RenderStatus:
+        raise NotImplementedError
+
+    async def download(self, task_id: str, status: RenderStatus, writer: StoreWriter):
+        """Streams the finished video into the media store (default: GET status.video_url)."""
+        async with RenderHTTP.client().stream("GET", status.video_url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(UPLOAD_CHUNK_SIZE):
+                writer.write(chunk)
+
+
+class LocalAvatarRenderer(AvatarRenderer):
+    """
+    Stand-in for tests and local runs: a render "takes" AVATAR_LOCAL_RENDER_SECONDS and
+    yields a deterministic placeholder file per input. Stateless (the task id carries the
+    submit time), so any worker can poll a task, even after a restart.
+    """
+
+    def __init__(self):
+        self._callbacks = set()
+
+    async def submit(self, text: str, avatar_id: str, voice_id: str, callback_url: Optional[str]) -> str:
+        task_id = f"local-{int(time.time() * 1000)}-{render_key(text, avatar_id, voice_id)[:32]}"
+        if callback_url:
+            task = asyncio.create_task(self._callback(callback_url, task_id))
+            self._callbacks.add(task)
+            task.add_done_callback(self._callbacks.discard)
+        return task_id
+
+    async def status(self, task_id: str) -> RenderStatus:
+        submitted_at = int(task_id.split("-")[1]) / 1000
+        elapsed = time.time() - submitted_at
+        if elapsed >= AVATAR_LOCAL_RENDER_SECONDS:
+            return RenderStatus(state="succeeded", progress=1.0)
+        return RenderStatus(state="running", progress=round(elapsed / AVATAR_LOCAL_RENDER_SECONDS, 3))
+
+    async def download(self, task_id: str, status: RenderStatus, writer: StoreWriter):
+        header = b"\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom"
+        seed = hashlib.sha256(task_id.split("-", 2)[2].encode()).digest()
+        block = seed * (UPLOAD_CHUNK_SIZE // len(seed))
+        writer.write(header)
+        remaining = AVATAR_LOCAL_VIDEO_BYTES - len(header)
+        while remaining > 0:
+            chunk = block[:remaining]
+            writer.write(chunk)
+            remaining -= len(chunk)
+            await asyncio.sleep(0)
+
+    async def _callback(self, url: str, task_id: str):
+        await asyncio.sleep(AVATAR_LOCAL_RENDER_SECONDS)
+        try:
+            await RenderHTTP.client().post(url, json={"status": "succeeded", "task_id": task_id})
+        except httpx.HTTPError as e:
+            print(f"Local renderer callback failed: {e!r}")
+
+
+_renderer: Optional[AvatarRenderer] = None
+
+
+def load_renderer(spec: str) -> AvatarRenderer:
+    if spec == "local":
+        return LocalAvatarRenderer()
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def get_renderer() -> AvatarRenderer:
+    global _renderer
+    if _renderer is None:
+        _renderer = load_renderer(AVATAR_RENDERER)
+    return _renderer
+
+
+# Renders get their own bounded pool, so minutes-long renders never hold the general job slots
+render_runner = JobRunner(concurrency=AVATAR_RENDER_CONCURRENCY, kinds=(RENDER_JOB_KIND,))
+
+
+# --- Requests ---
+
+async def find_render(db: AsyncSession, key: str) -> Optional[models.AvatarRender]:
+    result = await db.execute(
+        select(models.AvatarRender).where(models.AvatarRender.render_key == key).execution_options(populate_existing=True)
+    )
+    return result.scalars().first()
+
+
+async def _render_is_live(db: AsyncSession, render: models.AvatarRender) -> bool:
+    """An identical render worth joining or reusing: finished with its file, or still in progress."""
+    if render.status == RENDER_SUCCEEDED:
+        return content_store.exists(render.content_hash)
+    if render.status == RENDER_FAILED:
+        return False
+    if not render.job_id:
+        # Being submitted by another request right now, unless that request died midway
+        return datetime.datetime.utcnow() - (render.updated_at or render.created_at) < RENDER_SUBMIT_GRACE
+    job = await db.get(models.Job, render.job_id)
+    return job is not None and job.status != JOB_FAILED  # its job gave up without marking the render
+
+
+async def request_render(db: AsyncSession, text: str, avatar_id: str, voice_id: str) -> Tuple[models.AvatarRender, bool]:
+    """
+    Render for these inputs, reusing an identical finished or in-progress one.
+    Returns (render, cached); a new or repeated render is queued on render_runner.
+    """
+    key = render_key(text, avatar_id, voice_id)
+    render = await find_render(db, key)
+    if render is not None:
+        if await _render_is_live(db, render):
+            return render, True
+        # Failed, or its file is gone: render again under the same row (only one request wins)
+        reset = await db.execute(
+            update(models.AvatarRender)
+            .where(models.AvatarRender.id == render.id, models.AvatarRender.status == render.status,
+                   models.AvatarRender.job_id.is_not_distinct_from(render.job_id))
+            .values(status=RENDER_QUEUED, progress=0.0, upstream_task_id=None, content_hash=None, size=None,
+                    error=None, finished_at=None, renderer=AVATAR_RENDERER, updated_at=datetime.datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        if reset.rowcount == 0:
+            return await find_render(db, key), True
+    else:
+        render = models.AvatarRender(render_key=key, text=text, avatar_id=avatar_id, voice_id=voice_id,
+                                     renderer=AVATAR_RENDERER, status=RENDER_QUEUED)
+        db.add(render)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # A concurrent identical request created it first; join that one
+            await db.rollback()
+            return await find_render(db, key), True
+
+    job = await submit_job(db, RENDER_JOB_KIND, {"render_id": render.id})
+    await update_render(db, render.id, job_id=job.id)
+    return await find_render(db, key), False
+
+
+async def update_render(db: AsyncSession, render_id: int, **values):
+    await db.execute(
+        update(models.AvatarRender).where(models.AvatarRender.id == render_id)
+        .values(updated_at=datetime.datetime.utcnow(), **values)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
+# --- Rendering (runs in render_runner) ---
+
+_callback_events: Dict[int, asyncio.Event] = {}
+
+
+def notify_callback(render_id: int):
+    event = _callback_events.get(render_id)
+    if event is not None:
+        event.set()
+
+
+async def wait_for_callback(render_id: int, seen: Optional[datetime.datetime], timeout: float) -> Optional[datetime.datetime]:
+    """
+    Sleeps up to `timeout`, returning early once the renderer's webhook has arrived in
+    this worker (event) or in another one (callback_at moved past `seen`).
+    Returns the latest callback_at.
+    """
+    event = _callback_events.setdefault(render_id, asyncio.Event())
+    deadline = time.monotonic() + timeout
+    try:
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, CALLBACK_RECHECK_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+            async with AsyncSessionLocal() as db:
+                latest = await db.scalar(select(models.AvatarRender.callback_at).where(models.AvatarRender.id == render_id))
+            if event.is_set() or latest != seen:
+                return latest
+        return seen
+    finally:
+        _callback_events.pop(render_id, None)
+
+
+async def run_render(db: AsyncSession, render_id: int) -> Dict:
+    """Submit -> poll -> download -> store. A retried job resumes from the stored upstream task."""
+    render = await db.get(models.AvatarRender, render_id)
+    if render is None:
+        raise HTTPException(status_code=404, detail="Render not found")
+    if render.status == RENDER_SUCCEEDED and content_store.exists(render.content_hash):
+        return {"render_id": render.id, "video_url": video_url(render.id), "size": render.size}
+    renderer = get_renderer()
+
+    # 1. Submit (once per render; the task id survives job retries and restarts)
+    task_id = render.upstream_task_id
+    if not task_id:
+        task_id = await renderer.submit(render.text, render.avatar_id, render.voice_id, callback_url(render))
+        await update_render(db, render.id, status=RENDER_SUBMITTED, upstream_task_id=task_id)
+
+    # 2. Poll until the renderer is done; a webhook cuts the wait short
+    started = time.monotonic()
+    seen = render.callback_at
+    while True:
+        status = await renderer.status(task_id)
+        if status.state == RENDER_SUCCEEDED:
+            break
+        if status.state == RENDER_FAILED or time.monotonic() - started > AVATAR_RENDER_TIMEOUT:
+            error = (status.error or "Renderer failed") if status.state == RENDER_FAILED else "Render timed out"
+            await update_render(db, render.id, status=RENDER_FAILED, error=error, finished_at=datetime.datetime.utcnow())
+            raise HTTPException(status_code=502, detail=error)
+        await update_render(db, render.id, status=RENDER_RENDERING, progress=status.progress)
+        seen = await wait_for_callback(render.id, seen, AVATAR_POLL_INTERVAL)
+
+    # 3. Download into the content-addressed media store
+    await update_render(db, render.id, status=RENDER_DOWNLOADING, progress=1.0)
+    writer = content_store.open_writer(AVATAR_MAX_VIDEO_BYTES)
+    try:
+        await renderer.download(task_id, status, writer)
+    except BaseException:
+        writer.abort()
+        raise
+    sha256 = await asyncio.to_thread(writer.commit)
+
+    # 4. Done
+    await update_render(db, render.id, status=RENDER_SUCCEEDED, content_hash=sha256, size=writer.size,
+                        error=None, finished_at=datetime.datetime.utcnow())
+    return {"render_id": render.id, "video_url": video_url(render.id), "size": writer.size}
@@ -0,0 +1,106 @@
+"""
+Offline bulk IP positioning: runs a CSV/JSONL file through the same engine as
+POST /api/ip/batch, in this process, against the configured database.
+
+    python batch.py creators.csv -o results.ndjson
+    python batch.py --resume 12 -o results.ndjson                  # after a crash or Ctrl-C
+    python batch.py --resume 12 --retry-failed -o results.ndjson   # generate failed rows again
+
+Rows are checkpointed as they finish, so an interrupted run loses at most the last
+few seconds of work; the batch also shows up in the API (GET /api/ip/batch/{id}).
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import sys
+import asyncio
+import argparse
+from fastapi import HTTPException
+from database import engine, migrate, AsyncSessionLocal
+import search_index  # noqa: F401  (keeps the search index in sync with the profiles written)
+from services import UpstreamHTTP
+from media import content_store
+from http_cache import CacheRefresh
+from ip_batch import (
+    BATCH_FORMATS, batch_format, inspect_input, store_file, create_batch, get_batch, forget_failed_rows,
+    run_batch, iter_results,
+)
+
+PROGRESS_INTERVAL = 5.0
+
+
+async def report_progress(batch_id: int):
+    while True:
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        async with AsyncSessionLocal() as db:
+            batch = await get_batch(db, batch_id)
+        print(f"Batch {batch_id}: {batch.succeeded_rows} succeeded, {batch.failed_rows} failed of {batch.total_rows}",
+              file=sys.stderr)
+
+
+async def run(args) -> int:
+    async with AsyncSessionLocal() as db:
+        if args.resume:
+            batch = await get_batch(db, args.resume)
+            if args.retry_failed:
+                await forget_failed_rows(db, batch.id)
+        else:
+            input_format = batch_format(args.format, args.input)
+            content_hash = await asyncio.to_thread(store_file, args.input)
+            total_rows = await asyncio.to_thread(inspect_input, content_store.path_for(content_hash), input_format)
+            batch = await create_batch(db, content_hash, input_format, args.input, total_rows,
+                                       use_cache=not args.bypass_cache)
+        batch_id = batch.id
+        print(f"Batch {batch_id}: {batch.total_rows} rows from {batch.filename}", file=sys.stderr)
+
+        progress = asyncio.create_task(report_progress(batch_id))
+        try:
+            summary = await run_batch(db, batch_id)
+        except asyncio.CancelledError:
+            print(f"Interrupted; finished rows are saved. Resume with: python batch.py --resume {batch_id}",
+                  file=sys.stderr)
+            raise
+        finally:
+            progress.cancel()
+    print(f"Batch {batch_id}: {summary['succeeded_rows']} succeeded, {summary['failed_rows']} failed", file=sys.stderr)
+
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        async for line in iter_results(batch_id):
+            output.write(line)
+    finally:
+        if args.output:
+            output.close()
+    return 0 if summary["failed_rows"] == 0 else 1
+
+
+async def main(args) -> int:
+    UpstreamHTTP.start()
+    try:
+        return await run(args)
+    except HTTPException as e:
+        print(f"Error: {e.detail}", file=sys.stderr)
+        return 2
+    finally:
+        await UpstreamHTTP.stop()
+        await CacheRefresh.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", nargs="?", help="CSV (header row of IPInput fields) or JSONL file")
+    parser.add_argument("--format", choices=BATCH_FORMATS, help="default: from the file extension")
+    parser.add_argument("-o", "--output", help="NDJSON results file (default: stdout)")
+    parser.add_argument("--resume", type=int, metavar="BATCH_ID", help="continue an earlier batch instead")
+    parser.add_argument("--retry-failed", action="store_true", help="with --resume: generate failed rows again")
+    parser.add_argument("--bypass-cache", action="store_true", help="do not reuse cached answers")
+    args = parser.parse_args()
+    if not args.input and not args.resume:
+        parser.error("an input file or --resume is required")
+
+    migrate(engine)
+    engine.dispose()
+    try:
+        sys.exit(asyncio.run(main(args)))
+    except KeyboardInterrupt:
+        sys.exit(130)
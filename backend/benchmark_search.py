@@ -0,0 +1,257 @@
+import os
+import re
+import json
+import hashlib
+import asyncio
+import importlib
+import httpx
+import numpy as np
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from cache import make_cache_key, benchmark_search_cache
+from services import DouyinService, single_flight
+
+# Configuration
+BENCHMARK_PROVIDERS = [p.strip() for p in os.getenv("BENCHMARK_PROVIDERS", "douyin").split(",") if p.strip()]
+BENCHMARK_SEARCH_LIMIT = int(os.getenv("BENCHMARK_SEARCH_LIMIT", "10"))  # accounts per provider
+BENCHMARK_FIXTURES_PATH = os.getenv("BENCHMARK_FIXTURES_PATH", "")  # JSON {keyword: [account, ...]}
+# TikHub Douyin API; without a key the Douyin provider serves DouyinService's mock accounts
+TIKHUB_API_KEY = os.getenv("TIKHUB_API_KEY")
+TIKHUB_BASE_URL = os.getenv("TIKHUB_BASE_URL", "https://api.tikhub.io")
+TIKHUB_USER_SEARCH_PATH = os.getenv("TIKHUB_USER_SEARCH_PATH", "/api/v1/douyin/web/fetch_user_search_result")
+SEARCH_HTTP_TIMEOUT = float(os.getenv("SEARCH_HTTP_TIMEOUT", "10"))
+SEARCH_MAX_CONNECTIONS = int(os.getenv("SEARCH_MAX_CONNECTIONS", "20"))
+
+# Ranking: weight of each engagement feature (standardized across the result set)
+RANK_WEIGHTS = {
+    "followers": 0.25,         # log follower count
+    "likes_per_video": 0.35,   # log average likes per video
+    "likes_per_follower": 0.25,  # engagement rate
+    "name_match": 0.15,        # keyword appears in the account name
+}
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+@dataclass
+class AccountCandidate:
+    platform: str
+    user_id: str
+    account_name: str
+    profile_url: str
+    follower_count: int = 0
+    like_count: int = 0
+    video_count: int = 0
+
+
+def normalize_keyword(keyword: str) -> str:
+    return WHITESPACE_PATTERN.sub(" ", keyword).strip().casefold()
+
+
+# --- Providers ---
+
+class SearchHTTP:
+    """Pooled client shared by all HTTP search providers in this worker; closed in the lifespan."""
+    _client: Optional[httpx.AsyncClient] = None
+
+    @classmethod
+    def client(cls) -> httpx.AsyncClient:
+        if cls._client is None or cls._client.is_closed:
+            cls._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=SEARCH_MAX_CONNECTIONS, max_keepalive_connections=SEARCH_MAX_CONNECTIONS),
+                timeout=httpx.Timeout(SEARCH_HTTP_TIMEOUT),
+            )
+        return cls._client
+
+    @classmethod
+    async def stop(cls):
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+
+
+class SearchProvider:
+    """Finds accounts on one platform for a keyword."""
+    platform: str = ""
+
+    async def search(self, keyword: str, limit: int) -> List[AccountCandidate]:
+        raise NotImplementedError
+
+
+class DouyinSearchProvider(SearchProvider):
+    platform = "douyin"
+
+    async def search(self, keyword: str, limit: int) -> List[AccountCandidate]:
+        if not TIKHUB_API_KEY:
+            return [AccountCandidate(platform=self.platform, **acc) for acc in DouyinService.search_accounts(keyword)][:limit]
+        response = await SearchHTTP.client().get(
+            f"{TIKHUB_BASE_URL}{TIKHUB_USER_SEARCH_PATH}",
+            params={"keyword": keyword, "offset": 0, "count": limit},
+            headers={"Authorization": f"Bearer {TIKHUB_API_KEY}"},
+        )
+        response.raise_for_status()
+        data = response.json().get("data") or {}
+        candidates = []
+        for item in data.get("user_list", [])[:limit]:
+            info = item.get("user_info") or item
+            sec_uid = info.get("sec_uid") or ""
+            user_id = str(info.get("uid") or sec_uid)
+            if not user_id:
+                continue
+            candidates.append(AccountCandidate(
+                platform=self.platform,
+                user_id=user_id,
+                account_name=info.get("nickname") or user_id,
+                profile_url=f"https://www.douyin.com/user/{sec_uid or user_id}",
+                follower_count=int(info.get("follower_count") or 0),
+                like_count=int(info.get("total_favorited") or 0),
+                video_count=int(info.get("aweme_count") or 0),
+            ))
+        return candidates
+
+
+class FixtureSearchProvider(SearchProvider):
+    """
+    Offline provider for tests and load runs: accounts from BENCHMARK_FIXTURES_PATH when
+    the keyword is listed there, otherwise deterministic synthetic accounts per keyword.
+    """
+    platform = "fixture"
+
+    def __init__(self, path: str = BENCHMARK_FIXTURES_PATH):
+        self.fixtures: Dict[str, List[Dict[str, Any]]] = {}
+        if path:
+            with open(path, encoding="utf-8") as f:
+                self.fixtures = {normalize_keyword(k): v for k, v in json.load(f).items()}
+
+    async def search(self, keyword: str, limit: int) -> List[AccountCandidate]:
+        fixtures = self.fixtures.get(normalize_keyword(keyword))
+        if fixtures is not None:
+            return [AccountCandidate(**dict({"platform": self.platform}, **acc)) for acc in fixtures[:limit]]
+        seed = int(hashlib.sha256(keyword.encode("utf-8")).hexdigest()[:8], 16)
+        rng = np.random.default_rng(seed)
+        followers = rng.lognormal(10, 1.5, limit).astype(int)
+        videos = rng.integers(10, 800, limit)
+        likes = (followers * rng.uniform(0.5, 20, limit)).astype(int)
+        return [
+            AccountCandidate(
+                platform=self.platform,
+                user_id=f"fx_{seed % 100000}_{i}",
+                account_name=f"{keyword}_{i}" if i % 2 == 0 else f"creator_{seed % 1000}_{i}",
+                profile_url=f"https://example.com/fixture/{seed % 100000}_{i}",
+                follower_count=int(followers[i]), like_count=int(likes[i]), video_count=int(videos[i]),
+            )
+            for i in range(limit)
+        ]
+
+
+SEARCH_PROVIDERS: Dict[str, SearchProvider] = {}
+
+
+def register_provider(provider: SearchProvider) -> SearchProvider:
+    SEARCH_PROVIDERS[provider.platform] = provider
+    return provider
+
+
+def load_provider(spec: str) -> SearchProvider:
+    """Provider named in BENCHMARK_PROVIDERS: a registered platform, or "package.module:ClassName" (loaded and registered)."""
+    if spec in SEARCH_PROVIDERS:
+        return SEARCH_PROVIDERS[spec]
+    if ":" not in spec:
+        raise ValueError(f"BENCHMARK_PROVIDERS: unknown search platform '{spec}'")
+    module_name, _, class_name = spec.partition(":")
+    return register_provider(getattr(importlib.import_module(module_name), class_name)())
+
+
+def get_provider(name: str) -> SearchProvider:
+    # Requests only choose among registered platforms; loading code is left to the operator's config
+    if name not in SEARCH_PROVIDERS:
+        raise HTTPException(status_code=400, detail=f"Unknown search platform: {name}")
+    return SEARCH_PROVIDERS[name]
+
+
+register_provider(DouyinSearchProvider())
+register_provider(FixtureSearchProvider())
+
+# Platforms searched when a request names none
+DEFAULT_PLATFORMS = list(dict.fromkeys(load_provider(spec).platform for spec in BENCHMARK_PROVIDERS))
+
+
+# --- Search ---
+
+async def search_platform(provider: SearchProvider, keyword: str, limit: int = BENCHMARK_SEARCH_LIMIT) -> Tuple[List[AccountCandidate], bool]:
+    """Accounts for one (platform, keyword), from the TTL cache when fresh. Returns (accounts, cached)."""
+    cache_key = make_cache_key(platform=provider.platform, keyword=normalize_keyword(keyword), limit=limit)
+    cached = await benchmark_search_cache.get(cache_key)
+    if cached is not None:
+        return [AccountCandidate(**acc) for acc in cached["accounts"]], True
+
+    async def fetch() -> List[AccountCandidate]:
+        accounts = await provider.search(keyword, limit)
+        await benchmark_search_cache.set(cache_key, {"accounts": [asdict(acc) for acc in accounts]})
+        return accounts
+
+    # Concurrent searches of the same keyword share one provider call
+    accounts = await single_flight.do(
+        f"benchmark:{cache_key}",
+        fetch,
+        encode=lambda accounts: [asdict(acc) for acc in accounts],
+        decode=lambda data: [AccountCandidate(**acc) for acc in data],
+    )
+    return accounts, False
+
+
+async def search_accounts(keyword: str, platforms: List[str]) -> Tuple[List[AccountCandidate], bool]:
+    """
+    Queries every platform concurrently and merges the results (first occurrence of a
+    (platform, user_id) wins). A failing platform is skipped; 502 only if all fail.
+    Returns (accounts, all_cached).
+    """
+    providers = [get_provider(name) for name in platforms]
+    results = await asyncio.gather(*[search_platform(p, keyword) for p in providers], return_exceptions=True)
+    accounts: Dict[Tuple[str, str], AccountCandidate] = {}
+    all_cached = True
+    failures = []
+    for provider, result in zip(providers, results):
+        if isinstance(result, BaseException):
+            print(f"Benchmark search on {provider.platform} failed: {result!r}")
+            failures.append(provider.platform)
+            continue
+        found, cached = result
+        all_cached = all_cached and cached
+        for acc in found:
+            accounts.setdefault((acc.platform, acc.user_id), acc)
+    if failures and len(failures) == len(providers):
+        raise HTTPException(status_code=502, detail=f"Benchmark search failed on: {', '.join(failures)}")
+    return list(accounts.values()), all_cached and not failures
+
+
+# --- Ranking ---
+
+def _standardize(column: np.ndarray) -> np.ndarray:
+    std = column.std()
+    return (column - column.mean()) / std if std > 0 else np.zeros_like(column)
+
+
+def rank_accounts(accounts: List[AccountCandidate], keyword: str) -> List[Tuple[AccountCandidate, float]]:
+    """
+    Scores all accounts at once: each engagement feature is computed over the whole
+    result set as a column, standardized, and combined with RANK_WEIGHTS.
+    Returns (account, score) pairs, best first.
+    """
+    if not accounts:
+        return []
+    followers = np.array([a.follower_count for a in accounts], dtype=np.float64)
+    likes = np.array([a.like_count for a in accounts], dtype=np.float64)
+    videos = np.array([a.video_count for a in accounts], dtype=np.float64)
+    needle = normalize_keyword(keyword)
+    features = {
+        "followers": np.log1p(followers),
+        "likes_per_video": np.log1p(likes / np.maximum(videos, 1)),
+        "likes_per_follower": np.log1p(likes / np.maximum(followers, 1)),
+        "name_match": np.array([needle in a.account_name.casefold() for a in accounts], dtype=np.float64),
+    }
+    matrix = np.column_stack([_standardize(features[name]) for name in RANK_WEIGHTS])
+    scores = matrix @ np.array(list(RANK_WEIGHTS.values()))
+    order = np.argsort(-scores, kind="stable")
+    return [(accounts[i], round(float(scores[i]), 4)) for i in order]
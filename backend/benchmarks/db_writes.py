@@ -0,0 +1,95 @@
+"""
+Write-throughput benchmark for the database backends.
+
+Each writer is a separate process (like a gunicorn worker) that inserts
+VideoScript rows, committing after every row the way the routers do.
+Runs 1, 4 and 16 concurrent writers against each backend and prints rows/s.
+
+Usage (from backend/):
+    python -m benchmarks.db_writes
+    python -m benchmarks.db_writes --rows 500 --postgres-url postgresql+psycopg2://user:pw@localhost/bench
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete
+from sqlalchemy.orm import sessionmaker
+from database import create_db_engine, migrate
+import models
+
+BENCH_SOURCE_TYPE = "bench"
+
+
+def _writer(url: str, sqlite_tuning: bool, rows: int, start_event, result_queue):
+    engine = create_db_engine(url, sqlite_tuning=sqlite_tuning)
+    Session = sessionmaker(bind=engine)
+    errors = 0
+    start_event.wait()
+    with Session() as db:
+        for i in range(rows):
+            try:
+                db.add(models.VideoScript(source_type=BENCH_SOURCE_TYPE, source_content=f"row-{i}", transcript="x" * 512))
+                db.commit()
+            except Exception:
+                db.rollback()
+                errors += 1
+    engine.dispose()
+    result_queue.put(errors)
+
+
+def run(url: str, sqlite_tuning: bool, writers: int, rows: int) -> dict:
+    start_event = multiprocessing.Event()
+    result_queue = multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(target=_writer, args=(url, sqlite_tuning, rows, start_event, result_queue))
+        for _ in range(writers)
+    ]
+    for p in procs:
+        p.start()
+    time.sleep(0.5)  # let every process import and connect before the clock starts
+    started = time.perf_counter()
+    start_event.set()
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - started
+    errors = sum(result_queue.get() for _ in procs)
+    written = writers * rows - errors
+    return {"writers": writers, "rows": written, "errors": errors, "seconds": elapsed, "rows_per_sec": written / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200, help="rows per writer")
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--postgres-url", default=os.getenv("BENCH_POSTGRES_URL"), help="also benchmark this PostgreSQL database")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="dbbench-")
+    backends = [
+        ("sqlite (default journal)", f"sqlite:///{tmpdir}/default.db", False),
+        ("sqlite (tuned profile)", f"sqlite:///{tmpdir}/tuned.db", True),
+    ]
+    if args.postgres_url:
+        backends.append(("postgresql", args.postgres_url, False))
+
+    print(f"{'backend':<26}{'writers':>8}{'rows':>8}{'errors':>8}{'seconds':>10}{'rows/s':>10}")
+    for name, url, tuning in backends:
+        engine = create_db_engine(url, sqlite_tuning=tuning)
+        migrate(engine)
+        for writers in args.writers:
+            r = run(url, tuning, writers, args.rows)
+            print(f"{name:<26}{r['writers']:>8}{r['rows']:>8}{r['errors']:>8}{r['seconds']:>10.2f}{r['rows_per_sec']:>10.0f}")
+        with sessionmaker(bind=engine)() as db:
+            db.execute(delete(models.VideoScript).where(models.VideoScript.source_type == BENCH_SOURCE_TYPE))
+            db.commit()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
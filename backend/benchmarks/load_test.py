@@ -0,0 +1,319 @@
+"""
+Load test for the API at a fixed arrival rate, against the real gunicorn/uvicorn setup.
+
+By default it starts the mock DashScope server (benchmarks.mock_dashscope) and gunicorn
+with gunicorn_conf.py on a scratch database, so no tokens are spent and nothing touches
+sql_app.db. Requests are sent open-loop (a new request every 1/RPS seconds regardless
+of how slow the previous ones are) across a weighted mix of scenarios:
+
+    ip_generate       POST /api/ip/generate (unique inputs unless --repeat-ratio)
+    benchmark_search  POST /api/benchmark/search
+    script_extract    POST /api/script/extract?url=...
+    script_rewrite    POST /api/script/rewrite
+    avatar_create     POST /api/avatar/create
+
+Reports p50/p95/p99 latency, throughput and error rates per scenario and overall, and
+writes them with the git commit and settings to a JSON artifact for comparing commits.
+
+Usage (from backend/):
+    python -m benchmarks.load_test --rps 20 --duration 60
+    python -m benchmarks.load_test --mix ip_generate=3,script_rewrite=1 --mock-latency fixed:500 --mock-rate-limit-rate 0.05
+    python -m benchmarks.load_test --target http://127.0.0.1:8000   # existing deployment, nothing spawned
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+
+SCENARIOS = ("ip_generate", "benchmark_search", "script_extract", "script_rewrite", "avatar_create")
+DEFAULT_MIX = "ip_generate=2,benchmark_search=1,script_extract=1,script_rewrite=1,avatar_create=1"
+KEYWORDS = ["职场", "健身", "美食", "育儿", "理财", "AI工具", "穿搭", "旅行"]
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario '{name}'; choose from {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    # Nearest-rank method
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Scenarios:
+    """Builds each scenario's request; the seed data (script ids) is created before the clock starts."""
+
+    def __init__(self, repeat_ratio: float, rng: random.Random):
+        self.repeat_ratio = repeat_ratio
+        self.rng = rng
+        self.script_ids: List[int] = []
+        self._ip_inputs: List[Dict[str, Any]] = []
+        self._seq = 0
+
+    async def seed(self, client: httpx.AsyncClient, scripts: int = 10):
+        for i in range(scripts):
+            r = await client.post("/api/script/extract", params={"url": f"https://www.douyin.com/video/{7000000000000000000 + i}"})
+            r.raise_for_status()
+            self.script_ids.append(r.json()["id"])
+
+    def request(self, scenario: str) -> Tuple[str, str, Dict[str, Any]]:
+        self._seq += 1
+        if scenario == "ip_generate":
+            if self._ip_inputs and self.rng.random() < self.repeat_ratio:
+                body = self.rng.choice(self._ip_inputs)
+            else:
+                body = {"bio": f"第 {self._seq} 位创作者，十年产品经理经验", "target_direction": "职场成长",
+                        "style_preference": "理性干货"}
+                self._ip_inputs.append(body)
+            return "POST", "/api/ip/generate", {"json": body}
+        if scenario == "benchmark_search":
+            return "POST", "/api/benchmark/search", {"json": {"keyword": self.rng.choice(KEYWORDS)}}
+        if scenario == "script_extract":
+            video_id = 7100000000000000000 + self._seq
+            return "POST", "/api/script/extract", {"params": {"url": f"https://www.douyin.com/video/{video_id}"}}
+        if scenario == "script_rewrite":
+            return "POST", "/api/script/rewrite", {"json": {"script_id": self.rng.choice(self.script_ids),
+                                                           "ip_context": f"ctx-{self._seq}"}}
+        return "POST", "/api/avatar/create", {"json": {"text": f"第 {self._seq} 条口播", "avatar_id": "a1", "voice_id": "v1"}}
+
+
+async def run_load(target: str, rps: float, duration: float, warmup: float, mix: Dict[str, float],
+                   repeat_ratio: float, timeout: float, max_in_flight: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    scenarios = Scenarios(repeat_ratio, rng)
+    names, weights = zip(*mix.items())
+    samples: List[Tuple[str, float, float, str]] = []  # (scenario, sent at, latency s, outcome)
+    dropped = Counter()
+    in_flight = 0
+
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+    async with httpx.AsyncClient(base_url=target, timeout=timeout, limits=limits) as client:
+        if "script_rewrite" in mix:
+            await scenarios.seed(client)
+
+        async def fire(scenario: str, sent_at: float):
+            nonlocal in_flight
+            method, path, kwargs = scenarios.request(scenario)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                outcome = str(response.status_code)
+            except httpx.TimeoutException:
+                outcome = "timeout"
+            except httpx.HTTPError as e:
+                outcome = type(e).__name__
+            finally:
+                in_flight -= 1
+            samples.append((scenario, sent_at, time.perf_counter() - started, outcome))
+
+        tasks = []
+        t0 = time.perf_counter()
+        total = int((warmup + duration) * rps)
+        for i in range(total):
+            sent_at = i / rps
+            delay = t0 + sent_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            scenario = rng.choices(names, weights)[0]
+            if in_flight >= max_in_flight:
+                dropped[scenario] += 1  # client-side saturation; counted as an error
+                continue
+            in_flight += 1
+            tasks.append(asyncio.create_task(fire(scenario, sent_at)))
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - t0
+
+    measured = [s for s in samples if s[1] >= warmup]
+    report = {"scenarios": {}, "overall": summarize(measured, sum(dropped.values()), duration)}
+    for name in names:
+        report["scenarios"][name] = summarize([s for s in measured if s[0] == name], dropped[name], duration)
+    report["wall_seconds"] = round(wall, 2)
+    return report
+
+
+def summarize(samples: List[Tuple[str, float, float, str]], dropped: int, duration: float) -> Dict[str, Any]:
+    outcomes = Counter(s[3] for s in samples)
+    ok = [s[2] * 1000 for s in samples if s[3].startswith("2")]
+    ok.sort()
+    total = len(samples) + dropped
+    errors = {k: v for k, v in outcomes.items() if not k.startswith("2")}
+    if dropped:
+        errors["dropped"] = dropped
+    return {
+        "requests": total,
+        "ok": len(ok),
+        "errors": errors,
+        "error_rate": round(1 - len(ok) / total, 4) if total else 0.0,
+        "throughput_rps": round(len(ok) / duration, 2),
+        "latency_ms": {
+            "p50": _round(percentile(ok, 50)),
+            "p95": _round(percentile(ok, 95)),
+            "p99": _round(percentile(ok, 99)),
+            "mean": _round(sum(ok) / len(ok) if ok else None),
+            "max": _round(ok[-1] if ok else None),
+        },
+    }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 1)
+
+
+def wait_until_up(url: str, proc: subprocess.Popen, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"{' '.join(proc.args)} exited with {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"Timed out waiting for {url}")
+
+
+def stop(proc: Optional[subprocess.Popen]):
+    if proc and proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"{'scenario':<18}{'requests':>9}{'ok':>7}{'err%':>7}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}")
+    rows = list(report["scenarios"].items()) + [("overall", report["overall"])]
+    for name, r in rows:
+        lat = r["latency_ms"]
+        print(f"{name:<18}{r['requests']:>9}{r['ok']:>7}{r['error_rate'] * 100:>6.1f}%{r['throughput_rps']:>8.1f}"
+              + "".join(f"{(lat[p] if lat[p] is not None else float('nan')):>9.0f}" for p in ("p50", "p95", "p99")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rps", type=float, default=10, help="target arrival rate (requests/s)")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of load before measuring")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario weights, e.g. ip_generate=2,script_rewrite=1")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="share of ip_generate calls repeating an earlier input (cache hits)")
+    parser.add_argument("--timeout", type=float, default=60, help="client timeout per request (s)")
+    parser.add_argument("--max-in-flight", type=int, default=500, help="client-side cap; arrivals beyond it count as dropped")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="JSON artifact path (default benchmarks/results/load-<commit>-<time>.json)")
+    parser.add_argument("--target", help="base URL of a running API; skips spawning gunicorn and the mock upstream")
+    parser.add_argument("--port", type=int, default=8765, help="port for the spawned gunicorn")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers to spawn")
+    parser.add_argument("--mock-port", type=int, default=9100)
+    parser.add_argument("--mock-latency", default="lognormal:800:0.5")
+    parser.add_argument("--mock-error-rate", type=float, default=0.0)
+    parser.add_argument("--mock-rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--mock-malformed-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    mock = server = None
+    scratch = None
+    target = args.target
+    mock_url = None
+    try:
+        if not target:
+            scratch = tempfile.mkdtemp(prefix="loadtest-")
+            mock_url = f"http://127.0.0.1:{args.mock_port}"
+            mock = subprocess.Popen([
+                sys.executable, "-m", "benchmarks.mock_dashscope", "--port", str(args.mock_port),
+                "--latency", args.mock_latency, "--error-rate", str(args.mock_error_rate),
+                "--rate-limit-rate", str(args.mock_rate_limit_rate), "--malformed-rate", str(args.mock_malformed_rate),
+                "--seed", str(args.seed),
+            ], cwd=BACKEND_DIR)
+            wait_until_up(f"{mock_url}/_stats", mock)
+
+            env = dict(
+                os.environ,
+                DATABASE_URL=f"sqlite:///{scratch}/load.db",
+                LLM_CACHE_PATH=f"{scratch}/llm_cache.db",
+                MEDIA_STORE_DIR=f"{scratch}/media",
+                DASHSCOPE_BASE_URL=f"{mock_url}/v1",
+                DASHSCOPE_API_KEY="mock",
+            )
+            target = f"http://127.0.0.1:{args.port}"
+            server = subprocess.Popen([
+                sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py", "main:app",
+                "--bind", f"127.0.0.1:{args.port}", "--workers", str(args.workers), "--access-logfile", "/dev/null",
+            ], cwd=BACKEND_DIR, env=env)
+            wait_until_up(f"{target}/ready", server, timeout=60)
+
+        print(f"Load: {args.rps} rps for {args.duration}s (+{args.warmup}s warmup) against {target}")
+        report = asyncio.run(run_load(target, args.rps, args.duration, args.warmup, mix, args.repeat_ratio,
+                                      args.timeout, args.max_in_flight, args.seed))
+        if mock_url:
+            report["upstream"] = httpx.get(f"{mock_url}/_stats").json()
+        try:
+            report["llm_usage"] = httpx.get(f"{target}/api/stats/usage", timeout=5).json()
+        except httpx.HTTPError:
+            pass
+    finally:
+        stop(server)
+        stop(mock)
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    commit = git_commit()
+    artifact = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "settings": {
+            "rps": args.rps, "duration": args.duration, "warmup": args.warmup, "mix": mix,
+            "repeat_ratio": args.repeat_ratio, "target": args.target or "spawned",
+            "workers": None if args.target else args.workers,
+            "mock": None if args.target else {
+                "latency": args.mock_latency, "error_rate": args.mock_error_rate,
+                "rate_limit_rate": args.mock_rate_limit_rate, "malformed_rate": args.mock_malformed_rate,
+            },
+        },
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        **report,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{commit or 'nogit'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(artifact, f, ensure_ascii=False, indent=2)
+
+    print_report(report)
+    print(f"\nWrote {output}")
+
+
+if __name__ == "__main__":
+    main()
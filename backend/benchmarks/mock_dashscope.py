@@ -0,0 +1,241 @@
+"""
+OpenAI-compatible stand-in for DashScope, for load tests that must not spend tokens.
+
+Serves POST /v1/chat/completions (also under /compatible-mode/v1), plain or streamed,
+with a configurable latency distribution and fault injection:
+  - error rate (500), rate-limit rate (429 + Retry-After)
+  - malformed-JSON rate: fenced/prose-wrapped, trailing comma, truncated, or a field
+    that fails validation - the faults the backend's JSON repair has to deal with
+Usage carries prompt/completion/cached tokens; a system prompt seen before counts as
+cached, like the upstream context cache.
+
+Runtime control: GET /_stats for counters, POST /_config with any of the options below
+to change them on the fly, POST /_reset to zero the counters.
+
+Usage (from backend/):
+    python -m benchmarks.mock_dashscope --port 9100 --latency lognormal:800:0.5 --rate-limit-rate 0.05
+    DASHSCOPE_BASE_URL=http://127.0.0.1:9100/v1 DASHSCOPE_API_KEY=mock uvicorn main:app
+
+Latency specs (milliseconds): fixed:MS, uniform:LOW:HIGH, normal:MEAN:STDDEV, lognormal:MEDIAN:SIGMA
+"""
+import re
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import hashlib
+import uvicorn
+from collections import Counter
+from typing import Any, Dict, List
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+SAMPLE_IP_RESULT = {
+    "positioning_one_liner": "用数据讲透职场升级的理性派导师",
+    "audience_profiles": [
+        {"name": "3-5年职场人", "pain_points": ["晋升卡住", "不会向上管理"], "triggers": ["涨薪", "跳槽季"]},
+    ],
+    "content_pillars": [
+        {"pillar": "晋升方法论", "topics": ["述职答辩", "向上汇报"]},
+        {"pillar": "职场工具", "topics": ["AI 提效", "复盘模板"]},
+    ],
+    "differentiation": ["大厂面试官视角", "每条内容给可复用模板"],
+    "monetization_path": [{"offer": "晋升训练营", "price_hint": "Mid", "cta": "评论区领取述职模板"}],
+    "do_not_say": ["保证升职加薪", "最好的职场课"],
+    "sample_titles": ["述职时千万别说这三句话", "我当面试官时最想听到的回答"],
+    "sample_hooks": ["你的汇报，老板只听前 30 秒", "升不上去，往往不是能力问题"],
+    "confidence_notes": "Mock response generated locally; no model was called.",
+}
+
+MALFORMATIONS = ("fenced", "trailing_comma", "truncated", "invalid_field")
+
+LATENCY_PATTERN = re.compile(r"^(fixed|uniform|normal|lognormal):([\d.]+)(?::([\d.]+))?$")
+REPAIR_FIELDS_PATTERN = re.compile(r"ONLY these keys[^:]*:\s*(.+)$", re.MULTILINE)
+
+
+class MockConfig:
+    def __init__(self, latency: str = "lognormal:800:0.5", ttft_fraction: float = 0.25, chunk_chars: int = 20,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, retry_after: float = 1.0,
+                 malformed_rate: float = 0.0, seed: int = None):
+        self.update(latency=latency, ttft_fraction=ttft_fraction, chunk_chars=chunk_chars, error_rate=error_rate,
+                    rate_limit_rate=rate_limit_rate, retry_after=retry_after, malformed_rate=malformed_rate)
+        self.random = random.Random(seed)
+
+    def update(self, **options):
+        if "latency" in options and not LATENCY_PATTERN.match(options["latency"]):
+            raise ValueError(f"Bad latency spec: {options['latency']}")
+        for name, value in options.items():
+            setattr(self, name, value)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in (
+            "latency", "ttft_fraction", "chunk_chars", "error_rate", "rate_limit_rate", "retry_after", "malformed_rate")}
+
+    def sample_latency(self) -> float:
+        """Seconds for one completion, drawn from the configured distribution."""
+        kind, a, b = LATENCY_PATTERN.match(self.latency).groups()
+        a, b = float(a), float(b or 0)
+        if kind == "fixed":
+            ms = a
+        elif kind == "uniform":
+            ms = self.random.uniform(a, b)
+        elif kind == "normal":
+            ms = self.random.gauss(a, b)
+        else:
+            ms = a * math.exp(self.random.gauss(0, b))
+        return max(ms, 0.0) / 1000
+
+
+config = MockConfig()
+counters: Counter = Counter()
+_seen_prefixes = set()
+
+app = FastAPI(title="Mock DashScope")
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 2)
+
+
+def _usage(messages: List[Dict[str, Any]], content: str) -> Dict[str, Any]:
+    prompt_tokens = sum(_estimate_tokens(str(m.get("content", ""))) for m in messages)
+    cached_tokens = 0
+    if messages and messages[0].get("role") == "system":
+        digest = hashlib.sha256(str(messages[0]["content"]).encode()).hexdigest()
+        if digest in _seen_prefixes:
+            cached_tokens = _estimate_tokens(str(messages[0]["content"]))
+        _seen_prefixes.add(digest)
+    completion_tokens = _estimate_tokens(content)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+    }
+
+
+def _content(body: Dict[str, Any]) -> str:
+    messages = body.get("messages", [])
+    last = str(messages[-1].get("content", "")) if messages else ""
+    repair = REPAIR_FIELDS_PATTERN.search(last)
+    if repair:
+        # Field-repair follow-up: answer with just the requested keys
+        fields = [f.strip() for f in repair.group(1).split(",")]
+        result = {f: SAMPLE_IP_RESULT[f] for f in fields if f in SAMPLE_IP_RESULT}
+    elif body.get("response_format", {}).get("type") == "json_object":
+        result = SAMPLE_IP_RESULT
+    else:
+        return "This is a mock completion."
+
+    text = json.dumps(result, ensure_ascii=False)
+    if config.random.random() >= config.malformed_rate:
+        return text
+    kind = config.random.choice(MALFORMATIONS)
+    counters[f"malformed_{kind}"] += 1
+    if kind == "fenced":
+        return f"Sure! Here is the strategy:\n```json\n{text}\n```\nLet me know if you need changes."
+    if kind == "trailing_comma":
+        return text[:-1] + ",}"
+    if kind == "truncated":
+        return text[: int(len(text) * 0.9)]
+    broken = dict(result)
+    broken[next(iter(broken))] = None  # first field fails validation
+    return json.dumps(broken, ensure_ascii=False)
+
+
+@app.post("/v1/chat/completions")
+@app.post("/compatible-mode/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    counters["requests"] += 1
+    latency = config.sample_latency()
+
+    roll = config.random.random()
+    if roll < config.rate_limit_rate:
+        counters["rate_limited"] += 1
+        await asyncio.sleep(min(latency, 0.05))
+        return JSONResponse({"error": {"code": "Throttling", "message": "Requests rate limit exceeded"}},
+                            status_code=429, headers={"Retry-After": str(config.retry_after)})
+    if roll < config.rate_limit_rate + config.error_rate:
+        counters["errors"] += 1
+        await asyncio.sleep(latency)
+        return JSONResponse({"error": {"code": "InternalError", "message": "Injected failure"}}, status_code=500)
+
+    content = _content(body)
+    usage = _usage(body.get("messages", []), content)
+    completion_id = f"chatcmpl-mock-{counters['requests']}"
+    created = int(time.time())
+
+    if not body.get("stream"):
+        await asyncio.sleep(latency)
+        counters["completed"] += 1
+        return {
+            "id": completion_id, "object": "chat.completion", "created": created, "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    async def stream():
+        chunks = [content[i:i + config.chunk_chars] for i in range(0, len(content), config.chunk_chars)]
+        await asyncio.sleep(latency * config.ttft_fraction)
+        gap = latency * (1 - config.ttft_fraction) / max(len(chunks), 1)
+        for piece in chunks:
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": body.get("model"),
+                     "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(gap)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield f"data: {json.dumps({'id': completion_id, 'choices': [], 'usage': usage})}\n\n"
+        yield "data: [DONE]\n\n"
+        counters["completed"] += 1
+
+    counters["streamed"] += 1
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.get("/_stats")
+def get_stats():
+    return {"config": config.as_dict(), "counters": dict(counters)}
+
+
+@app.post("/_config")
+async def set_config(request: Request):
+    try:
+        config.update(**await request.json())
+    except ValueError as e:
+        return JSONResponse({"detail": str(e)}, status_code=400)
+    return config.as_dict()
+
+
+@app.post("/_reset")
+def reset():
+    counters.clear()
+    _seen_prefixes.clear()
+    return {"ok": True}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", default="lognormal:800:0.5", help="completion latency distribution (ms)")
+    parser.add_argument("--ttft-fraction", type=float, default=0.25, help="share of the latency before the first streamed chunk")
+    parser.add_argument("--chunk-chars", type=int, default=20, help="characters per streamed chunk")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of JSON answers that are malformed")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    global config
+    config = MockConfig(latency=args.latency, ttft_fraction=args.ttft_fraction, chunk_chars=args.chunk_chars,
+                        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+                        malformed_rate=args.malformed_rate, seed=args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
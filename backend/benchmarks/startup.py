@@ -0,0 +1,112 @@
+"""
+Startup-time profile: how long until the API can take traffic, and where the time goes.
+
+1. Import profile: `python -X importtime -c "import main"`, top modules by cumulative time.
+2. Cold start under gunicorn, with and without preload_app: seconds from spawn until
+   /ready answers 200, and each worker's own startup phases as reported by /ready.
+
+Runs against a scratch database, so sql_app.db is left alone.
+
+Usage (from backend/):
+    python -m benchmarks.startup
+    python -m benchmarks.startup --workers 4 --top 15 --output startup.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from typing import Any, Dict, List
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_profile(env: Dict[str, str], top: int) -> Dict[str, Any]:
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                          cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True)
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = (part.strip() for part in line.replace("import time:", "|").split("|"))
+        modules.append({"module": name, "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+    total = next((m["cumulative_ms"] for m in modules if m["module"] == "main"), None)
+    modules.sort(key=lambda m: m["cumulative_ms"], reverse=True)
+    return {"main_ms": total, "top": modules[:top]}
+
+
+def cold_start(env: Dict[str, str], port: int, workers: int, preload: bool, timeout: float = 60) -> Dict[str, Any]:
+    url = f"http://127.0.0.1:{port}/ready"
+    started = time.perf_counter()
+    server = subprocess.Popen([
+        sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py", "main:app",
+        "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "--access-logfile", "/dev/null",
+    ], cwd=BACKEND_DIR, env=dict(env, GUNICORN_PRELOAD="true" if preload else "false"),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        ready_after = None
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                raise SystemExit(f"gunicorn exited with {server.returncode}")
+            try:
+                if httpx.get(url, timeout=1).status_code == 200:
+                    ready_after = time.perf_counter() - started
+                    break
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.02)
+        if ready_after is None:
+            raise SystemExit(f"Timed out waiting for {url}")
+
+        # Let every worker finish booting, then collect their own profiles
+        profiles: Dict[int, Any] = {}
+        deadline = time.perf_counter() + 10
+        with httpx.Client() as client:
+            while len(profiles) < workers and time.perf_counter() < deadline:
+                body = client.get(url, headers={"Connection": "close"}).json()
+                if body["ready"]:
+                    profiles[body["pid"]] = body["startup"]
+        return {"preload": preload, "workers": workers, "first_ready_seconds": round(ready_after, 3),
+                "worker_profiles": list(profiles.values())}
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8131)
+    parser.add_argument("--top", type=int, default=10, help="modules to list in the import profile")
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="startup-")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{scratch}/startup.db", MEDIA_STORE_DIR=f"{scratch}/media",
+               PROMETHEUS_MULTIPROC_DIR=f"{scratch}/prometheus")
+    os.makedirs(env["PROMETHEUS_MULTIPROC_DIR"])
+    try:
+        report = {"imports": import_profile(env, args.top),
+                  "cold_start": [cold_start(env, args.port, args.workers, preload) for preload in (False, True)]}
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    print(f"import main: {report['imports']['main_ms']:.0f} ms")
+    for m in report["imports"]["top"]:
+        print(f"  {m['cumulative_ms']:>8.1f} ms  {m['module']}")
+    for run in report["cold_start"]:
+        label = "preload" if run["preload"] else "no preload"
+        totals: List[float] = [p["total_seconds"] for p in run["worker_profiles"]]
+        print(f"{label:<11} first /ready after {run['first_ready_seconds']:.2f}s; "
+              f"per-worker startup {min(totals, default=0):.3f}-{max(totals, default=0):.3f}s ({len(totals)} workers seen)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
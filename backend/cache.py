@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Configuration
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))  # seconds
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "256"))  # per worker, in memory
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")  # SQLite file shared by all workers; empty disables
+LLM_CACHE_SHARED_MAX_ENTRIES = int(os.getenv("LLM_CACHE_SHARED_MAX_ENTRIES", "5000"))
+BENCHMARK_CACHE_TTL = float(os.getenv("BENCHMARK_CACHE_TTL", "3600"))  # search results per (platform, keyword)
+
+
+def make_cache_key(**parts: Any) -> str:
+    """Content-addressed key: SHA-256 over the canonical JSON of everything that shapes the answer."""
+    canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Two-tier cache for LLM results.
+    Tier 1 is an in-process LRU dict; tier 2 is an optional SQLite file so that
+    every gunicorn worker can reuse answers generated by the others.
+    Both tiers honour the same TTL and are bounded by entry count.
+    """
+
+    def __init__(self, namespace: str, ttl: float = LLM_CACHE_TTL, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 shared_path: str = LLM_CACHE_PATH, shared_max_entries: int = LLM_CACHE_SHARED_MAX_ENTRIES,
+                 enabled: bool = LLM_CACHE_ENABLED):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared_path = shared_path
+        self.shared_max_entries = shared_max_entries
+        self.enabled = enabled
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._shared_ready = False
+        self.counters = {"hits_memory": 0, "hits_shared": 0, "misses": 0, "writes": 0, "evictions": 0, "bypassed": 0}
+
+    # --- Public API ---
+
+    async def get(self, key: str) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+
+        value = self._memory_get(key)
+        if value is not None:
+            self.counters["hits_memory"] += 1
+            return value
+
+        if self.shared_path:
+            value = await asyncio.to_thread(self._shared_get, key)
+            if value is not None:
+                self.counters["hits_shared"] += 1
+                self._memory_set(key, value, time.time() + self.ttl)
+                return value
+
+        self.counters["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Dict):
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.ttl
+        self._memory_set(key, value, expires_at)
+        if self.shared_path:
+            await asyncio.to_thread(self._shared_set, key, value, expires_at)
+        self.counters["writes"] += 1
+
+    def record_bypass(self):
+        self.counters["bypassed"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.counters["hits_memory"] + self.counters["hits_shared"] + self.counters["misses"]
+        hits = self.counters["hits_memory"] + self.counters["hits_shared"]
+        return {
+            "enabled": self.enabled,
+            "shared": bool(self.shared_path),
+            "memory_entries": len(self._memory),
+            "hit_ratio": round(hits / lookups, 4) if lookups else None,
+            **self.counters,
+        }
+
+    # --- Tier 1: in-process LRU ---
+
+    def _memory_get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return value
+
+    def _memory_set(self, key: str, value: Dict, expires_at: float):
+        with self._lock:
+            self._memory[key] = (expires_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    # --- Tier 2: shared SQLite file ---
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.shared_path, timeout=5.0)
+        if not self._shared_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed ON llm_cache (namespace, accessed_at)")
+            conn.commit()
+            self._shared_ready = True
+        return conn
+
+    def _shared_get(self, key: str) -> Optional[Dict]:
+        conn = self._connect()
+        try:
+            now = time.time()
+            row = conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                conn.execute("DELETE FROM llm_cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+                conn.commit()
+                return None
+            conn.execute(
+                "UPDATE llm_cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key),
+            )
+            conn.commit()
+            return json.loads(row[0])
+        finally:
+            conn.close()
+
+    def _shared_set(self, key: str, value: Dict, expires_at: float):
+        conn = self._connect()
+        try:
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (namespace, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value, ensure_ascii=False), expires_at, now),
+            )
+            # Drop expired rows, then trim least-recently-used rows over the size bound
+            conn.execute("DELETE FROM llm_cache WHERE namespace = ? AND expires_at < ?", (self.namespace, now))
+            cur = conn.execute(
+                "DELETE FROM llm_cache WHERE namespace = ? AND key IN ("
+                " SELECT key FROM llm_cache WHERE namespace = ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.namespace, self.namespace, self.shared_max_entries),
+            )
+            self.counters["evictions"] += cur.rowcount
+            conn.commit()
+        finally:
+            conn.close()
+
+
+# Shared instances
+ip_positioning_cache = LLMResponseCache(namespace="ip_positioning")
+benchmark_search_cache = LLMResponseCache(namespace="benchmark_search", ttl=BENCHMARK_CACHE_TTL)
@@ -1,4 +1,8 @@
 # Gunicorn configuration file
+import os
+import sys
+import shutil
+import tempfile
 import multiprocessing
 
 bind = "0.0.0.0:8000"
@@ -9,3 +13,37 @@ keepalive = 5
 loglevel = "info"
 accesslog = "-"
 errorlog = "-"
+
+# Import the app once in the master and fork workers from it: a worker (re)start skips
+# all imports, and the workers share the imported code pages.
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+# Run schema migrations (migrate.py) in the master before any worker starts
+MIGRATE_ON_START = os.getenv("MIGRATE_ON_START", "true").lower() in ("1", "true", "yes")
+
+# Prometheus multiprocess mode: workers write samples to this directory and /metrics
+# sums them. Must be set before prometheus_client is imported, i.e. before workers load the app.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "workbench-prometheus"))
+
+def on_starting(server):
+    # Samples from a previous run would otherwise be added to this one
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+    if MIGRATE_ON_START:
+        import migrate
+        migrate.run()
+
+def post_fork(server, worker):
+    # Preloaded app: pooled connections opened in the master must not be shared by the
+    # workers; drop them from the pools without closing the master's sockets.
+    database = sys.modules.get("database")
+    if database is not None:
+        database.engine.dispose(close=False)
+        database.async_engine.sync_engine.dispose(close=False)
+    telemetry = sys.modules.get("telemetry")
+    if telemetry is not None:
+        telemetry.startup_profile.forked()
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
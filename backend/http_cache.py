@@ -0,0 +1,106 @@
+import os
+import asyncio
+import hashlib
+import datetime
+import httpx
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Set
+from fastapi import Request, Response
+
+# Configuration
+# Proxy cache lifetimes (X-Accel-Expires, read by nginx; see nginx.conf.template). The proxy
+# only stores bare paths; detail pages are refreshed there when they change, history expires.
+IP_DETAIL_PROXY_TTL = int(os.getenv("IP_DETAIL_PROXY_TTL", "300"))
+IP_HISTORY_PROXY_TTL = int(os.getenv("IP_HISTORY_PROXY_TTL", "5"))
+# Base URL of the caching proxy (http://127.0.0.1 in .env.example); when set, changed resources
+# are re-fetched through it with X-Cache-Refresh so it stores the new version right away.
+# Without it a changed profile stays stale in the proxy for up to IP_DETAIL_PROXY_TTL.
+HTTP_CACHE_REFRESH_URL = os.getenv("HTTP_CACHE_REFRESH_URL", "").rstrip("/")
+HTTP_CACHE_REFRESH_TIMEOUT = float(os.getenv("HTTP_CACHE_REFRESH_TIMEOUT", "5"))
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    cache_control: str  # for browsers
+    proxy_ttl: int = 0  # seconds the proxy may serve it without asking; 0 = not proxy-cached
+
+    def headers(self, etag: Optional[str] = None) -> Dict[str, str]:
+        headers = {"Cache-Control": self.cache_control}
+        if self.proxy_ttl:
+            headers["X-Accel-Expires"] = str(self.proxy_ttl)
+        if etag:
+            headers["ETag"] = etag
+        return headers
+
+
+# Browsers revalidate every poll (no-cache) and get a 304 while nothing changed
+CACHE_POLICIES = {
+    "ip.detail": CachePolicy("no-cache", proxy_ttl=IP_DETAIL_PROXY_TTL),
+    "ip.history": CachePolicy("no-cache", proxy_ttl=IP_HISTORY_PROXY_TTL),
+}
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag over the values that determine a representation (row ids, versions, timestamps, query)."""
+    digest = hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def row_stamp(updated_at: Optional[datetime.datetime], created_at: Optional[datetime.datetime]) -> str:
+    stamp = updated_at or created_at
+    return stamp.isoformat() if stamp else ""
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # If-None-Match: "a", W/"b" or * (weak comparison, RFC 9110)
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+
+def not_modified(request: Request, etag: str, policy: Optional[CachePolicy] = None) -> Optional[Response]:
+    """304 with the validators, or None when the client's copy is stale (or it has none)."""
+    if not etag_matches(request.headers.get("if-none-match"), etag):
+        return None
+    return Response(status_code=304, headers=policy.headers(etag) if policy else {"ETag": etag})
+
+
+# --- Proxy refresh ---
+
+class CacheRefresh:
+    """Pooled client for refreshing the proxy cache; closed in the lifespan."""
+    _client: Optional[httpx.AsyncClient] = None
+    _tasks: Set[asyncio.Task] = set()
+
+    @classmethod
+    def client(cls) -> httpx.AsyncClient:
+        if cls._client is None or cls._client.is_closed:
+            cls._client = httpx.AsyncClient(timeout=httpx.Timeout(HTTP_CACHE_REFRESH_TIMEOUT))
+        return cls._client
+
+    @classmethod
+    def paths(cls, paths: Iterable[str]):
+        """Re-fetch `paths` through the proxy in the background (call after the change is committed)."""
+        if not HTTP_CACHE_REFRESH_URL:
+            return
+        for path in paths:
+            task = asyncio.create_task(cls._refresh(path))
+            cls._tasks.add(task)
+            task.add_done_callback(cls._tasks.discard)
+
+    @classmethod
+    async def _refresh(cls, path: str):
+        try:
+            response = await cls.client().get(f"{HTTP_CACHE_REFRESH_URL}{path}", headers={"X-Cache-Refresh": "1"})
+            await response.aclose()
+        except httpx.HTTPError as e:
+            print(f"Proxy cache refresh of {path} failed: {e!r}")
+
+    @classmethod
+    async def stop(cls):
+        if cls._tasks:
+            await asyncio.gather(*cls._tasks, return_exceptions=True)
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
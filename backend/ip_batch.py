@@ -0,0 +1,365 @@
+import os
+import csv
+import json
+import time
+import asyncio
+import datetime
+import itertools
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import Text, cast, delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal, bulk_insert
+import models, schemas
+from services import AIService
+from scheduler import PRIORITY_BATCH, backoff_delay
+from jobs import JobRunner, submit_job, claim_held, TERMINAL_STATUSES
+from json_utils import json_object
+from media import content_store, UPLOAD_CHUNK_SIZE
+from http_cache import CacheRefresh
+
+# Configuration
+IP_BATCH_CONCURRENCY = int(os.getenv("IP_BATCH_CONCURRENCY", "4"))  # rows generated at once per batch
+IP_BATCH_JOBS = int(os.getenv("IP_BATCH_JOBS", "1"))  # batches run at once per process
+IP_BATCH_FLUSH_ROWS = int(os.getenv("IP_BATCH_FLUSH_ROWS", "20"))  # finished rows written per transaction
+IP_BATCH_FLUSH_SECONDS = float(os.getenv("IP_BATCH_FLUSH_SECONDS", "2"))  # ...or once the oldest waited this long
+
+BATCH_JOB_KIND = "ip.batch"
+BATCH_QUEUED = "queued"
+BATCH_RUNNING = "running"
+BATCH_SUCCEEDED = "succeeded"
+BATCH_FAILED = "failed"
+ROW_SUCCEEDED = "succeeded"
+ROW_FAILED = "failed"
+BATCH_FORMATS = ("csv", "jsonl")
+
+# Errors that would fail every remaining row the same way (budget spent, no API key):
+# stop the batch instead, so a resume after the fix picks up from there
+BATCH_FATAL_STATUS_CODES = (429, 500)
+# Upstream queue full / slot wait timed out: backpressure from interactive traffic, so the
+# row waits and tries again rather than being recorded as failed
+BATCH_RETRY_STATUS_CODES = (503,)
+READ_BLOCK_ROWS = 200
+RESULTS_PAGE_ROWS = 500
+
+REQUIRED_FIELDS = [name for name, field in schemas.IPInput.model_fields.items() if field.is_required()]
+
+
+def results_url(batch_id: int) -> str:
+    return f"/api/ip/batch/{batch_id}/results"
+
+
+def ip_profile_values(input: schemas.IPInput, result: schemas.IPPositioningResult) -> Dict:
+    """Column values of the IPProfile stored for a generated result, legacy summary columns included."""
+    return dict(
+        input_json=input.model_dump(),
+        result_json=result.model_dump(),
+        result_version=schemas.IP_RESULT_VERSION,
+        persona=result.positioning_one_liner,
+        audience=result.audience_profiles[0].name if result.audience_profiles else "General",
+        content_pillars=[p.pillar for p in result.content_pillars],
+        usp=result.differentiation[0] if result.differentiation else "N/A",
+    )
+
+
+# --- Input files ---
+
+def batch_format(format: Optional[str], filename: Optional[str], content_type: str = "") -> str:
+    if format:
+        return format
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".csv" or content_type.startswith("text/csv"):
+        return "csv"
+    if extension in (".jsonl", ".ndjson") or "ndjson" in content_type or "jsonl" in content_type:
+        return "jsonl"
+    raise HTTPException(status_code=400, detail="Cannot tell the file format; pass format=csv or format=jsonl")
+
+
+def iter_rows(path: str, input_format: str) -> Iterator[Tuple[int, Union[Dict, str]]]:
+    """
+    (row, values) per record: CSV data rows counted from 1 below the header, JSONL by
+    line number (blank lines skipped). Empty CSV cells are left out so IPInput defaults
+    apply; a record that cannot be read yields an error message instead of values.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if input_format == "csv":
+            for row, record in enumerate(csv.DictReader(f), start=1):
+                yield row, {key.strip(): value.strip() for key, value in record.items()
+                            if key and isinstance(value, str) and value.strip()}
+            return
+        for row, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                values = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row, f"Invalid JSON: {e}"
+                continue
+            yield row, values if isinstance(values, dict) else "Expected a JSON object"
+
+
+def inspect_input(path: str, input_format: str) -> int:
+    """Number of records; rejects files that are not UTF-8 and CSVs without the required columns."""
+    try:
+        if input_format == "csv":
+            with open(path, newline="", encoding="utf-8-sig") as f:
+                header = {column.strip() for column in next(csv.reader(f), [])}
+            missing = [name for name in REQUIRED_FIELDS if name not in header]
+            if missing:
+                raise HTTPException(status_code=400, detail=f"CSV is missing columns: {', '.join(missing)}")
+        return sum(1 for _ in iter_rows(path, input_format))
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Unreadable {input_format} file: {e}")
+
+
+def store_file(path: str) -> str:
+    """Copy a local file into the media store (as an upload would be); returns its SHA-256."""
+    writer = content_store.open_writer()
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(UPLOAD_CHUNK_SIZE):
+                writer.write(chunk)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.commit()
+
+
+async def read_rows(path: str, input_format: str) -> AsyncIterator[Tuple[int, Union[Dict, str]]]:
+    # Parsed in blocks on a thread, so a large file never stalls the event loop
+    rows = iter_rows(path, input_format)
+    while block := await asyncio.to_thread(lambda: list(itertools.islice(rows, READ_BLOCK_ROWS))):
+        for item in block:
+            yield item
+
+
+# --- Batches ---
+
+async def create_batch(db: AsyncSession, content_hash: str, input_format: str, filename: Optional[str],
+                       total_rows: int, use_cache: bool = True) -> models.IPBatch:
+    batch = models.IPBatch(content_hash=content_hash, input_format=input_format, filename=filename,
+                           total_rows=total_rows, use_cache=use_cache, status=BATCH_QUEUED)
+    db.add(batch)
+    await db.commit()
+    return batch
+
+
+async def update_batch(db: AsyncSession, batch_id: int, *conditions, **values):
+    await db.execute(
+        update(models.IPBatch).where(models.IPBatch.id == batch_id, *conditions)
+        .values(updated_at=datetime.datetime.utcnow(), **values)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
+async def get_batch(db: AsyncSession, batch_id: int) -> models.IPBatch:
+    batch = await db.get(models.IPBatch, batch_id, populate_existing=True)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
+
+async def submit_batch(db: AsyncSession, batch_id: int) -> models.IPBatch:
+    """Queue the batch on batch_runner; rows already checkpointed are skipped when it runs."""
+    job = await submit_job(db, BATCH_JOB_KIND, {"batch_id": batch_id})
+    await update_batch(db, batch_id, status=BATCH_QUEUED, job_id=job.id, error=None, finished_at=None)
+    return await get_batch(db, batch_id)
+
+
+async def batch_is_live(db: AsyncSession, batch: models.IPBatch) -> bool:
+    if not batch.job_id:
+        return False
+    job = await db.get(models.Job, batch.job_id, populate_existing=True)
+    return job is not None and job.status not in TERMINAL_STATUSES
+
+
+async def forget_failed_rows(db: AsyncSession, batch_id: int):
+    """Drop the checkpoints of failed rows, so the next run generates them again."""
+    await db.execute(delete(models.IPBatchRow).where(
+        models.IPBatchRow.batch_id == batch_id, models.IPBatchRow.status == ROW_FAILED
+    ))
+    await update_batch(db, batch_id, failed_rows=0)
+
+
+async def resume_batch(db: AsyncSession, batch_id: int, retry_failed: bool = False) -> models.IPBatch:
+    batch = await get_batch(db, batch_id)
+    if await batch_is_live(db, batch):
+        raise HTTPException(status_code=409, detail=f"Batch is {batch.status}")
+    if retry_failed:
+        await forget_failed_rows(db, batch_id)
+    return await submit_batch(db, batch_id)
+
+
+# --- Running (in batch_runner, or the batch.py CLI) ---
+
+class CheckpointWriter:
+    """
+    Buffers finished rows and writes them in one transaction per flush: the profiles
+    (one multi-row INSERT), their checkpoint rows and the batch counters. A crash loses
+    at most the unflushed rows, which the resumed run generates again.
+    """
+
+    def __init__(self, db: AsyncSession, batch_id: int):
+        self.db = db
+        self.batch_id = batch_id
+        self.pending: List[Dict] = []
+        self._oldest = 0.0
+        self._lock = asyncio.Lock()
+
+    def add(self, record: Dict) -> bool:
+        """Buffer a finished row; True when a flush is due."""
+        if not self.pending:
+            self._oldest = time.monotonic()
+        self.pending.append(record)
+        return len(self.pending) >= IP_BATCH_FLUSH_ROWS or time.monotonic() - self._oldest >= IP_BATCH_FLUSH_SECONDS
+
+    async def flush(self):
+        async with self._lock:
+            records, self.pending = self.pending, []
+            if not records:
+                return
+            succeeded = [record for record in records if record["status"] == ROW_SUCCEEDED]
+            try:
+                profiles = await bulk_insert(self.db, models.IPProfile, [record["profile"] for record in succeeded], commit=False)
+                for record, profile in zip(succeeded, profiles):
+                    record["ip_profile_id"] = profile["id"]
+                await bulk_insert(self.db, models.IPBatchRow, [
+                    {"batch_id": self.batch_id, "row": record["row"], "status": record["status"],
+                     "ip_profile_id": record.get("ip_profile_id"), "error": record.get("error")}
+                    for record in records
+                ], commit=False)
+                await self.db.execute(
+                    update(models.IPBatch).where(models.IPBatch.id == self.batch_id)
+                    .values(succeeded_rows=models.IPBatch.succeeded_rows + len(succeeded),
+                            failed_rows=models.IPBatch.failed_rows + len(records) - len(succeeded),
+                            updated_at=datetime.datetime.utcnow())
+                    .execution_options(synchronize_session=False)
+                )
+                await self.db.commit()
+            except IntegrityError:
+                # Another runner took the batch over (lease expired) and recorded these rows first
+                await self.db.rollback()
+                print(f"Batch {self.batch_id}: rows {records[0]['row']}..{records[-1]['row']} already recorded")
+                return
+            if succeeded:
+                CacheRefresh.paths(["/api/ip/history"])
+
+
+def row_error(e: ValidationError) -> str:
+    return "Invalid row: " + "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+
+
+async def generate_row(row: int, values: Union[Dict, str], use_cache: bool) -> Dict:
+    """The checkpoint record of one input row; failures are recorded, not raised (unless fatal)."""
+    if isinstance(values, str):
+        return {"row": row, "status": ROW_FAILED, "error": values}
+    try:
+        input = schemas.IPInput(**values)
+    except ValidationError as e:
+        return {"row": row, "status": ROW_FAILED, "error": row_error(e)}
+    attempt = 0
+    while True:
+        try:
+            result = await AIService.generate_ip_positioning(input, use_cache=use_cache, priority=PRIORITY_BATCH,
+                                                             endpoint=BATCH_JOB_KIND)
+        except HTTPException as e:
+            if e.status_code in BATCH_RETRY_STATUS_CODES:
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+            if e.status_code in BATCH_FATAL_STATUS_CODES:
+                raise
+            return {"row": row, "status": ROW_FAILED, "error": str(e.detail)}
+        return {"row": row, "status": ROW_SUCCEEDED, "profile": ip_profile_values(input, result)}
+
+
+async def run_batch(db: AsyncSession, batch_id: int) -> Dict:
+    """
+    Generates every row without a checkpoint, IP_BATCH_CONCURRENCY at a time, behind
+    interactive traffic in the upstream queue. Safe to run again at any point: a
+    retried job or a resumed batch continues where the last run stopped.
+    """
+    batch = await get_batch(db, batch_id)
+    if not content_store.exists(batch.content_hash):
+        await update_batch(db, batch_id, status=BATCH_FAILED, error="Input file is missing from the media store")
+        raise HTTPException(status_code=410, detail="Batch input file is missing")
+    done = set((await db.scalars(select(models.IPBatchRow.row).where(models.IPBatchRow.batch_id == batch_id))).all())
+    await update_batch(db, batch_id, status=BATCH_RUNNING, error=None, finished_at=None)
+
+    writer = CheckpointWriter(db, batch_id)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=IP_BATCH_CONCURRENCY * 2)
+
+    async def produce():
+        async for row, values in read_rows(content_store.path_for(batch.content_hash), batch.input_format):
+            if row not in done:
+                await queue.put((row, values))
+        for _ in range(IP_BATCH_CONCURRENCY):
+            await queue.put(None)
+
+    async def work():
+        while (item := await queue.get()) is not None:
+            if writer.add(await generate_row(*item, use_cache=batch.use_cache)):
+                await writer.flush()
+
+    tasks = [asyncio.create_task(produce())] + [asyncio.create_task(work()) for _ in range(IP_BATCH_CONCURRENCY)]
+    try:
+        await asyncio.gather(*tasks)
+        await writer.flush()
+    except BaseException as e:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Keep the rows that did finish (a flush interrupted midway rolls back as a whole)
+        await db.rollback()
+        await writer.flush()
+        # Fenced: if this run was abandoned because its job lease was lost, the batch now
+        # belongs to the runner that claimed the job again and its status must stay as is
+        owned = (models.IPBatch.status == BATCH_RUNNING, claim_held())
+        if isinstance(e, asyncio.CancelledError):
+            await update_batch(db, batch_id, *owned, status=BATCH_QUEUED)  # shutdown: the job goes back to the queue
+        else:
+            error = e.detail if isinstance(e, HTTPException) else repr(e)
+            await update_batch(db, batch_id, *owned, status=BATCH_FAILED, error=str(error))
+        raise
+
+    await update_batch(db, batch_id, status=BATCH_SUCCEEDED, finished_at=datetime.datetime.utcnow())
+    batch = await get_batch(db, batch_id)
+    return {"batch_id": batch.id, "succeeded_rows": batch.succeeded_rows, "failed_rows": batch.failed_rows,
+            "results_url": results_url(batch.id)}
+
+
+async def iter_results(batch_id: int, since: Optional[int] = None) -> AsyncIterator[bytes]:
+    """
+    NDJSON, one line per processed row: checkpoint, row, status, ip_profile_id, error,
+    and the stored input and result JSON copied as-is. The full export is in row order.
+    With `since`, only rows checkpointed after that checkpoint id, in checkpoint order:
+    rows finish out of order, so this (not the row number) is what a client resumes
+    from. Pages with its own sessions (a streamed body outlives the request's).
+    """
+    # Keyset on the order column: row for the export, checkpoint id for incremental reads
+    key = models.IPBatchRow.row if since is None else models.IPBatchRow.id
+    after = 0 if since is None else since
+    while True:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(models.IPBatchRow.id.label("checkpoint"), models.IPBatchRow.row, models.IPBatchRow.status,
+                       models.IPBatchRow.ip_profile_id, models.IPBatchRow.error,
+                       cast(models.IPProfile.input_json, Text).label("input"),
+                       cast(models.IPProfile.result_json, Text).label("result"))
+                .outerjoin(models.IPProfile, models.IPProfile.id == models.IPBatchRow.ip_profile_id)
+                .where(models.IPBatchRow.batch_id == batch_id, key > after)
+                .order_by(key)
+                .limit(RESULTS_PAGE_ROWS)
+            )).all()
+        for row in rows:
+            yield json_object(row._asdict(), raw=("input", "result")) + b"\n"
+        if len(rows) < RESULTS_PAGE_ROWS:
+            return
+        after = rows[-1].row if since is None else rows[-1].checkpoint
+
+
+# Batches get their own pool, so an hours-long batch never holds the general job slots
+batch_runner = JobRunner(concurrency=IP_BATCH_JOBS, kinds=(BATCH_JOB_KIND,))
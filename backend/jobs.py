@@ -0,0 +1,307 @@
+import os
+import uuid
+import socket
+import asyncio
+import datetime
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from fastapi import HTTPException
+from sqlalchemy import select, update, or_, and_, true, exists
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal
+import models
+
+# Configuration
+JOB_RUNNER_ENABLED = os.getenv("JOB_RUNNER_ENABLED", "true").lower() in ("1", "true", "yes")
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "2"))  # jobs run at once per process
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+TERMINAL_STATUSES = (JOB_SUCCEEDED, JOB_FAILED)
+
+# A handler receives its own session and the job payload and returns a JSON-able result
+JobHandler = Callable[[AsyncSession, Dict[str, Any]], Awaitable[Any]]
+_handlers: Dict[str, JobHandler] = {}
+# Kinds served by a dedicated runner (see JobRunner `kinds`); the general runner skips them
+_dedicated_kinds: Set[str] = set()
+_runners: List["JobRunner"] = []
+# The claim (job id, runner, claim time) the current handler task runs under
+_current_claim: ContextVar[Optional[Tuple[str, str, datetime.datetime]]] = ContextVar("current_claim", default=None)
+
+
+def job_handler(kind: str):
+    """Register the coroutine that executes jobs of `kind`."""
+    def decorator(fn: JobHandler) -> JobHandler:
+        _handlers[kind] = fn
+        return fn
+    return decorator
+
+
+async def submit_job(db: AsyncSession, kind: str, payload: Dict[str, Any], priority: int = 0) -> models.Job:
+    if kind not in _handlers:
+        raise HTTPException(status_code=500, detail=f"No job handler registered for '{kind}'")
+    job = models.Job(id=uuid.uuid4().hex, kind=kind, status=JOB_QUEUED, priority=priority, payload=payload, attempts=0)
+    db.add(job)
+    await db.commit()
+    for runner in _runners:
+        runner.notify()
+    return job
+
+
+def claim_held():
+    """
+    SQL condition for fencing a handler's own writes: true while the runner still holds
+    the claim the handler was started under (always true outside a job). Once the lease
+    is lost and the job claimed again, writes made by the abandoned handler match nothing.
+    """
+    claim = _current_claim.get()
+    if claim is None:
+        return true()
+    job_id, worker_id, started_at = claim
+    return exists().where(models.Job.id == job_id, models.Job.locked_by == worker_id,
+                          models.Job.started_at == started_at)
+
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.utcnow()
+
+
+class JobRunner:
+    """
+    Database-backed job queue consumer.
+
+    Each process runs JOB_CONCURRENCY loops that claim the oldest queued job with a
+    conditional UPDATE, so several gunicorn workers (or a separate `python worker.py`)
+    can share one queue. A running job holds a lease renewed by a heartbeat; if its
+    process dies the lease expires and another runner picks the job up again, up to
+    JOB_MAX_ATTEMPTS times. A runner that cannot renew a lease (or finds it taken over)
+    cancels the job's handler before the lease runs out, so a job never runs twice at once.
+    Jobs live in the database, so nothing is lost on restart.
+
+    A runner created with `kinds` only claims those kinds, giving long-running work its
+    own bounded pool; the general runner (no `kinds`) leaves them alone.
+    """
+
+    def __init__(self, concurrency: int = JOB_CONCURRENCY, poll_interval: float = JOB_POLL_INTERVAL,
+                 lease_seconds: float = JOB_LEASE_SECONDS, max_attempts: int = JOB_MAX_ATTEMPTS,
+                 kinds: Optional[Tuple[str, ...]] = None):
+        self.kinds = kinds
+        if kinds:
+            _dedicated_kinds.update(kinds)
+        _runners.append(self)
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._changed: Optional[asyncio.Event] = None
+        self.counters = {"claimed": 0, "succeeded": 0, "failed": 0, "retried": 0, "running": 0}
+
+    def start(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"  # after fork
+        self._wakeup = asyncio.Event()
+        self._changed = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker_loop()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Hand interrupted jobs straight back to the queue instead of waiting for the lease to expire
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(models.Job)
+                .where(models.Job.status == JOB_RUNNING, models.Job.locked_by == self.worker_id)
+                .values(status=JOB_QUEUED, locked_by=None, lease_expires_at=None, attempts=models.Job.attempts - 1)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+    def notify(self):
+        """Wake idle loops in this process (other processes notice on their next poll)."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def wait_for_change(self, timeout: float):
+        """Sleep until a job in this process changes state, or `timeout` elapses."""
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": bool(self._tasks),
+            "worker_id": self.worker_id,
+            "kinds": list(self.kinds) if self.kinds else None,
+            "concurrency": self.concurrency,
+            **self.counters,
+        }
+
+    # --- Internals ---
+
+    def _kind_filter(self):
+        if self.kinds:
+            return models.Job.kind.in_(self.kinds)
+        return models.Job.kind.not_in(_dedicated_kinds) if _dedicated_kinds else true()
+
+    def _signal_change(self):
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = asyncio.Event()
+
+    async def _worker_loop(self):
+        while True:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                print(f"Job claim failed: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _claim(self) -> Optional[models.Job]:
+        now = _utcnow()
+        claimable = and_(self._kind_filter(), or_(
+            models.Job.status == JOB_QUEUED,
+            and_(models.Job.status == JOB_RUNNING, models.Job.lease_expires_at < now),
+        ))
+        async with AsyncSessionLocal() as db:
+            candidates = (await db.scalars(
+                select(models.Job.id).where(claimable)
+                .order_by(models.Job.priority, models.Job.created_at)
+                .limit(5)
+            )).all()
+            for job_id in candidates:
+                # Conditional update: only one runner wins the race for a given job
+                claimed = await db.execute(
+                    update(models.Job)
+                    .where(models.Job.id == job_id, claimable)
+                    .values(
+                        status=JOB_RUNNING,
+                        locked_by=self.worker_id,
+                        lease_expires_at=now + datetime.timedelta(seconds=self.lease_seconds),
+                        attempts=models.Job.attempts + 1,
+                        started_at=now,
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+                if claimed.rowcount == 1:
+                    self.counters["claimed"] += 1
+                    return await db.get(models.Job, job_id)
+        return None
+
+    async def _run(self, job: models.Job):
+        self.counters["running"] += 1
+        self._signal_change()
+        heartbeat = asyncio.create_task(self._heartbeat(job.id))
+        try:
+            handler = _handlers.get(job.kind)
+            if handler is None:
+                raise HTTPException(status_code=500, detail=f"No job handler registered for '{job.kind}'")
+            if job.attempts > self.max_attempts:
+                raise HTTPException(status_code=500, detail=f"Gave up after {self.max_attempts} attempts")
+            async with AsyncSessionLocal() as db:
+                claim = _current_claim.set((job.id, self.worker_id, job.started_at))
+                try:
+                    work = asyncio.create_task(handler(db, job.payload or {}))  # runs under the claim
+                finally:
+                    _current_claim.reset(claim)
+                try:
+                    await asyncio.wait((work, heartbeat), return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    if not work.done():
+                        work.cancel()  # shutdown, or the heartbeat lost the lease
+                        await asyncio.gather(work, return_exceptions=True)
+            if work.cancelled():
+                # Another runner owns (or may claim) the job now; leave the outcome to it
+                print(f"Job {job.id} ({job.kind}) abandoned: its lease could not be renewed")
+                return
+            result = work.result()
+            await self._finish(job.id, JOB_SUCCEEDED, result=result)
+        except asyncio.CancelledError:
+            raise  # shutdown; stop() requeues the job
+        except HTTPException as e:
+            # Deterministic failure (bad input, upstream gave up after its own retries)
+            await self._finish(job.id, JOB_FAILED, error=str(e.detail))
+        except Exception as e:
+            print(f"Job {job.id} ({job.kind}) failed (Attempt {job.attempts}): {e}")
+            if job.attempts < self.max_attempts:
+                await self._requeue(job.id)
+            else:
+                await self._finish(job.id, JOB_FAILED, error=str(e))
+        finally:
+            heartbeat.cancel()
+            self.counters["running"] -= 1
+            self._signal_change()
+
+    async def _heartbeat(self, job_id: str):
+        """Renews the lease until cancelled; returns once it is lost (taken over, or about to expire unrenewed)."""
+        loop = asyncio.get_running_loop()
+        interval = self.lease_seconds / 3
+        expires = loop.time() + self.lease_seconds
+        while True:
+            await asyncio.sleep(interval)
+            attempted = loop.time()
+            try:
+                async with AsyncSessionLocal() as db:
+                    renewed = await db.execute(
+                        update(models.Job)
+                        .where(models.Job.id == job_id, models.Job.locked_by == self.worker_id)
+                        .values(lease_expires_at=_utcnow() + datetime.timedelta(seconds=self.lease_seconds))
+                        .execution_options(synchronize_session=False)
+                    )
+                    await db.commit()
+            except Exception as e:
+                print(f"Lease renewal for job {job_id} failed: {e}")
+                if loop.time() + interval >= expires:
+                    return
+                continue
+            if renewed.rowcount == 0:
+                return
+            expires = attempted + self.lease_seconds
+
+    async def _finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None):
+        self.counters["succeeded" if status == JOB_SUCCEEDED else "failed"] += 1
+        async with AsyncSessionLocal() as db:
+            # Fenced on locked_by: a runner whose lease was taken over must not overwrite the new owner
+            await db.execute(
+                update(models.Job)
+                .where(models.Job.id == job_id, models.Job.locked_by == self.worker_id)
+                .values(status=status, result=result, error=error, finished_at=_utcnow(), lease_expires_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+    async def _requeue(self, job_id: str):
+        self.counters["retried"] += 1
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(models.Job)
+                .where(models.Job.id == job_id, models.Job.locked_by == self.worker_id)
+                .values(status=JOB_QUEUED, locked_by=None, lease_expires_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        self.notify()
+
+
+# Shared instance (one per process)
+job_runner = JobRunner()
@@ -0,0 +1,239 @@
+import json
+import orjson
+from typing import Any, Dict, Iterable, List, Tuple
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one server-sent event with a JSON data line."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def json_object(values: Dict[str, Any], raw: Iterable[str] = ()) -> bytes:
+    """
+    Serialize a flat object with orjson. Values of the keys in `raw` are JSON text
+    already (e.g. a stored JSON column) and are spliced in as-is, without a parse.
+    """
+    raw = set(raw)
+    members = []
+    for key, value in values.items():
+        if key in raw and value is not None:
+            encoded = value.encode("utf-8") if isinstance(value, str) else value
+        else:
+            encoded = orjson.dumps(value)
+        members.append(orjson.dumps(key) + b":" + encoded)
+    return b"{" + b",".join(members) + b"}"
+
+
+class IncrementalObjectParser:
+    """
+    Incremental parser for a streamed top-level JSON object.
+
+    Feed it text chunks as they arrive; each call to feed() returns the
+    (key, value) pairs of top-level fields that became complete in that chunk.
+    Nested objects/arrays are reported whole once their closing bracket arrives,
+    strings as soon as the closing quote arrives. Anything before the first '{'
+    (code fences, stray prose) is ignored. A field that is not valid JSON (e.g. a
+    trailing comma) is skipped and `broken` is set: parse `text` with repair_json then.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+        self.broken = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect = "start"  # start -> key -> colon -> value -> after -> key ...
+        self._key = None
+        self._token_start = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self.text += chunk
+        completed = []
+        text = self.text
+
+        while self._pos < len(text) and not self.done:
+            ch = text[self._pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        raw = text[self._token_start:self._pos + 1]
+                        if self._expect == "key":
+                            try:
+                                self._key = json.loads(raw)
+                            except ValueError:
+                                self._key = None
+                                self.broken = True
+                            self._expect = "colon"
+                        elif self._expect == "value":
+                            completed.extend(self._complete(raw))
+                self._pos += 1
+                continue
+
+            if self._expect == "start":
+                if ch == "{":
+                    self._depth = 1
+                    self._expect = "key"
+            elif ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect in ("key", "value"):
+                    self._token_start = self._pos
+            elif ch in "{[":
+                if self._depth == 1 and self._expect == "value":
+                    self._token_start = self._pos
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._expect == "value":
+                    completed.extend(self._complete(text[self._token_start:self._pos + 1]))
+                elif self._depth == 0:
+                    # Scalar (number/bool/null) terminated by the closing brace
+                    if self._expect == "value" and self._token_start is not None:
+                        completed.extend(self._complete(text[self._token_start:self._pos]))
+                    self.done = True
+            elif self._depth == 1:
+                if ch == ":" and self._expect == "colon":
+                    self._expect = "value"
+                    self._token_start = None
+                elif ch == ",":
+                    if self._expect == "value" and self._token_start is not None:
+                        completed.extend(self._complete(text[self._token_start:self._pos]))
+                    self._expect = "key"
+                elif not ch.isspace() and self._expect == "value" and self._token_start is None:
+                    self._token_start = self._pos
+
+            self._pos += 1
+
+        return completed
+
+    def _complete(self, raw: str) -> List[Tuple[str, Any]]:
+        key = self._key
+        self._key = None
+        self._token_start = None
+        self._expect = "after"
+        try:
+            value = json.loads(raw.strip())
+        except ValueError:
+            self.broken = True
+            return []
+        if key is None:
+            return []
+        self.fields[key] = value
+        return [(key, value)]
+
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def repair_json(text: str) -> Any:
+    """
+    Parse the JSON object/array in `text`, fixing the faults LLMs typically make:
+    code fences or prose around it, trailing commas, // and /* */ comments, raw newlines
+    inside strings, and truncation (unterminated strings, dangling keys, missing closing
+    brackets). Each '{' or '[' is tried in turn, so brackets in leading prose ("see [1]")
+    are skipped; an object is preferred over an array found before it. Raises
+    json.JSONDecodeError (a ValueError) if there is nothing that can be made into JSON.
+    """
+    fallback = None
+    skip_to = 0
+    for start, ch in enumerate(text):
+        if ch not in _CLOSERS or start < skip_to:
+            continue
+        try:
+            value, end = json.JSONDecoder().raw_decode(text, start)  # valid JSON, trailing prose ignored
+        except json.JSONDecodeError:
+            try:
+                value, end = json.loads(_repair(text[start:])), start + 1
+            except ValueError:
+                continue
+        if isinstance(value, dict):
+            return value
+        if fallback is None:
+            fallback = value
+        skip_to = end  # brackets inside an array already parsed are not candidates of their own
+    if fallback is None:
+        raise json.JSONDecodeError("No JSON object found in model output", text, 0)
+    return fallback
+
+
+def _repair(text: str) -> str:
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = False
+    escape = False
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            elif ch == "\n":
+                ch = "\\n"
+            out.append(ch)
+        elif ch == '"':
+            in_string = True
+            out.append(ch)
+        elif text.startswith("//", i):
+            end = text.find("\n", i)
+            i = len(text) if end < 0 else end
+            continue
+        elif text.startswith("/*", i):
+            end = text.find("*/", i)
+            i = len(text) if end < 0 else end + 2
+            continue
+        elif ch in _CLOSERS:
+            stack.append(_CLOSERS[ch])
+            out.append(ch)
+        elif ch in "}]":
+            if not stack:
+                break
+            _drop_trailing_comma(out)
+            out.append(stack.pop())  # a mismatched closer is replaced by the expected one
+            if not stack:
+                break  # document complete; anything after it is prose
+        else:
+            out.append(ch)
+        i += 1
+
+    # Truncated output: close whatever is still open
+    if in_string:
+        if escape:
+            out.pop()
+        out.append('"')
+    if stack:
+        tail = "".join(out).rstrip()
+        if tail.endswith(":"):
+            out.append(" null")
+        elif stack[-1] == "}" and tail.endswith('"') and _dangling_key(tail):
+            out.append(": null")
+        _drop_trailing_comma(out)
+        out.extend(reversed(stack))
+    return "".join(out)
+
+
+def _drop_trailing_comma(out: List[str]):
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+def _dangling_key(tail: str) -> bool:
+    """True if the last string in an object is a key without a value ({"a": 1, "b")."""
+    pos = len(tail) - 2
+    while pos >= 0 and not (tail[pos] == '"' and tail[pos - 1] != "\\"):
+        pos -= 1
+    before = tail[:pos].rstrip()
+    return before.endswith(",") or before.endswith("{")
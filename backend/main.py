@@ -1,15 +1,60 @@
+import time
+STARTED = time.perf_counter()
+
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from database import engine, Base
-from routers import ip, benchmark, script, avatar
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from database import engine, async_engine, missing_tables
+from routers import ip, benchmark, script, avatar, stats, jobs, metrics, search
+from services import UpstreamHTTP
+from jobs import job_runner, JOB_RUNNER_ENABLED
+from media import shutdown_asr_pool
+from benchmark_search import SearchHTTP
+from avatar_render import RenderHTTP, render_runner
+from http_cache import CacheRefresh
+from ip_batch import batch_runner
+from telemetry import MetricsMiddleware, instrument_engine, start_tracing, stop_tracing, startup_profile
+
+# Schema changes are not made here: run `python migrate.py` (gunicorn_conf.py does it
+# once in the master before forking), so starting workers never race on them.
+startup_profile.mark("imports", since=STARTED)
+
+# Query timings for both engines (scripts and job code use the sync one)
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
 
-# Create DB Tables
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Tracing and the pooled upstream client are per worker, set up after fork
+    start_tracing()
+    UpstreamHTTP.start()
+    if JOB_RUNNER_ENABLED:
+        job_runner.start()
+        render_runner.start()
+        batch_runner.start()
+    startup_profile.mark("lifespan")
+    startup_profile.finish()
+    yield
+    await job_runner.stop()
+    await render_runner.stop()
+    await batch_runner.stop()
+    shutdown_asr_pool()
+    await UpstreamHTTP.stop()
+    await SearchHTTP.stop()
+    await RenderHTTP.stop()
+    await CacheRefresh.stop()
+    await async_engine.dispose()
+    stop_tracing()
 
-app = FastAPI(title="AI Self-Media Workbench Demo")
+# orjson serializes response bodies several times faster than the stdlib encoder
+app = FastAPI(title="AI Self-Media Workbench Demo", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # CORS Setup
 app.add_middleware(
@@ -18,14 +63,50 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+# Outermost, so latency covers everything down the stack
+app.add_middleware(MetricsMiddleware)
 
 # Include Routers
 app.include_router(ip.router)
 app.include_router(benchmark.router)
 app.include_router(script.router)
 app.include_router(avatar.router)
+app.include_router(stats.router)
+app.include_router(jobs.router)
+app.include_router(search.router)
+app.include_router(metrics.router)
+
+startup_profile.mark("app")
+
+# Schema state is only re-read until it has been seen complete once
+_schema_ready = False
 
 @app.get("/")
 def read_root():
+    # Liveness: the process is up and serving
     return {"message": "AI Self-Media Workbench API is running"}
+
+@app.get("/ready")
+async def readiness(response: Response):
+    """Readiness: startup finished, database reachable and migrated. 503 until all hold."""
+    global _schema_ready
+    checks = {"startup": startup_profile.ready, "database": False, "schema": _schema_ready}
+    missing = []
+    try:
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            checks["database"] = True
+            if not _schema_ready:
+                missing = await conn.run_sync(missing_tables)
+                _schema_ready = checks["schema"] = not missing
+    except SQLAlchemyError as e:
+        print(f"Readiness check failed: {e}")
+    ready = all(checks.values())
+    if not ready:
+        response.status_code = 503
+    body = {"ready": ready, "checks": checks, "pid": os.getpid(), "startup": startup_profile.as_dict()}
+    if missing:
+        body["missing_tables"] = missing
+    return body
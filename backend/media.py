@@ -0,0 +1,425 @@
+import os
+import re
+import uuid
+import shutil
+import asyncio
+import hashlib
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional, Tuple
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from multipart.multipart import MultipartParser, parse_options_header
+from http_cache import etag_matches
+
+# Configuration
+MEDIA_STORE_DIR = os.getenv("MEDIA_STORE_DIR", "./media")
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(2 * 1024 ** 3)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+ASR_BACKEND = os.getenv("ASR_BACKEND", "mock")  # "mock" or "package.module:ClassName"
+ASR_WORKERS = int(os.getenv("ASR_WORKERS", "2"))
+ASR_SEGMENT_SECONDS = int(os.getenv("ASR_SEGMENT_SECONDS", "30"))
+ASR_SEGMENT_BYTES = int(os.getenv("ASR_SEGMENT_BYTES", str(4 * 1024 * 1024)))  # when no decoder is available
+ASR_MAX_PENDING_SEGMENTS = int(os.getenv("ASR_MAX_PENDING_SEGMENTS", str(ASR_WORKERS * 2)))  # per pipeline
+FFMPEG_BIN = os.getenv("FFMPEG_BIN") or shutil.which("ffmpeg")
+
+# Audio handed to ASR: 16 kHz mono signed 16-bit PCM
+PCM_SAMPLE_RATE = 16000
+PCM_BYTES_PER_SECOND = PCM_SAMPLE_RATE * 2
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+# --- Content-addressed storage ---
+
+class StoreWriter:
+    """Streams one blob into the store, hashing as it goes; the final name is its SHA-256."""
+
+    def __init__(self, store: "ContentStore", max_bytes: int):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._tmp_path = os.path.join(store.tmp_dir, uuid.uuid4().hex)
+        self._file = open(self._tmp_path, "wb")
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            self.abort()
+            raise HTTPException(status_code=413, detail=f"Upload exceeds {self.max_bytes} bytes")
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def commit(self) -> str:
+        self._file.close()
+        sha256 = self._hash.hexdigest()
+        path = self.store.path_for(sha256)
+        if os.path.exists(path):
+            os.remove(self._tmp_path)  # identical content already stored
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self._tmp_path, path)
+        return sha256
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class ContentStore:
+    def __init__(self, root: str = MEDIA_STORE_DIR):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+
+    def path_for(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self.path_for(sha256))
+
+    def open_writer(self, max_bytes: int = UPLOAD_MAX_BYTES) -> StoreWriter:
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        return StoreWriter(self, max_bytes)
+
+
+content_store = ContentStore()
+
+
+# --- ASR backends (run inside the process pool) ---
+
+class ASRBackend:
+    """Transcribes one segment of 16 kHz mono PCM (or raw bytes when no decoder is installed)."""
+
+    def transcribe_segment(self, audio: bytes, index: int, start_seconds: float) -> str:
+        raise NotImplementedError
+
+
+class MockASRBackend(ASRBackend):
+    """Local stand-in: deterministic text per segment, no model required."""
+
+    def transcribe_segment(self, audio: bytes, index: int, start_seconds: float) -> str:
+        return f"[{int(start_seconds) // 60:02d}:{int(start_seconds) % 60:02d}] This is a transcript from the uploaded video file..."
+
+
+_backend_instance: Optional[ASRBackend] = None
+
+
+def load_asr_backend(spec: str) -> ASRBackend:
+    if spec == "mock":
+        return MockASRBackend()
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def _transcribe_in_worker(spec: str, audio: bytes, index: int, start_seconds: float) -> str:
+    global _backend_instance
+    if _backend_instance is None:
+        _backend_instance = load_asr_backend(spec)  # loaded once per pool process
+    return _backend_instance.transcribe_segment(audio, index, start_seconds)
+
+
+_asr_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_asr_pool() -> ProcessPoolExecutor:
+    global _asr_pool
+    if _asr_pool is None:
+        # spawn, not fork: the web worker is multi-threaded by the time this runs
+        _asr_pool = ProcessPoolExecutor(max_workers=ASR_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _asr_pool
+
+
+def shutdown_asr_pool():
+    global _asr_pool
+    if _asr_pool is not None:
+        _asr_pool.shutdown(wait=False, cancel_futures=True)
+        _asr_pool = None
+
+
+class TranscriptionPipeline:
+    """
+    Cuts an audio byte stream into fixed-size segments and transcribes each one in
+    the ASR process pool as soon as it is complete, while more audio keeps arriving.
+    At most `max_pending` segments are queued or running at once; feed() waits for
+    one to finish before submitting another, which slows the producer down.
+    """
+
+    def __init__(self, segment_bytes: int, bytes_per_second: Optional[int] = None, backend: str = ASR_BACKEND,
+                 max_pending: int = ASR_MAX_PENDING_SEGMENTS):
+        self.segment_bytes = segment_bytes
+        self.bytes_per_second = bytes_per_second
+        self.backend = backend
+        self.max_pending = max(1, max_pending)
+        self._buffer = bytearray()
+        self._futures: List[asyncio.Future] = []
+        self._consumed = 0
+
+    async def feed(self, chunk: bytes):
+        self._buffer += chunk
+        while len(self._buffer) >= self.segment_bytes:
+            segment = bytes(self._buffer[:self.segment_bytes])
+            del self._buffer[:self.segment_bytes]
+            await self._submit(segment)
+
+    async def finish(self) -> str:
+        if self._buffer or not self._futures:
+            await self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        segments = await asyncio.gather(*self._futures)
+        return "\n".join(segment for segment in segments if segment)
+
+    def cancel(self):
+        for future in self._futures:
+            future.cancel()
+
+    async def _submit(self, audio: bytes):
+        pending = [future for future in self._futures if not future.done()]
+        if len(pending) >= self.max_pending:
+            await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        index = len(self._futures)
+        start = self._consumed / self.bytes_per_second if self.bytes_per_second else index * ASR_SEGMENT_SECONDS
+        self._consumed += len(audio)
+        loop = asyncio.get_running_loop()
+        self._futures.append(loop.run_in_executor(get_asr_pool(), _transcribe_in_worker, self.backend, audio, index, start))
+
+
+def audio_decoder_available() -> bool:
+    return bool(FFMPEG_BIN)
+
+
+def live_pipeline() -> Optional[TranscriptionPipeline]:
+    """Pipeline fed with upload bytes as they arrive; only used when there is no decoder to run afterwards."""
+    return None if audio_decoder_available() else TranscriptionPipeline(ASR_SEGMENT_BYTES)
+
+
+async def iter_audio(path: str) -> AsyncIterator[bytes]:
+    """Decoded PCM from a stored media file via ffmpeg, streamed as it is produced."""
+    proc = await asyncio.create_subprocess_exec(
+        FFMPEG_BIN, "-nostdin", "-loglevel", "error", "-i", path,
+        "-vn", "-f", "s16le", "-ac", "1", "-ar", str(PCM_SAMPLE_RATE), "pipe:1",
+        stdout=asyncio.subprocess.PIPE,
+    )
+    try:
+        while True:
+            chunk = await proc.stdout.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+        await proc.wait()
+
+
+async def transcribe_file(path: str) -> str:
+    if audio_decoder_available():
+        pipeline = TranscriptionPipeline(ASR_SEGMENT_SECONDS * PCM_BYTES_PER_SECOND, PCM_BYTES_PER_SECOND)
+        async for chunk in iter_audio(path):
+            await pipeline.feed(chunk)
+    else:
+        pipeline = TranscriptionPipeline(ASR_SEGMENT_BYTES)
+        with open(path, "rb") as f:
+            while chunk := await asyncio.to_thread(f.read, UPLOAD_CHUNK_SIZE):
+                await pipeline.feed(chunk)
+    return await pipeline.finish()
+
+
+# --- Streaming upload ingestion ---
+
+@dataclass
+class StoredUpload:
+    filename: str
+    sha256: str
+    size: int
+
+
+class _MultipartFileReceiver:
+    """Feeds the `file` part of a multipart body to a callback without spooling it."""
+
+    def __init__(self, boundary: bytes, on_data):
+        self.filename: Optional[str] = None
+        self.found = False
+        self._on_data = on_data
+        self._header_field = b""
+        self._header_value = b""
+        self._disposition = None
+        self._in_file = False
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": self._part_begin,
+            "on_header_field": self._header_field_data,
+            "on_header_value": self._header_value_data,
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        })
+
+    def _part_begin(self):
+        self._disposition = None
+        self._in_file = False
+
+    def _header_field_data(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _header_value_data(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _header_end(self):
+        if self._header_field.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _headers_finished(self):
+        if self._disposition is None or self.found:
+            return
+        _, params = parse_options_header(self._disposition)
+        if params.get(b"name") == b"file" and b"filename" in params:
+            self.filename = params[b"filename"].decode("utf-8", "replace")
+            self._in_file = True
+            self.found = True
+
+    def _part_data(self, data, start, end):
+        if self._in_file:
+            self._on_data(data[start:end])
+
+    def _part_end(self):
+        self._in_file = False
+
+
+def request_has_upload(request: Request) -> bool:
+    content_type = request.headers.get("content-type", "")
+    return content_type.startswith("multipart/form-data") or int(request.headers.get("content-length") or 0) > 0
+
+
+async def receive_upload(request: Request, pipeline: Optional[TranscriptionPipeline] = None,
+                         filename: Optional[str] = None, store: ContentStore = content_store) -> StoredUpload:
+    """
+    Reads the request body chunk by chunk into the content store.
+    Accepts either multipart/form-data with a `file` field or a raw body (filename
+    from the `filename` argument). Body chunks are collected up to UPLOAD_CHUNK_SIZE,
+    then hashed and written in a worker thread and, if a pipeline is given, fed to
+    ASR before more of the body is read.
+    """
+    writer = store.open_writer()
+    pending: List[bytes] = []
+    pending_size = 0
+
+    def on_data(chunk: bytes):
+        nonlocal pending_size
+        pending.append(chunk)
+        pending_size += len(chunk)
+
+    async def flush():
+        nonlocal pending_size
+        data = b"".join(pending)
+        pending.clear()
+        pending_size = 0
+        await asyncio.to_thread(writer.write, data)
+        if pipeline is not None:
+            await pipeline.feed(data)
+
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    receiver = None
+    if content_type == b"multipart/form-data":
+        if b"boundary" not in params:
+            writer.abort()
+            raise HTTPException(status_code=400, detail="Multipart body without boundary")
+        receiver = _MultipartFileReceiver(params[b"boundary"], on_data)
+
+    try:
+        async for chunk in request.stream():
+            if receiver is not None:
+                receiver.parser.write(chunk)
+            else:
+                on_data(chunk)
+            if pending_size >= UPLOAD_CHUNK_SIZE:
+                await flush()
+        if receiver is not None:
+            receiver.parser.finalize()
+            if not receiver.found:
+                raise HTTPException(status_code=400, detail="Multipart body has no 'file' field")
+            filename = receiver.filename
+        if pending:
+            await flush()
+    except BaseException:
+        writer.abort()
+        if pipeline is not None:
+            pipeline.cancel()
+        raise
+
+    if writer.size == 0:
+        writer.abort()
+        raise HTTPException(status_code=400, detail="Uploaded file is empty")
+    sha256 = await asyncio.to_thread(writer.commit)
+    return StoredUpload(filename=filename or sha256, sha256=sha256, size=writer.size)
+
+
+# --- Serving stored files ---
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    (start, end), inclusive, for a single `Range: bytes=...` header; None to send the whole
+    file (no header, several ranges or a form we do not handle). 416 if it starts past the end.
+    """
+    match = RANGE_PATTERN.match(header.strip()) if header else None
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if end < start and start < size:
+            return None
+    else:
+        start, end = max(size - int(last), 0), size - 1  # suffix: the last N bytes
+        if int(last) == 0:
+            start = size
+    if start >= size:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+async def _iter_file(path: str, start: int, length: int) -> AsyncIterator[bytes]:
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = await asyncio.to_thread(f.read, min(UPLOAD_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def stored_file_response(request: Request, sha256: str, media_type: str, store: ContentStore = content_store) -> Response:
+    """
+    Streams a blob from the store with HTTP range support (206 / 416, If-Range) so players
+    can seek and downloads can resume. Blobs are content-addressed, hence immutable: the
+    hash is the ETag and clients may cache them indefinitely.
+    """
+    path = store.path_for(sha256)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="File not found")
+    size = os.path.getsize(path)
+    etag = f'"{sha256}"'
+    headers = {"Accept-Ranges": "bytes", "ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if request.headers.get("if-range", etag) == etag:  # a stale If-Range gets the whole file
+        byte_range = parse_range(request.headers.get("range"), size)
+    start, end = byte_range or (0, size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    body = _iter_file(path, start, end - start + 1) if request.method != "HEAD" else iter(())
+    return StreamingResponse(body, status_code=206 if byte_range else 200, media_type=media_type, headers=headers)
@@ -0,0 +1,38 @@
+"""
+Creates or updates the database schema. Run once per deploy, before the web workers start:
+
+    python migrate.py && gunicorn -c gunicorn_conf.py main:app
+
+gunicorn_conf.py also runs it in the master process before forking workers
+(MIGRATE_ON_START, on by default), so the workers never race on schema changes.
+
+    python migrate.py --reindex   # also rebuild the full-text search index
+    python migrate.py --reembed   # also recompute script embeddings (after changing SIMILARITY_*)
+    python migrate.py --dedupe    # delete rows blocking a new unique index (all but the newest per key)
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import sys
+import time
+from sqlalchemy.engine import make_url
+from database import engine, migrate, DuplicateRowsError, SQLALCHEMY_DATABASE_URL
+
+def run(reindex: bool = False, reembed: bool = False, dedupe: bool = False):
+    started = time.perf_counter()
+    migrate(engine, dedupe)
+    if reindex:
+        import search_index
+        print(f"Rebuilt search index: {search_index.reindex(engine)}")
+    if reembed:
+        import similarity
+        print(f"Re-embedded {similarity.backfill_embeddings(engine, rebuild=True)} scripts")
+    engine.dispose()  # do not hand open connections to forked workers
+    url = make_url(SQLALCHEMY_DATABASE_URL).render_as_string(hide_password=True)
+    print(f"Schema up to date on {url} ({time.perf_counter() - started:.2f}s)")
+
+if __name__ == "__main__":
+    try:
+        run(reindex="--reindex" in sys.argv[1:], reembed="--reembed" in sys.argv[1:], dedupe="--dedupe" in sys.argv[1:])
+    except DuplicateRowsError as e:
+        sys.exit(str(e))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, JSON, DateTime
+from sqlalchemy import Column, Boolean, Integer, Float, String, Text, ForeignKey, JSON, DateTime, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -7,14 +7,22 @@ class IPProfile(Base):
     __tablename__ = "ip_profiles"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_input = Column(JSON)  # Stores initial user input (Legacy)
+    user_input = Column(JSON)  # Legacy duplicate of input_json; no longer written
     input_json = Column(JSON)  # Stores full input JSON
     result_json = Column(JSON) # Stores full AI result JSON
+    result_version = Column(Integer)  # schemas.IP_RESULT_VERSION result_json was validated against; NULL = legacy
     persona = Column(String)   # Kept for backward compatibility or summary
     audience = Column(String)
     content_pillars = Column(JSON)
     usp = Column(String)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime)  # last edit of the result; with created_at, the ETag of the detail page
+
+    __table_args__ = (
+        # Covering index for keyset-paginated history: (created_at, id) order plus the
+        # one-liner (persona), so history pages never touch the JSON blobs
+        Index("ix_ip_profiles_history", "created_at", "id", "persona"),
+    )
 
 class BenchmarkAccount(Base):
     __tablename__ = "benchmark_accounts"
@@ -27,7 +35,17 @@ class BenchmarkAccount(Base):
     profile_url = Column(String)
     analysis_reason = Column(Text)
     learning_points = Column(Text)
+    follower_count = Column(Integer)
+    like_count = Column(Integer)
+    video_count = Column(Integer)
+    engagement_score = Column(Float)  # rank score from the latest search that returned the account
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime)
+
+    __table_args__ = (
+        # One row per account; repeat searches update it instead of adding duplicates
+        Index("ux_benchmark_accounts_platform_user", "platform", "user_id", unique=True),
+    )
 
 class VideoScript(Base):
     __tablename__ = "video_scripts"
@@ -36,10 +54,18 @@ class VideoScript(Base):
     source_type = Column(String)  # 'link' or 'upload'
     source_content = Column(String)  # URL or filename
     transcript = Column(Text)
+    content_hash = Column(String)  # SHA-256 of the uploaded file in the media store
+    source_key = Column(String)  # 'douyin:<video id>', 'url:<normalized url>' or 'sha256:<content hash>'
+    embedding = Column(LargeBinary)  # similarity.embed(transcript), float32; finds near-duplicate scripts
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     
     rewrites = relationship("RewriteVersion", back_populates="original_script")
 
+    __table_args__ = (
+        # One transcript per source: repeat extracts of the same video return the stored row
+        Index("ux_video_scripts_source_key", "source_key", unique=True),
+    )
+
 class RewriteVersion(Base):
     __tablename__ = "rewrite_versions"
 
@@ -50,3 +76,102 @@ class RewriteVersion(Base):
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
     original_script = relationship("VideoScript", back_populates="rewrites")
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True)  # uuid4 hex
+    kind = Column(String, nullable=False)  # e.g. 'ip.generate', 'script.rewrite'
+    status = Column(String, nullable=False, default="queued")  # queued / running / succeeded / failed
+    priority = Column(Integer, nullable=False, default=0)  # lower runs first
+    payload = Column(JSON)
+    result = Column(JSON)
+    error = Column(Text)
+    attempts = Column(Integer, nullable=False, default=0)
+    locked_by = Column(String)  # runner holding the lease
+    lease_expires_at = Column(DateTime)  # running jobs past this are reclaimed
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_jobs_claim", "status", "priority", "created_at"),
+    )
+
+class AvatarRender(Base):
+    __tablename__ = "avatar_renders"
+
+    id = Column(Integer, primary_key=True, index=True)
+    render_key = Column(String, nullable=False)  # SHA-256 over (text, avatar_id, voice_id)
+    text = Column(Text)
+    avatar_id = Column(String)
+    voice_id = Column(String)
+    renderer = Column(String)
+    status = Column(String, nullable=False, default="queued")  # queued / submitted / rendering / downloading / succeeded / failed
+    progress = Column(Float, default=0.0)
+    upstream_task_id = Column(String)
+    job_id = Column(String)
+    content_hash = Column(String)  # finished video in the media store
+    size = Column(Integer)
+    error = Column(Text)
+    callback_at = Column(DateTime)  # last renderer webhook; wakes the polling job early
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        # One render per distinct input: identical requests share it
+        Index("ux_avatar_renders_render_key", "render_key", unique=True),
+    )
+
+class IPBatch(Base):
+    __tablename__ = "ip_batches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    filename = Column(String)
+    content_hash = Column(String, nullable=False)  # uploaded CSV/JSONL in the media store
+    input_format = Column(String, nullable=False)  # 'csv' or 'jsonl'
+    use_cache = Column(Boolean, default=True)  # reuse cached answers for inputs seen before
+    status = Column(String, nullable=False, default="queued")  # queued / running / succeeded / failed
+    total_rows = Column(Integer)
+    succeeded_rows = Column(Integer, nullable=False, default=0)
+    failed_rows = Column(Integer, nullable=False, default=0)
+    job_id = Column(String)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+class IPBatchRow(Base):
+    __tablename__ = "ip_batch_rows"
+
+    id = Column(Integer, primary_key=True, index=True)
+    batch_id = Column(Integer, ForeignKey("ip_batches.id"), nullable=False)
+    row = Column(Integer, nullable=False)  # CSV data row / JSONL line, from 1
+    status = Column(String, nullable=False)  # succeeded / failed
+    ip_profile_id = Column(Integer, ForeignKey("ip_profiles.id"))
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        # The batch's checkpoint: a row recorded here is never generated again
+        Index("ux_ip_batch_rows_row", "batch_id", "row", unique=True),
+    )
+
+class LLMUsage(Base):
+    __tablename__ = "llm_usage"
+
+    id = Column(Integer, primary_key=True, index=True)
+    endpoint = Column(String, nullable=False)  # e.g. 'ip.generate', 'ip.generate.stream'
+    template = Column(String)  # prompt template version, e.g. 'ip_positioning@v2'
+    model = Column(String)
+    status = Column(String)  # 'ok' or the upstream/transport error
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    cached_tokens = Column(Integer, default=0)  # prompt tokens served from the upstream prefix cache
+    latency_ms = Column(Float)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_llm_usage_endpoint_time", "endpoint", "created_at"),
+    )
@@ -1,10 +1,92 @@
-from fastapi import APIRouter
-import schemas
-from services import AvatarService
+import hmac
+import time
+import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db
+import models, schemas
+from jobs import job_handler
+from media import stored_file_response
+from avatar_render import (
+    RENDER_JOB_KIND, RENDER_SUCCEEDED, RENDER_FAILED, RENDER_MEDIA_TYPE, AVATAR_WEBHOOK_SECRET,
+    render_runner, request_render, run_render, notify_callback, webhook_token, video_url,
+)
 
 router = APIRouter(prefix="/api/avatar", tags=["avatar"])
 
-@router.post("/create", response_model=schemas.AvatarResponse)
-def create_avatar_video(input: schemas.AvatarCreateRequest):
-    video_url = AvatarService.create_video(input.text, input.avatar_id, input.voice_id)
-    return {"video_url": video_url}
+# Other processes' updates are only visible by re-reading the row
+RENDER_RECHECK_INTERVAL = 0.5
+
+def render_response(render: models.AvatarRender, cached: bool = False) -> schemas.AvatarRenderResponse:
+    return schemas.AvatarRenderResponse.model_validate(render).model_copy(update={
+        "video_url": video_url(render.id) if render.status == RENDER_SUCCEEDED else None,
+        "cached": cached,
+    })
+
+@router.post("/create", response_model=schemas.AvatarRenderResponse)
+async def create_avatar_video(input: schemas.AvatarCreateRequest, response: Response,
+                              wait: float = Query(0, ge=0, le=60), db: AsyncSession = Depends(get_db)):
+    """
+    Queues a render (or reuses an identical one) and returns its state: 200 with
+    `video_url` when finished, 202 while rendering. Poll GET /api/avatar/renders/{id},
+    or pass `wait` to hold the request up to that many seconds for the result.
+    """
+    render, cached = await request_render(db, input.text, input.avatar_id, input.voice_id)
+    if wait and render.status not in (RENDER_SUCCEEDED, RENDER_FAILED):
+        render = await wait_for_render(db, render.id, wait)
+    if render.status != RENDER_SUCCEEDED:
+        response.status_code = 202
+    return render_response(render, cached)
+
+@router.post("/create/async", response_model=schemas.JobResponse, status_code=202)
+async def create_avatar_video_async(input: schemas.AvatarCreateRequest, db: AsyncSession = Depends(get_db)):
+    # The render job; an identical earlier render returns its (possibly finished) job
+    render, _ = await request_render(db, input.text, input.avatar_id, input.voice_id)
+    job = await db.get(models.Job, render.job_id) if render.job_id else None
+    if not job:
+        raise HTTPException(status_code=404, detail="Render job not found")
+    return job
+
+@router.get("/renders/{id}", response_model=schemas.AvatarRenderResponse)
+async def get_render(id: int, wait: float = Query(0, ge=0, le=60), db: AsyncSession = Depends(get_db)):
+    render = await wait_for_render(db, id, wait)
+    return render_response(render)
+
+@router.api_route("/renders/{id}/video", methods=["GET", "HEAD"])
+async def get_render_video(id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    render = await db.get(models.AvatarRender, id)
+    if not render:
+        raise HTTPException(status_code=404, detail="Render not found")
+    if render.status != RENDER_SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Render is {render.status}")
+    return stored_file_response(request, render.content_hash, RENDER_MEDIA_TYPE)
+
+@router.post("/renders/{id}/webhook", status_code=204)
+async def render_webhook(id: int, token: str, body: Optional[schemas.AvatarWebhook] = None,
+                         db: AsyncSession = Depends(get_db)):
+    """Completion callback from the renderer; wakes the render job to poll the renderer now."""
+    render = await db.get(models.AvatarRender, id)
+    if not render or not AVATAR_WEBHOOK_SECRET or not hmac.compare_digest(token, webhook_token(render.render_key)):
+        raise HTTPException(status_code=404, detail="Render not found")
+    render.callback_at = datetime.datetime.utcnow()
+    await db.commit()
+    notify_callback(id)
+    return Response(status_code=204)
+
+async def wait_for_render(db: AsyncSession, id: int, timeout: float) -> models.AvatarRender:
+    """Long-poll: the render as soon as it finishes, or its current state after `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while True:
+        render = await db.get(models.AvatarRender, id, populate_existing=True)
+        if not render:
+            raise HTTPException(status_code=404, detail="Render not found")
+        remaining = deadline - time.monotonic()
+        if render.status in (RENDER_SUCCEEDED, RENDER_FAILED) or remaining <= 0:
+            return render
+        await db.rollback()  # end the read transaction so the next read sees new commits
+        await render_runner.wait_for_change(min(remaining, RENDER_RECHECK_INTERVAL))
+
+@job_handler(RENDER_JOB_KIND)
+async def run_render_job(db: AsyncSession, payload: dict):
+    return await run_render(db, payload["render_id"])
@@ -1,34 +1,71 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+import asyncio
+import datetime
+from fastapi import APIRouter, Depends
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-from database import get_db
+from database import get_db, bulk_upsert
 import models, schemas
-from services import DouyinService, AIService
+from services import AIService
+from benchmark_search import DEFAULT_PLATFORMS, search_accounts, rank_accounts
 
 router = APIRouter(prefix="/api/benchmark", tags=["benchmark"])
 
+# Refreshed on every search that finds the account; the AI analysis is kept from the first one
+BENCHMARK_UPDATE_COLUMNS = ["keyword", "account_name", "profile_url", "follower_count", "like_count",
+                            "video_count", "engagement_score", "updated_at"]
+
 @router.post("/search", response_model=List[schemas.BenchmarkAccountResponse])
-def search_benchmark(input: schemas.BenchmarkSearch, db: Session = Depends(get_db)):
-    # 1. Search Douyin via Service
-    accounts = DouyinService.search_accounts(input.keyword)
-    
-    results = []
-    for acc in accounts:
-        # 2. Generate AI Analysis
-        analysis = AIService.generate_benchmark_analysis(acc["account_name"])
-        
-        # 3. Save to DB
-        db_acc = models.BenchmarkAccount(
-            keyword=input.keyword,
-            account_name=acc["account_name"],
-            user_id=acc["user_id"],
-            profile_url=acc["profile_url"],
-            analysis_reason=analysis["analysis_reason"],
-            learning_points=analysis["learning_points"]
-        )
-        db.add(db_acc)
-        db.commit()
-        db.refresh(db_acc)
-        results.append(db_acc)
-        
-    return results
+async def search_benchmark(input: schemas.BenchmarkSearch, db: AsyncSession = Depends(get_db)):
+    # 1. Search every platform concurrently (each (platform, keyword) is cached with a TTL)
+    accounts, all_cached = await search_accounts(input.keyword, input.platforms or DEFAULT_PLATFORMS)
+    ranked = rank_accounts(accounts, input.keyword)
+    if not ranked:
+        return []
+
+    # 2. Accounts already stored (one row per platform + user_id)
+    keys = [(acc.platform, acc.user_id) for acc, _ in ranked]
+    result = await db.execute(
+        select(models.BenchmarkAccount).where(tuple_(models.BenchmarkAccount.platform, models.BenchmarkAccount.user_id).in_(keys))
+    )
+    stored = {(row.platform, row.user_id): row for row in result.scalars()}
+
+    # Repeat search inside the cache TTL: nothing new to analyze or write
+    if all_cached and len(stored) == len(keys):
+        return [stored[key] for key in keys]
+
+    # 3. Generate AI Analysis for new accounts only (concurrently)
+    new_accounts = [acc for acc, _ in ranked if (acc.platform, acc.user_id) not in stored]
+    analyses = await asyncio.gather(*[
+        run_in_threadpool(AIService.generate_benchmark_analysis, acc.account_name)
+        for acc in new_accounts
+    ])
+    analysis_by_key = {(acc.platform, acc.user_id): analysis for acc, analysis in zip(new_accounts, analyses)}
+
+    # 4. Insert or refresh all rows (one statement, one commit)
+    now = datetime.datetime.utcnow()
+    rows = []
+    for acc, score in ranked:
+        key = (acc.platform, acc.user_id)
+        analysis = analysis_by_key.get(key) or {
+            "analysis_reason": stored[key].analysis_reason, "learning_points": stored[key].learning_points,
+        }
+        rows.append({
+            "platform": acc.platform,
+            "keyword": input.keyword,
+            "account_name": acc.account_name,
+            "user_id": acc.user_id,
+            "profile_url": acc.profile_url,
+            "follower_count": acc.follower_count,
+            "like_count": acc.like_count,
+            "video_count": acc.video_count,
+            "engagement_score": score,
+            "analysis_reason": analysis["analysis_reason"],
+            "learning_points": analysis["learning_points"],
+            "created_at": now,
+            "updated_at": now,
+        })
+    saved = await bulk_upsert(db, models.BenchmarkAccount, rows, ["platform", "user_id"], BENCHMARK_UPDATE_COLUMNS)
+    by_key = {(row["platform"], row["user_id"]): row for row in saved}
+    return [by_key[key] for key in keys]
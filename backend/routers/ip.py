@@ -1,77 +1,277 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from database import get_db
+import json
+import base64
+import asyncio
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import Text, cast, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db, AsyncSessionLocal
 import models, schemas
 from services import AIService
-from typing import List
+from json_utils import sse_event, json_object
+from jobs import job_handler, submit_job
+from http_cache import CACHE_POLICIES, CacheRefresh, make_etag, not_modified, row_stamp
+from media import content_store, receive_upload, request_has_upload
+from ip_batch import (
+    BATCH_JOB_KIND, batch_format, inspect_input, create_batch, submit_batch, get_batch, resume_batch,
+    run_batch, iter_results, ip_profile_values, results_url,
+)
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 router = APIRouter(prefix="/api/ip", tags=["ip"])
 
+# Batch files are read from the raw request stream, so describe the body for the docs
+BATCH_UPLOAD_OPENAPI = {"requestBody": {"content": {
+    "multipart/form-data": {"schema": {"type": "object", "properties": {"file": {"type": "string", "format": "binary"}}}},
+    "text/csv": {"schema": {"type": "string"}},
+    "application/x-ndjson": {"schema": {"type": "string"}},
+}}}
+
+# IPProfileResponse fields in response order; the JSON columns among them are read as stored text
+IP_PROFILE_FIELDS = list(schemas.IPProfileResponse.model_fields)
+IP_JSON_FIELDS = {"input_json", "result_json", "content_pillars"}
+
 @router.post("/generate", response_model=schemas.IPProfileResponse)
-async def generate_ip(input: schemas.IPInput, db: Session = Depends(get_db)):
+async def generate_ip(
+    input: schemas.IPInput,
+    bypass_cache: bool = False,
+    refresh_cache: bool = False,
+    db: AsyncSession = Depends(get_db)
+):
     # 1. Call AI Service (New Async Method)
     # Note: AIService.generate_ip_positioning will raise HTTPException if API Key is missing or API fails
-    result: schemas.IPPositioningResult = await AIService.generate_ip_positioning(input)
+    # Identical inputs are served from the response cache unless bypass_cache/refresh_cache is set
+    result: schemas.IPPositioningResult = await AIService.generate_ip_positioning(
+        input, use_cache=not bypass_cache, refresh_cache=refresh_cache
+    )
 
     # 2. Save to DB
-    # We populate both legacy fields (for simple display if needed) and new JSON fields
-    
-    # Map complex objects to simple strings/lists for legacy fields if possible
-    legacy_persona = result.positioning_one_liner
-    legacy_audience = result.audience_profiles[0].name if result.audience_profiles else "General"
-    legacy_pillars = [p.pillar for p in result.content_pillars]
-    legacy_usp = result.differentiation[0] if result.differentiation else "N/A"
-
-    db_ip = models.IPProfile(
-        user_input=input.model_dump(),  # Legacy
-        input_json=input.model_dump(),  # New
-        result_json=result.model_dump(), # New
-        persona=legacy_persona,
-        audience=legacy_audience,
-        content_pillars=legacy_pillars,
-        usp=legacy_usp
+    db_ip = await save_ip_profile(db, input, result)
+    etag = ip_profile_etag(db_ip.id, db_ip.updated_at, db_ip.created_at, IP_PROFILE_FIELDS)
+    return ip_profile_response({f: getattr(db_ip, f) for f in IP_PROFILE_FIELDS}, IP_PROFILE_FIELDS, etag)
+
+@router.post("/generate/async", response_model=schemas.JobResponse, status_code=202)
+async def generate_ip_async(input: schemas.IPInput, db: AsyncSession = Depends(get_db)):
+    # Queue the generation and return immediately; poll /api/jobs/{id} for the IPProfileResponse
+    return await submit_job(db, "ip.generate", {"input": input.model_dump()})
+
+@job_handler("ip.generate")
+async def run_ip_generate_job(db: AsyncSession, payload: dict):
+    input = schemas.IPInput(**payload["input"])
+    result = await AIService.generate_ip_positioning(input)
+    db_ip = await save_ip_profile(db, input, result)
+    return schemas.IPProfileResponse.model_validate(db_ip).model_dump(mode="json")
+
+@router.post("/generate/stream")
+async def generate_ip_stream(
+    input: schemas.IPInput,
+    bypass_cache: bool = False,
+    refresh_cache: bool = False
+):
+    """
+    Server-sent events version of /generate.
+    Emits one `field` event per completed top-level field, then a `result` event
+    carrying the saved IPProfileResponse, or an `error` event if generation fails.
+    The body outlives request-scoped dependencies, so the stream opens its own session.
+    """
+    stream = AIService.stream_ip_positioning(input, use_cache=not bypass_cache, refresh_cache=refresh_cache)
+
+    async def event_source():
+        try:
+            async for kind, payload in stream:
+                if kind == "field":
+                    name, value = payload
+                    yield sse_event("field", {"field": name, "value": value})
+                else:
+                    async with AsyncSessionLocal() as db:
+                        db_ip = await save_ip_profile(db, input, payload)
+                    yield sse_event("result", schemas.IPProfileResponse.model_validate(db_ip).model_dump(mode="json"))
+        except HTTPException as e:
+            yield sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
+
+async def save_ip_profile(db: AsyncSession, input: schemas.IPInput, result: schemas.IPPositioningResult) -> models.IPProfile:
+    # We populate both legacy fields (for simple display if needed) and new JSON fields
+    db_ip = models.IPProfile(**ip_profile_values(input, result))
     db.add(db_ip)
-    db.commit()
-    db.refresh(db_ip)
+    await db.commit()
+    CacheRefresh.paths(["/api/ip/history"])
     
     return db_ip
 
+def batch_response(batch: models.IPBatch) -> schemas.IPBatchResponse:
+    return schemas.IPBatchResponse.model_validate(batch).model_copy(update={"results_url": results_url(batch.id)})
+
+@router.post("/batch", response_model=schemas.IPBatchResponse, status_code=202, openapi_extra=BATCH_UPLOAD_OPENAPI)
+async def create_ip_batch(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(csv|jsonl)$"),
+    filename: Optional[str] = None,
+    bypass_cache: bool = False,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Bulk /generate. The body (multipart `file` or raw) is a CSV with a header row of
+    IPInput fields, or JSONL with one IPInput object per line; the format comes from
+    `format`, the file name or the Content-Type. It is streamed into the media store and
+    queued: rows are generated in the background with bounded concurrency and
+    checkpointed as they finish. Poll GET /api/ip/batch/{id}; results_url streams NDJSON.
+    """
+    if not request_has_upload(request):
+        raise HTTPException(status_code=400, detail="A CSV or JSONL file must be provided")
+    upload = await receive_upload(request, None, filename)
+    input_format = batch_format(format, upload.filename, request.headers.get("content-type", ""))
+    total_rows = await asyncio.to_thread(inspect_input, content_store.path_for(upload.sha256), input_format)
+    if not total_rows:
+        raise HTTPException(status_code=400, detail="The file has no rows")
+    batch = await create_batch(db, upload.sha256, input_format, upload.filename, total_rows, use_cache=not bypass_cache)
+    return batch_response(await submit_batch(db, batch.id))
+
+@router.get("/batch/{id}", response_model=schemas.IPBatchResponse)
+async def get_ip_batch(id: int, db: AsyncSession = Depends(get_db)):
+    return batch_response(await get_batch(db, id))
+
+@router.get("/batch/{id}/results")
+async def get_ip_batch_results(id: int, since: Optional[int] = Query(None, ge=0), db: AsyncSession = Depends(get_db)):
+    """
+    NDJSON, one line per processed row (`checkpoint`, `row`, `status`, `ip_profile_id`,
+    `error`, `input`, `result`), in row order. Readable while the batch runs: pass the
+    highest `checkpoint` seen as `since` to fetch only rows finished after it (in
+    checkpoint order; rows do not finish in row order, so a row number cannot be used).
+    """
+    await get_batch(db, id)
+    return StreamingResponse(
+        iter_results(id, since),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="ip-batch-{id}.ndjson"'},
+    )
+
+@router.post("/batch/{id}/resume", response_model=schemas.IPBatchResponse, status_code=202)
+async def resume_ip_batch(id: int, retry_failed: bool = False, db: AsyncSession = Depends(get_db)):
+    # Re-queue a failed or interrupted batch; checkpointed rows are skipped (failed ones too, unless retry_failed)
+    return batch_response(await resume_batch(db, id, retry_failed))
+
+@job_handler(BATCH_JOB_KIND)
+async def run_ip_batch_job(db: AsyncSession, payload: dict):
+    return await run_batch(db, payload["batch_id"])
+
 @router.get("/history", response_model=List[schemas.IPHistoryItem])
-def get_ip_history(skip: int = 0, limit: int = 20, db: Session = Depends(get_db)):
-    # Order by created_at desc
-    history = db.query(models.IPProfile).order_by(models.IPProfile.created_at.desc()).offset(skip).limit(limit).all()
-    
-    # Map to HistoryItem
-    result = []
-    for item in history:
-        # positioning_one_liner might be in result_json or persona
-        one_liner = item.persona
-        if item.result_json and "positioning_one_liner" in item.result_json:
-            one_liner = item.result_json["positioning_one_liner"]
-            
-        result.append(schemas.IPHistoryItem(
-            id=item.id,
-            created_at=item.created_at,
-            positioning_one_liner=one_liner
-        ))
-    return result
+async def get_ip_history(
+    request: Request,
+    cursor: Optional[str] = None,
+    skip: int = 0,
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db)
+):
+    # Order by created_at desc, id desc; keyset pagination via `cursor`
+    # (the X-Next-Cursor header of the previous page). `skip` is kept for old clients.
+    # persona holds the positioning one-liner, so only the covering index is read.
+    stmt = (
+        select(models.IPProfile.id, models.IPProfile.created_at, models.IPProfile.persona)
+        .order_by(models.IPProfile.created_at.desc(), models.IPProfile.id.desc())
+        .limit(limit)
+    )
+    if cursor:
+        created_at, last_id = decode_history_cursor(cursor)
+        stmt = stmt.where(tuple_(models.IPProfile.created_at, models.IPProfile.id) < tuple_(created_at, last_id))
+    elif skip:
+        stmt = stmt.offset(skip)
+
+    rows = (await db.execute(stmt)).all()
+    # The page is fully determined by its rows (the one-liner changes with every edit)
+    etag = make_etag("ip.history", [(row.id, row.created_at.isoformat(), row.persona) for row in rows])
+    response = not_modified(request, etag, CACHE_POLICIES["ip.history"]) or ORJSONResponse(
+        [{"id": row.id, "created_at": row.created_at, "positioning_one_liner": row.persona} for row in rows],
+        headers=CACHE_POLICIES["ip.history"].headers(etag),
+    )
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_history_cursor(rows[-1].created_at, rows[-1].id)
+    return response
+
+def encode_history_cursor(created_at: datetime, id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_history_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid history cursor")
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    # "result_json,persona" -> those response fields plus id, in response order
+    if not fields:
+        return IP_PROFILE_FIELDS
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - set(IP_PROFILE_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return [f for f in IP_PROFILE_FIELDS if f == "id" or f in requested]
+
+def ip_profile_etag(id: int, updated_at: Optional[datetime], created_at: Optional[datetime], fields: List[str]) -> str:
+    return make_etag("ip.detail", id, row_stamp(updated_at, created_at), fields)
+
+def ip_profile_response(values: Dict[str, Any], fields: List[str], etag: str, raw: Iterable[str] = ()) -> Response:
+    # Serialized directly; `raw` fields hold JSON text and are copied into the body unparsed
+    return Response(json_object({f: values[f] for f in fields}, raw=raw), media_type="application/json",
+                    headers=CACHE_POLICIES["ip.detail"].headers(etag))
 
 @router.get("/{id}", response_model=schemas.IPProfileResponse)
-def get_ip_detail(id: int, db: Session = Depends(get_db)):
-    db_ip = db.query(models.IPProfile).filter(models.IPProfile.id == id).first()
-    if not db_ip:
+async def get_ip_detail(id: int, request: Request, fields: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    """
+    `fields` (comma-separated, e.g. `result_json,persona`) limits the response, and the
+    columns read, to those fields. JSON columns are returned as stored: a result_json
+    validated when it was written is not parsed or re-validated on the way out.
+    Conditional: a current If-None-Match gets a 304 after reading only the row's timestamps.
+    """
+    fields = parse_fields(fields)
+    policy = CACHE_POLICIES["ip.detail"]
+    stamps = (models.IPProfile.updated_at.label("etag_updated_at"), models.IPProfile.created_at.label("etag_created_at"))
+    if request.headers.get("if-none-match"):
+        row = (await db.execute(select(*stamps).where(models.IPProfile.id == id))).first()
+        if not row:
+            raise HTTPException(status_code=404, detail="IP Profile not found")
+        cached = not_modified(request, ip_profile_etag(id, row.etag_updated_at, row.etag_created_at, fields), policy)
+        if cached:
+            return cached
+
+    columns = [
+        cast(getattr(models.IPProfile, f), Text).label(f) if f in IP_JSON_FIELDS else getattr(models.IPProfile, f)
+        for f in fields
+    ]
+    columns.extend(stamps)
+    if "result_json" in fields:
+        columns.append(models.IPProfile.result_version)
+    row = (await db.execute(select(*columns).where(models.IPProfile.id == id))).first()
+    if not row:
         raise HTTPException(status_code=404, detail="IP Profile not found")
-    return db_ip
+
+    values = row._asdict()
+    if "result_json" in fields and values["result_json"] not in (None, "null") and row.result_version != schemas.IP_RESULT_VERSION:
+        # Stored before results were versioned (or under an older schema): validate as before
+        values["result_json"] = schemas.IPPositioningResult.model_validate_json(values["result_json"]).model_dump_json()
+    etag = ip_profile_etag(id, row.etag_updated_at, row.etag_created_at, fields)
+    return ip_profile_response(values, fields, etag, raw=IP_JSON_FIELDS)
 
 @router.put("/{id}", response_model=schemas.IPProfileResponse)
-def update_ip_result(id: int, result: schemas.IPPositioningResult, db: Session = Depends(get_db)):
-    db_ip = db.query(models.IPProfile).filter(models.IPProfile.id == id).first()
+async def update_ip_result(id: int, result: schemas.IPPositioningResult, fields: Optional[str] = None,
+                           db: AsyncSession = Depends(get_db)):
+    fields = parse_fields(fields)
+    db_ip = await db.get(models.IPProfile, id)
     if not db_ip:
         raise HTTPException(status_code=404, detail="IP Profile not found")
     
     # Update result_json
     db_ip.result_json = result.model_dump()
+    db_ip.result_version = schemas.IP_RESULT_VERSION
     
     # Update legacy fields for consistency
     db_ip.persona = result.positioning_one_liner
@@ -79,6 +279,10 @@ def update_ip_result(id: int, result: schemas.IPPositioningResult, db: Session =
     db_ip.content_pillars = [p.pillar for p in result.content_pillars]
     db_ip.usp = result.differentiation[0] if result.differentiation else "N/A"
     
-    db.commit()
-    db.refresh(db_ip)
-    return db_ip
+    db_ip.updated_at = datetime.utcnow()
+    
+    await db.commit()
+    # The proxy cache holds the old version of the detail page and of the history page showing it
+    CacheRefresh.paths([f"/api/ip/{id}", "/api/ip/history"])
+    etag = ip_profile_etag(id, db_ip.updated_at, db_ip.created_at, fields)
+    return ip_profile_response({f: getattr(db_ip, f) for f in fields}, fields, etag)
@@ -0,0 +1,59 @@
+import time
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db, AsyncSessionLocal
+import models, schemas
+from jobs import job_runner, TERMINAL_STATUSES
+from json_utils import sse_event
+
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+
+# Other processes' updates are only visible by re-reading the row
+JOB_RECHECK_INTERVAL = 0.5
+
+@router.get("/{id}", response_model=schemas.JobResponse)
+async def get_job(id: str, db: AsyncSession = Depends(get_db)):
+    db_job = await db.get(models.Job, id)
+    if not db_job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return db_job
+
+@router.get("/{id}/wait", response_model=schemas.JobResponse)
+async def wait_for_job(id: str, timeout: float = Query(25, ge=0, le=60), db: AsyncSession = Depends(get_db)):
+    """Long-poll: returns as soon as the job finishes, or its current state after `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while True:
+        db_job = await db.get(models.Job, id, populate_existing=True)
+        if not db_job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        remaining = deadline - time.monotonic()
+        if db_job.status in TERMINAL_STATUSES or remaining <= 0:
+            return db_job
+        await db.rollback()  # end the read transaction so the next read sees new commits
+        await job_runner.wait_for_change(min(remaining, JOB_RECHECK_INTERVAL))
+
+@router.get("/{id}/events")
+async def job_events(id: str):
+    """Server-sent events: a `status` event on every state change, ending with the terminal one."""
+    async with AsyncSessionLocal() as db:
+        if not await db.get(models.Job, id):
+            raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_source():
+        last_status = None
+        while True:
+            async with AsyncSessionLocal() as db:
+                db_job = await db.get(models.Job, id)
+            if db_job.status != last_status:
+                last_status = db_job.status
+                yield sse_event("status", schemas.JobResponse.model_validate(db_job).model_dump(mode="json"))
+            if db_job.status in TERMINAL_STATUSES:
+                return
+            await job_runner.wait_for_change(JOB_RECHECK_INTERVAL)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
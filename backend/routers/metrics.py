@@ -0,0 +1,10 @@
+from fastapi import APIRouter, Response
+from telemetry import render_metrics
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", include_in_schema=False)
+def get_metrics():
+    # Prometheus text format; summed over all gunicorn workers (see gunicorn_conf.py)
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
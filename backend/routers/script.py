@@ -1,65 +1,288 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from sqlalchemy.orm import Session
-from typing import List
-from database import get_db
+import os
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from database import get_db, bulk_insert, AsyncSessionLocal
 import models, schemas
-from services import DouyinService, AIService
+from services import DouyinService, AIService, single_flight
+from cache import make_cache_key
+from jobs import job_handler, submit_job
+from json_utils import sse_event
+from media import content_store, live_pipeline, receive_upload, request_has_upload, transcribe_file, TranscriptionPipeline
+from similarity import embed, to_bytes, similarity_index, find_near_duplicates, latest_rewrites
+
+# Uploads are read from the raw request stream (no form spooling), so describe the body for the docs
+UPLOAD_OPENAPI = {"requestBody": {"content": {
+    "multipart/form-data": {"schema": {"type": "object", "properties": {"file": {"type": "string", "format": "binary"}}}},
+    "application/octet-stream": {"schema": {"type": "string", "format": "binary"}},
+}}}
+
+# Batch rewrites
+REWRITE_BATCH_CONCURRENCY = int(os.getenv("REWRITE_BATCH_CONCURRENCY", "8"))  # LLM calls in flight per batch
+REWRITE_BATCH_MAX_ITEMS = int(os.getenv("REWRITE_BATCH_MAX_ITEMS", "500"))  # scripts x styles
 
 router = APIRouter(prefix="/api/script", tags=["script"])
 
-@router.post("/extract", response_model=schemas.ScriptResponse)
+@router.post("/extract", response_model=schemas.ScriptResponse, openapi_extra=UPLOAD_OPENAPI)
 async def extract_script(
+    request: Request,
     url: str = None, 
-    file: UploadFile = File(None), 
-    db: Session = Depends(get_db)
+    filename: str = None,
+    refresh_cache: bool = False,
+    db: AsyncSession = Depends(get_db)
 ):
-    transcript = ""
-    source_type = ""
-    source_content = ""
+    if url:
+        db_script = await create_script(db, "link", url, refresh=refresh_cache)
+    elif request_has_upload(request):
+        # Without a decoder installed, ASR starts on the first segments while the rest is still uploading
+        pipeline = live_pipeline()
+        upload = await receive_upload(request, pipeline, filename)
+        db_script = await create_script(db, "upload", upload.filename, content_hash=upload.sha256,
+                                        pipeline=pipeline, refresh=refresh_cache)
+    else:
+        raise HTTPException(status_code=400, detail="Either url or file must be provided")
+    return await script_response(db, db_script)
 
+@router.post("/extract/async", response_model=schemas.JobResponse, status_code=202, openapi_extra=UPLOAD_OPENAPI)
+async def extract_script_async(
+    request: Request,
+    url: str = None, 
+    filename: str = None,
+    refresh_cache: bool = False,
+    db: AsyncSession = Depends(get_db)
+):
     if url:
-        source_type = "link"
-        source_content = url
-        video_data = DouyinService.get_video_data(url)
-        transcript = video_data["transcript"]
-    elif file:
-        source_type = "upload"
-        source_content = file.filename
-        # Mock ASR
-        transcript = "This is a transcript from the uploaded video file..."
+        payload = {"source_type": "link", "source_content": url, "refresh": refresh_cache}
+    elif request_has_upload(request):
+        # The job may run in another process; it finds the file in the media store by hash
+        upload = await receive_upload(request, None, filename)
+        payload = {"source_type": "upload", "source_content": upload.filename, "content_hash": upload.sha256,
+                   "refresh": refresh_cache}
     else:
         raise HTTPException(status_code=400, detail="Either url or file must be provided")
+    return await submit_job(db, "script.extract", payload)
 
+@job_handler("script.extract")
+async def run_extract_job(db: AsyncSession, payload: dict):
+    db_script = await create_script(db, payload["source_type"], payload["source_content"],
+                                    content_hash=payload.get("content_hash"), refresh=payload.get("refresh", False))
+    return (await script_response(db, db_script)).model_dump(mode="json")
+
+async def script_response(db: AsyncSession, db_script: models.VideoScript) -> schemas.ScriptResponse:
+    # Flag earlier scripts with (nearly) the same transcript, with the rewrites they already have
+    duplicates = await find_near_duplicates(db, db_script)
+    rewrites = await latest_rewrites(db, [script.id for script, _ in duplicates])
+    return schemas.ScriptResponse.model_validate(db_script).model_copy(update={"near_duplicates": [
+        schemas.NearDuplicate(
+            script_id=script.id, similarity=score, source_content=script.source_content,
+            rewrite_ids=sorted(version.id for version in rewrites.get(script.id, {}).values()),
+        )
+        for script, score in duplicates
+    ]})
+
+def script_source_key(source_type: str, source_content: str, content_hash: Optional[str]) -> str:
+    if source_type == "link":
+        return DouyinService.source_key(source_content)
+    return f"sha256:{content_hash}"
+
+async def find_script(db: AsyncSession, source_key: str) -> Optional[models.VideoScript]:
+    return await db.scalar(select(models.VideoScript).where(models.VideoScript.source_key == source_key))
+
+async def create_script(db: AsyncSession, source_type: str, source_content: str,
+                        content_hash: Optional[str] = None, pipeline: Optional[TranscriptionPipeline] = None,
+                        refresh: bool = False) -> models.VideoScript:
+    # 1. Same video or same bytes already transcribed: reuse it (unique index on source_key)
+    source_key = script_source_key(source_type, source_content, content_hash)
+    existing = await find_script(db, source_key)
+    if existing and not refresh:
+        if pipeline:
+            pipeline.cancel()
+        return existing
+
+    # 2. Transcribe
+    if source_type == "link":
+        video_data = await run_in_threadpool(DouyinService.get_video_data, source_content)
+        transcript = video_data["transcript"]
+    elif pipeline:
+        transcript = await pipeline.finish()
+    else:
+        if not content_hash or not content_store.exists(content_hash):
+            raise HTTPException(status_code=404, detail="Uploaded file not found in media store")
+        transcript = await transcribe_file(content_store.path_for(content_hash))
+
+    # 3. Store; a forced refresh updates the row in place so existing rewrites stay attached
+    vector = embed(transcript)
+    if existing:
+        existing.transcript = transcript
+        existing.embedding = to_bytes(vector)
+        await db.commit()
+        similarity_index.put(existing.id, vector)
+        return existing
     db_script = models.VideoScript(
         source_type=source_type,
         source_content=source_content,
-        transcript=transcript
+        transcript=transcript,
+        content_hash=content_hash,
+        source_key=source_key,
+        embedding=to_bytes(vector)
     )
     db.add(db_script)
-    db.commit()
-    db.refresh(db_script)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # A concurrent extract of the same source committed first; return its row
+        await db.rollback()
+        return await find_script(db, source_key)
     return db_script
 
 @router.post("/rewrite", response_model=List[schemas.RewriteVersionResponse])
-def rewrite_script(input: schemas.RewriteRequest, db: Session = Depends(get_db)):
-    db_script = db.query(models.VideoScript).filter(models.VideoScript.id == input.script_id).first()
+async def rewrite_script(input: schemas.RewriteRequest, db: AsyncSession = Depends(get_db)):
+    return await coalesced_rewrites(db, input)
+
+async def coalesced_rewrites(db: AsyncSession, input: schemas.RewriteRequest) -> List[schemas.RewriteVersionResponse]:
+    # Concurrent rewrites of the same script (double-clicks, launch bursts) share one run
+    return await single_flight.do(
+        "rewrite:" + make_cache_key(script_id=input.script_id, ip_context=input.ip_context,
+                                    reuse_duplicates=input.reuse_duplicates),
+        lambda: create_rewrites(db, input),
+        encode=lambda versions: [v.model_dump(mode="json") for v in versions],
+        decode=lambda data: [schemas.RewriteVersionResponse(**v) for v in data],
+    )
+
+@router.post("/rewrite/batch")
+async def rewrite_script_batch(input: schemas.BatchRewriteRequest):
+    """
+    Rewrites every script in every requested style, REWRITE_BATCH_CONCURRENCY calls at a
+    time, and streams server-sent events in completion order: `version` with each stored
+    RewriteVersionResponse, `error` with script_id/style/detail for each item that failed,
+    then `done` with the counts. A failed item never stops the rest of the batch.
+    """
+    script_ids = list(dict.fromkeys(input.script_ids))
+    styles = list({style.name: style for style in input.styles}.values())
+    if len(script_ids) * len(styles) > REWRITE_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {REWRITE_BATCH_MAX_ITEMS} script x style items")
+
+    async def event_source():
+        async with AsyncSessionLocal() as db:
+            async for event, data in run_rewrite_batch(db, script_ids, styles):
+                yield sse_event(event, data)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def run_rewrite_batch(db: AsyncSession, script_ids: List[int], styles: List[schemas.RewriteStyle]):
+    counts = {"succeeded": 0, "failed": 0}
+
+    def failure(script_id, style, status_code, detail):
+        counts["failed"] += 1
+        return "error", {"script_id": script_id, "style": style, "status_code": status_code, "detail": detail}
+
+    # 1. Load all transcripts in one query; unknown ids fail individually
+    scripts = (await db.scalars(select(models.VideoScript).where(models.VideoScript.id.in_(script_ids)))).all()
+    transcripts = {script.id: script.transcript for script in scripts}
+    for script_id in script_ids:
+        if script_id not in transcripts:
+            for style in styles:
+                yield failure(script_id, style.name, 404, "Script not found")
+
+    # 2. Fan out under a bounded limit
+    semaphore = asyncio.Semaphore(REWRITE_BATCH_CONCURRENCY)
+
+    async def rewrite_one(script_id: int, style: schemas.RewriteStyle):
+        async with semaphore:
+            content = await run_in_threadpool(AIService.rewrite_script, transcripts[script_id], style.name, style.prompt)
+        return {"script_id": script_id, "style": style.name, "content": content}
+
+    items = {}
+    for script_id in script_ids:
+        for style in styles:
+            if script_id in transcripts:
+                items[asyncio.create_task(rewrite_one(script_id, style))] = (script_id, style.name)
+
+    # 3. Store and emit whatever has finished, one INSERT per wake-up
+    pending = set(items)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            rows = []
+            for task in done:
+                script_id, style = items[task]
+                error = task.exception()
+                if isinstance(error, HTTPException):
+                    yield failure(script_id, style, error.status_code, error.detail)
+                elif error is not None:
+                    print(f"Batch rewrite failed for script {script_id} ({style}): {error}")
+                    yield failure(script_id, style, 500, str(error))
+                else:
+                    rows.append(task.result())
+            try:
+                stored = await bulk_insert(db, models.RewriteVersion, rows)
+            except Exception as e:
+                await db.rollback()
+                for row in rows:
+                    yield failure(row["script_id"], row["style"], 500, f"Failed to save rewrite: {e}")
+                continue
+            for row in stored:
+                counts["succeeded"] += 1
+                yield "version", schemas.RewriteVersionResponse(**row).model_dump(mode="json")
+    finally:
+        # Client went away: stop the calls that have not finished
+        for task in pending:
+            task.cancel()
+
+    yield "done", {"total": len(script_ids) * len(styles), **counts}
+
+@router.post("/rewrite/async", response_model=schemas.JobResponse, status_code=202)
+async def rewrite_script_async(input: schemas.RewriteRequest, db: AsyncSession = Depends(get_db)):
+    return await submit_job(db, "script.rewrite", {"request": input.model_dump()})
+
+@job_handler("script.rewrite")
+async def run_rewrite_job(db: AsyncSession, payload: dict):
+    versions = await coalesced_rewrites(db, schemas.RewriteRequest(**payload["request"]))
+    return [v.model_dump(mode="json") for v in versions]
+
+async def create_rewrites(db: AsyncSession, input: schemas.RewriteRequest) -> List[schemas.RewriteVersionResponse]:
+    db_script = await db.get(models.VideoScript, input.script_id)
     if not db_script:
         raise HTTPException(status_code=404, detail="Script not found")
 
     styles = ["hook", "professional", "emotional"]
-    results = []
-
-    for style in styles:
-        new_content = AIService.rewrite_script(db_script.transcript, style)
-        
-        db_rewrite = models.RewriteVersion(
-            script_id=input.script_id,
-            style=style,
-            content=new_content
-        )
-        db.add(db_rewrite)
-        db.commit()
-        db.refresh(db_rewrite)
-        results.append(db_rewrite)
 
-    return results
+    # A near-duplicate script already rewritten in every style: reuse its rewrites, no LLM call
+    if input.reuse_duplicates:
+        reused = await reusable_rewrites(db, db_script, styles)
+        if reused:
+            return reused
+
+    # All styles are rewritten concurrently, then stored in one transaction
+    contents = await asyncio.gather(*[
+        run_in_threadpool(AIService.rewrite_script, db_script.transcript, style)
+        for style in styles
+    ])
+    rows = [
+        {"script_id": input.script_id, "style": style, "content": content}
+        for style, content in zip(styles, contents)
+    ]
+    stored = await bulk_insert(db, models.RewriteVersion, rows)
+    return [schemas.RewriteVersionResponse(**row) for row in stored]
+
+async def reusable_rewrites(db: AsyncSession, db_script: models.VideoScript,
+                            styles: List[str]) -> Optional[List[schemas.RewriteVersionResponse]]:
+    duplicates = await find_near_duplicates(db, db_script)
+    rewrites = await latest_rewrites(db, [script.id for script, _ in duplicates])
+    for script, score in duplicates:
+        by_style = rewrites.get(script.id, {})
+        if all(style in by_style for style in styles):
+            return [
+                schemas.RewriteVersionResponse.model_validate(by_style[style]).model_copy(update={"similarity": score})
+                for style in styles
+            ]
+    return None
@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from database import get_db
+import schemas
+from search_index import DOC_TYPES, search
+
+router = APIRouter(prefix="/api/search", tags=["search"])
+
+@router.get("", response_model=List[schemas.SearchHitResponse])
+async def search_content(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    types: Optional[List[str]] = Query(None),
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Full-text search over transcripts, rewrites and IP results, best match first.
+    Every word of `q` must match (Chinese is matched as written, no spaces needed);
+    `types` narrows the document types. Next page: pass the X-Next-Cursor header as `cursor`.
+    """
+    doc_types = types or list(DOC_TYPES)
+    unknown = [t for t in doc_types if t not in DOC_TYPES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown document types: {', '.join(unknown)}")
+    hits, next_cursor = await search(db, q, doc_types, limit, cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return hits
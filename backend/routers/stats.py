@@ -0,0 +1,34 @@
+import os
+from fastapi import APIRouter, Query
+from services import UpstreamHTTP, AIService, single_flight, usage_ledger
+from cache import ip_positioning_cache, benchmark_search_cache
+from scheduler import upstream_scheduler
+from jobs import job_runner
+from avatar_render import render_runner
+from ip_batch import batch_runner
+
+router = APIRouter(prefix="/api/stats", tags=["stats"])
+
+@router.get("")
+def get_worker_stats():
+    # Stats are per gunicorn worker; pid tells you which one answered
+    return {
+        "pid": os.getpid(),
+        "upstream_http": UpstreamHTTP.stats(),
+        "upstream_scheduler": upstream_scheduler.stats(),
+        "single_flight": single_flight.stats(),
+        "job_runner": job_runner.stats(),
+        "render_runner": render_runner.stats(),
+        "batch_runner": batch_runner.stats(),
+        "llm_usage": usage_ledger.stats(),
+        "json_repair": AIService.repair_counters,
+        "llm_cache": {
+            "ip_positioning": ip_positioning_cache.stats(),
+            "benchmark_search": benchmark_search_cache.stats(),
+        },
+    }
+
+@router.get("/usage")
+async def get_llm_usage(hours: float = Query(24, gt=0, le=24 * 90)):
+    # Recorded by every worker, so this is the cluster-wide view of token spend
+    return {"hours": hours, "endpoints": await usage_ledger.summary(hours)}
@@ -0,0 +1,186 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import email.utils
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+from fastapi import HTTPException
+
+# Configuration (all limits are per gunicorn worker; divide the account quota by the worker count)
+DASHSCOPE_MAX_CONCURRENCY = int(os.getenv("DASHSCOPE_MAX_CONCURRENCY", "8"))
+DASHSCOPE_MIN_CONCURRENCY = int(os.getenv("DASHSCOPE_MIN_CONCURRENCY", "1"))
+DASHSCOPE_ADAPTIVE_CONCURRENCY = os.getenv("DASHSCOPE_ADAPTIVE_CONCURRENCY", "true").lower() in ("1", "true", "yes")
+DASHSCOPE_RATE_LIMIT_RPS = float(os.getenv("DASHSCOPE_RATE_LIMIT_RPS", "0"))  # 0 disables the token bucket
+DASHSCOPE_RATE_LIMIT_BURST = int(os.getenv("DASHSCOPE_RATE_LIMIT_BURST", "5"))
+DASHSCOPE_QUEUE_MAX = int(os.getenv("DASHSCOPE_QUEUE_MAX", "100"))
+DASHSCOPE_QUEUE_TIMEOUT = float(os.getenv("DASHSCOPE_QUEUE_TIMEOUT", "30"))
+DASHSCOPE_RETRY_BASE_DELAY = float(os.getenv("DASHSCOPE_RETRY_BASE_DELAY", "0.5"))
+DASHSCOPE_RETRY_MAX_DELAY = float(os.getenv("DASHSCOPE_RETRY_MAX_DELAY", "20"))
+
+# Priority classes (lower runs first)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+# Upstream statuses that mean "slow down" rather than "your request is wrong"
+OVERLOAD_STATUS_CODES = {429, 503}
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+    Seconds to wait before retry number `attempt + 1`.
+    Honours a Retry-After header (delta-seconds or HTTP date), otherwise
+    exponential backoff with full jitter, capped at DASHSCOPE_RETRY_MAX_DELAY.
+    """
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0.0), DASHSCOPE_RETRY_MAX_DELAY)
+    return random.uniform(0, min(DASHSCOPE_RETRY_MAX_DELAY, DASHSCOPE_RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+class TokenBucket:
+    """Classic token bucket; take() sleeps until a token is available."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+
+    async def take(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class UpstreamScheduler:
+    """
+    Admission control in front of DashScope.
+
+    - Concurrency limit, optionally AIMD-adaptive: +1/limit per success,
+      halved on 429/503/timeouts, bounded by [min, max].
+    - Optional token bucket matching the per-worker share of the RPS quota.
+    - Bounded wait queue ordered by priority class, then arrival. A full queue
+      or a wait longer than DASHSCOPE_QUEUE_TIMEOUT is rejected with 503.
+    """
+
+    def __init__(self, max_concurrency: int = DASHSCOPE_MAX_CONCURRENCY, min_concurrency: int = DASHSCOPE_MIN_CONCURRENCY,
+                 adaptive: bool = DASHSCOPE_ADAPTIVE_CONCURRENCY, rate: float = DASHSCOPE_RATE_LIMIT_RPS,
+                 burst: int = DASHSCOPE_RATE_LIMIT_BURST, max_queue: int = DASHSCOPE_QUEUE_MAX,
+                 queue_timeout: float = DASHSCOPE_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.adaptive = adaptive
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._limit = float(max_concurrency)
+        self._bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self._in_flight = 0
+        self._waiters = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._waits = deque(maxlen=1000)
+        self.counters = {"admitted": 0, "queued": 0, "rejected_full": 0, "rejected_timeout": 0,
+                         "overloads": 0, "successes": 0}
+
+    @property
+    def limit(self) -> int:
+        return max(int(self._limit), self.min_concurrency)
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_INTERACTIVE):
+        await self._acquire(priority)
+        try:
+            if self._bucket is not None:
+                await self._bucket.take()
+            yield
+        finally:
+            self._release()
+
+    def record_success(self):
+        self.counters["successes"] += 1
+        if self.adaptive and self._limit < self.max_concurrency:
+            self._limit = min(self.max_concurrency, self._limit + 1 / self._limit)
+            self._wake()
+
+    def record_overload(self):
+        self.counters["overloads"] += 1
+        if self.adaptive:
+            self._limit = max(float(self.min_concurrency), self._limit / 2)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        return {
+            "limit": self.limit,
+            "adaptive": self.adaptive,
+            "in_flight": self._in_flight,
+            "queue_depth": self._queue_depth(),
+            "wait_ms_p50": round(waits[len(waits) // 2] * 1000, 1) if waits else None,
+            "wait_ms_p95": round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else None,
+            "wait_ms_max": round(waits[-1] * 1000, 1) if waits else None,
+            **self.counters,
+        }
+
+    # --- Internals ---
+
+    def _queue_depth(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def _acquire(self, priority: int):
+        started = time.monotonic()
+        if self._in_flight < self.limit and self._queue_depth() == 0:
+            self._in_flight += 1
+            self.counters["admitted"] += 1
+            self._waits.append(0.0)
+            return
+
+        if self._queue_depth() >= self.max_queue:
+            self.counters["rejected_full"] += 1
+            raise HTTPException(status_code=503, detail="Upstream queue is full, please retry shortly.")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self.counters["queued"] += 1
+        try:
+            await asyncio.wait_for(future, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.counters["rejected_timeout"] += 1
+            raise HTTPException(status_code=503, detail="Timed out waiting for an upstream slot, please retry shortly.")
+        except asyncio.CancelledError:
+            # Slot may have been handed over just as we were cancelled
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        self.counters["admitted"] += 1
+        self._waits.append(time.monotonic() - started)
+
+    def _release(self):
+        self._in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self._in_flight < self.limit:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue  # waiter gave up
+            self._in_flight += 1
+            future.set_result(None)
+
+
+# Shared instance (one per worker)
+upstream_scheduler = UpstreamScheduler()
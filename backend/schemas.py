@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from pydantic import BaseModel, Field, field_validator
+from typing import List, Optional, Dict, Any
 from datetime import datetime
 
 # --- IP Positioning ---
@@ -30,6 +30,10 @@ class IPPositioningResult(BaseModel):
     sample_hooks: List[str]
     confidence_notes: str
 
+# Stored with each result_json that was validated against IPPositioningResult, so reads can
+# return it unparsed. Bump when the schema changes incompatibly: older rows are re-validated.
+IP_RESULT_VERSION = 1
+
 # Input Schema
 class IPInput(BaseModel):
     name_or_brand: Optional[str] = None
@@ -63,9 +67,27 @@ class IPHistoryItem(BaseModel):
     class Config:
         from_attributes = True
 
+class IPBatchResponse(BaseModel):
+    id: int
+    filename: Optional[str] = None
+    input_format: str
+    status: str  # queued / running / succeeded (every row processed) / failed
+    total_rows: Optional[int] = None
+    succeeded_rows: int = 0
+    failed_rows: int = 0
+    results_url: Optional[str] = None  # NDJSON, one line per processed row; readable while running
+    job_id: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
 # --- Benchmark Accounts ---
 class BenchmarkSearch(BaseModel):
-    keyword: str
+    keyword: str = Field(..., min_length=1)
+    platforms: Optional[List[str]] = None  # registered platform names; default: BENCHMARK_PROVIDERS
 
 class BenchmarkAccountBase(BaseModel):
     account_name: str
@@ -77,6 +99,10 @@ class BenchmarkAccountBase(BaseModel):
 class BenchmarkAccountResponse(BenchmarkAccountBase):
     id: int
     platform: str
+    follower_count: Optional[int] = None
+    like_count: Optional[int] = None
+    video_count: Optional[int] = None
+    engagement_score: Optional[float] = None
     created_at: datetime
 
     class Config:
@@ -87,12 +113,19 @@ class ScriptExtractRequest(BaseModel):
     url: Optional[str] = None
     # For file upload, we'll handle it in the controller separately
 
+class NearDuplicate(BaseModel):
+    script_id: int
+    similarity: float  # cosine of the transcript embeddings, 1.0 = same shingles
+    source_content: Optional[str] = None
+    rewrite_ids: List[int] = []  # newest rewrite per style, reusable instead of a new rewrite
+
 class ScriptResponse(BaseModel):
     id: int
     source_type: str
     source_content: str
     transcript: str
     created_at: datetime
+    near_duplicates: List[NearDuplicate] = []
 
     class Config:
         from_attributes = True
@@ -100,12 +133,30 @@ class ScriptResponse(BaseModel):
 class RewriteRequest(BaseModel):
     script_id: int
     ip_context: Optional[str] = None # Optional context to guide rewrite
+    reuse_duplicates: bool = True  # return a near-duplicate script's rewrites instead of calling the LLM
+
+class RewriteStyle(BaseModel):
+    name: str
+    prompt: Optional[str] = None  # Custom style instruction; built-in styles need none
+
+class BatchRewriteRequest(BaseModel):
+    script_ids: List[int] = Field(..., min_length=1)
+    styles: List[RewriteStyle] = Field(default_factory=lambda: [RewriteStyle(name=s) for s in ("hook", "professional", "emotional")], min_length=1)
+    ip_context: Optional[str] = None
+
+    @field_validator("styles", mode="before")
+    @classmethod
+    def accept_style_names(cls, v):
+        # "hook" is shorthand for {"name": "hook"}
+        return [{"name": s} if isinstance(s, str) else s for s in v]
 
 class RewriteVersionResponse(BaseModel):
     id: int
+    script_id: Optional[int] = None
     style: str
     content: str
     created_at: datetime
+    similarity: Optional[float] = None  # set when reused from near-duplicate script `script_id`
 
     class Config:
         from_attributes = True
@@ -116,5 +167,50 @@ class AvatarCreateRequest(BaseModel):
     avatar_id: str
     voice_id: str
 
-class AvatarResponse(BaseModel):
-    video_url: str
+class AvatarRenderResponse(BaseModel):
+    id: int
+    render_key: str
+    status: str
+    progress: float = 0.0
+    video_url: Optional[str] = None  # set once succeeded; served with HTTP range support
+    size: Optional[int] = None
+    cached: bool = False  # an identical render already existed
+    job_id: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class AvatarWebhook(BaseModel):
+    # Renderer callback body; only used as a hint to poll the renderer now
+    status: Optional[str] = None
+    task_id: Optional[str] = None
+
+# --- Background Jobs ---
+class JobResponse(BaseModel):
+    id: str
+    kind: str
+    status: str
+    attempts: int
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+# --- Search ---
+class SearchHitResponse(BaseModel):
+    doc_type: str  # 'transcript' (VideoScript), 'rewrite' (RewriteVersion) or 'ip' (IPProfile)
+    doc_id: int
+    title: str
+    snippet: str  # HTML-escaped excerpt, matches wrapped in <mark>
+    score: float  # higher is more relevant
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,338 @@
+import os
+import re
+import json
+import html
+import base64
+import datetime
+import unicodedata
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import event, select, text
+from sqlalchemy.orm import Session
+import models
+
+# Configuration
+SEARCH_SNIPPET_CHARS = int(os.getenv("SEARCH_SNIPPET_CHARS", "160"))  # length of the highlighted excerpt
+SEARCH_TITLE_WEIGHT = float(os.getenv("SEARCH_TITLE_WEIGHT", "2.0"))  # BM25 weight of title matches vs body
+SEARCH_REINDEX_BATCH = int(os.getenv("SEARCH_REINDEX_BATCH", "1000"))
+
+SEARCH_INDEX_TABLE = "search_index"
+
+# Indexed document types: name -> (rowid tag, model). Index rowid = doc id * 8 + tag,
+# so a document's entry is found (and replaced) by primary key.
+DOC_TYPES = {
+    "transcript": (1, models.VideoScript),
+    "rewrite": (2, models.RewriteVersion),
+    "ip": (3, models.IPProfile),
+}
+ROWID_BITS = 3
+
+# CJK has no spaces between words: runs of Han / kana / Hangul are indexed as overlapping
+# bigrams (plus the run's last character), everything else as casefolded words, and both
+# dialects' full-text engines just see space-separated tokens.
+CJK_CHARS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"  # kana, Han, Hangul
+CJK_PATTERN = re.compile(f"[{CJK_CHARS}]+")
+PIECE_PATTERN = re.compile(f"[{CJK_CHARS}]+|[^\\W_{CJK_CHARS}]+")
+
+MARK_OPEN, MARK_CLOSE = "<mark>", "</mark>"
+
+
+# --- Tokenization ---
+
+def text_pieces(value: str) -> List[str]:
+    """Normalized CJK runs and words of `value` (NFKC, casefolded)."""
+    return PIECE_PATTERN.findall(unicodedata.normalize("NFKC", value).casefold())
+
+
+def tokenize(value: str) -> str:
+    """Index form of a text: space-separated words and CJK bigrams."""
+    tokens = []
+    for piece in text_pieces(value):
+        if CJK_PATTERN.fullmatch(piece):
+            tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+            # The last character gets its own token so one-character queries reach every character
+            tokens.append(piece[-1])
+        else:
+            tokens.append(piece)
+    return " ".join(tokens)
+
+
+@dataclass
+class Phrase:
+    tokens: List[str]
+    prefix: bool = False  # a lone CJK character: matches any token starting with it
+
+
+def parse_query(q: str) -> Tuple[List[Phrase], List[str]]:
+    """
+    Every whitespace-separated term must match: a term becomes a phrase of its tokens
+    (so 内容创作 is 内容 容创 创作 in a row). Returns (phrases, pieces to highlight).
+    """
+    phrases, pieces = [], []
+    for term in q.split():
+        tokens = []
+        for piece in text_pieces(term):
+            pieces.append(piece)
+            if CJK_PATTERN.fullmatch(piece) and len(piece) == 1:
+                if tokens:
+                    phrases.append(Phrase(tokens))
+                    tokens = []
+                phrases.append(Phrase([piece], prefix=True))
+            elif CJK_PATTERN.fullmatch(piece):
+                tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+            else:
+                tokens.append(piece)
+        if tokens:
+            phrases.append(Phrase(tokens))
+    return phrases, pieces
+
+
+def highlight(value: str, pieces: List[str], width: int = SEARCH_SNIPPET_CHARS) -> str:
+    """HTML-escaped excerpt of `value` around the first match, matches wrapped in <mark>."""
+    if not value:
+        return ""
+    pattern = re.compile("|".join(re.escape(p) for p in sorted(set(pieces), key=len, reverse=True)), re.IGNORECASE)
+    first = pattern.search(value)
+    start = max(0, first.start() - width // 3) if first else 0
+    window = value[start:start + width]
+    parts, position = [], 0
+    for match in pattern.finditer(window):
+        parts.append(html.escape(window[position:match.start()]))
+        parts.append(f"{MARK_OPEN}{html.escape(match.group())}{MARK_CLOSE}")
+        position = match.end()
+    parts.append(html.escape(window[position:]))
+    return ("…" if start else "") + "".join(parts) + ("…" if start + width < len(value) else "")
+
+
+# --- Documents ---
+
+def _field(row, name: str):
+    return row.get(name) if isinstance(row, Mapping) else getattr(row, name)
+
+
+def _json_text(value) -> List[str]:
+    """Every string inside a JSON value, in order."""
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict):
+        return [s for item in value.values() for s in _json_text(item)]
+    if isinstance(value, list):
+        return [s for item in value for s in _json_text(item)]
+    return []
+
+
+def document(doc_type: str, row) -> Tuple[str, str]:
+    """(title, body) indexed for a row (ORM object or column mapping) of the type's table."""
+    if doc_type == "transcript":
+        return _field(row, "source_content") or "", _field(row, "transcript") or ""
+    if doc_type == "rewrite":
+        return _field(row, "style") or "", _field(row, "content") or ""
+    return _field(row, "persona") or "", "\n".join(_json_text(_field(row, "result_json")))
+
+
+def index_rowid(doc_type: str, doc_id: int) -> int:
+    return (doc_id << ROWID_BITS) | DOC_TYPES[doc_type][0]
+
+
+# --- Index maintenance (sync connections: ORM flush events, migrate) ---
+
+def create_index(conn) -> bool:
+    """Create the index if it is missing. Returns True if it was created (and needs a backfill)."""
+    if conn.dialect.has_table(conn, SEARCH_INDEX_TABLE):
+        return False
+    if conn.dialect.name == "postgresql":
+        # Ranked with ts_rank_cd over a GIN index; the title is weighted 'A'
+        conn.execute(text(
+            f"CREATE TABLE {SEARCH_INDEX_TABLE} (rowid BIGINT PRIMARY KEY, doc_type VARCHAR NOT NULL, "
+            "doc_id INTEGER NOT NULL, title TEXT, body TEXT, created_at TIMESTAMP, terms TSVECTOR NOT NULL)"
+        ))
+        conn.execute(text(f"CREATE INDEX ix_{SEARCH_INDEX_TABLE}_terms ON {SEARCH_INDEX_TABLE} USING GIN (terms)"))
+    else:
+        # FTS5 with BM25; only the token columns are indexed, the rest is stored for results
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE {SEARCH_INDEX_TABLE} USING fts5(doc_type UNINDEXED, doc_id UNINDEXED, "
+            "title UNINDEXED, body UNINDEXED, created_at UNINDEXED, title_terms, terms, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+    return True
+
+
+def index_rows(conn, doc_type: str, rows: Iterable) -> int:
+    """Add or replace the index entries of `rows` (ORM objects or column mappings)."""
+    params = []
+    for row in rows:
+        title, body = document(doc_type, row)
+        doc_id = _field(row, "id")
+        created_at = _field(row, "created_at")
+        params.append({
+            "rowid": index_rowid(doc_type, doc_id), "doc_type": doc_type, "doc_id": doc_id,
+            "title": title, "body": body, "title_terms": tokenize(title), "terms": tokenize(body),
+            "created_at": created_at if conn.dialect.name == "postgresql" else (created_at.isoformat() if created_at else None),
+        })
+    if not params:
+        return 0
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(
+            f"INSERT INTO {SEARCH_INDEX_TABLE} (rowid, doc_type, doc_id, title, body, created_at, terms) "
+            "VALUES (:rowid, :doc_type, :doc_id, :title, :body, :created_at, "
+            "setweight(to_tsvector('simple', :title_terms), 'A') || to_tsvector('simple', :terms)) "
+            "ON CONFLICT (rowid) DO UPDATE SET title = excluded.title, body = excluded.body, terms = excluded.terms"
+        ), params)
+    else:
+        conn.execute(text(
+            f"INSERT OR REPLACE INTO {SEARCH_INDEX_TABLE} (rowid, doc_type, doc_id, title, body, created_at, title_terms, terms) "
+            "VALUES (:rowid, :doc_type, :doc_id, :title, :body, :created_at, :title_terms, :terms)"
+        ), params)
+    return len(params)
+
+
+def unindex_rows(conn, doc_type: str, doc_ids: Iterable[int]):
+    rowids = [{"rowid": index_rowid(doc_type, doc_id)} for doc_id in doc_ids]
+    if rowids:
+        conn.execute(text(f"DELETE FROM {SEARCH_INDEX_TABLE} WHERE rowid = :rowid"), rowids)
+
+
+def reindex(bind) -> Dict[str, int]:
+    """Rebuild the whole index from the source tables (after creating it, or `python migrate.py --reindex`)."""
+    counts = {}
+    with bind.begin() as conn:
+        create_index(conn)
+        conn.execute(text(f"DELETE FROM {SEARCH_INDEX_TABLE}"))
+        for doc_type, (_, model) in DOC_TYPES.items():
+            counts[doc_type] = 0
+            result = conn.execution_options(yield_per=SEARCH_REINDEX_BATCH).execute(select(model.__table__))
+            for batch in result.mappings().partitions():
+                counts[doc_type] += index_rows(conn, doc_type, batch)
+    return counts
+
+
+# Incremental sync: entries are written on the flushing connection, so they commit
+# (or roll back) together with the row itself.
+
+def _listen(doc_type: str, model):
+    @event.listens_for(model, "after_insert")
+    @event.listens_for(model, "after_update")
+    def _on_write(mapper, connection, target):
+        index_rows(connection, doc_type, [target])
+
+    @event.listens_for(model, "after_delete")
+    def _on_delete(mapper, connection, target):
+        unindex_rows(connection, doc_type, [target.id])
+
+
+for _doc_type, (_, _model) in DOC_TYPES.items():
+    _listen(_doc_type, _model)
+
+DOC_TYPE_BY_MODEL = {model: doc_type for doc_type, (_, model) in DOC_TYPES.items()}
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _on_bulk_insert(orm_execute_state):
+    """
+    database.bulk_insert / bulk_upsert write with INSERT ... RETURNING, which skips the
+    mapper events above; index the returned rows instead and hand the caller a copy.
+    """
+    mapper = orm_execute_state.bind_mapper
+    doc_type = DOC_TYPE_BY_MODEL.get(mapper.class_) if orm_execute_state.is_insert and mapper else None
+    if doc_type is None:
+        return None
+    returning = set(orm_execute_state.statement.exported_columns.keys())
+    if not {"id", "created_at"} <= returning:
+        print(f"Search index: {doc_type} rows inserted without RETURNING id were not indexed")
+        return None
+    frozen = orm_execute_state.invoke_statement().freeze()
+    index_rows(orm_execute_state.session.connection(), doc_type, frozen().mappings())
+    return frozen()
+
+
+# --- Query ---
+
+@dataclass
+class SearchHit:
+    doc_type: str
+    doc_id: int
+    title: str
+    snippet: str
+    score: float
+    created_at: Optional[datetime.datetime]
+
+
+def encode_search_cursor(rank: float, rowid: int) -> str:
+    raw = json.dumps([rank, rowid]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_search_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        rank, rowid = json.loads(raw)
+        return float(rank), int(rowid)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid search cursor")
+
+
+def _fts5_query(phrases: List[Phrase]) -> str:
+    def quote(token):
+        return '"' + token.replace('"', '""') + '"'
+    return " AND ".join(
+        quote(" ".join(p.tokens)) + (" *" if p.prefix else "") for p in phrases
+    )
+
+
+def _tsquery(phrases: List[Phrase], params: Dict[str, Any]) -> str:
+    parts = []
+    for i, phrase in enumerate(phrases):
+        params[f"p{i}"] = " ".join(phrase.tokens) + (":*" if phrase.prefix else "")
+        parts.append(f"{'to_tsquery' if phrase.prefix else 'phraseto_tsquery'}('simple', :p{i})")
+    return " && ".join(parts)
+
+
+async def search(db, q: str, doc_types: List[str], limit: int, cursor: Optional[str] = None
+                 ) -> Tuple[List[SearchHit], Optional[str]]:
+    """
+    Best matches first (BM25 on SQLite, ts_rank_cd on PostgreSQL), keyset-paginated on
+    (rank, rowid). Returns the hits and the cursor of the next page, if there may be one.
+    """
+    phrases, pieces = parse_query(q)
+    if not phrases:
+        raise HTTPException(status_code=400, detail="Query has no searchable words")
+    params: Dict[str, Any] = {"limit": limit}
+
+    # rank: lower is better on both dialects
+    if db.bind.dialect.name == "postgresql":
+        tsquery = _tsquery(phrases, params)
+        rank = f"-ts_rank_cd(terms, {tsquery})"
+        where = f"terms @@ ({tsquery})"
+    else:
+        # One weight per column, UNINDEXED ones included
+        rank = f"bm25({SEARCH_INDEX_TABLE}, 0, 0, 0, 0, 0, {SEARCH_TITLE_WEIGHT}, 1.0)"
+        where = f"{SEARCH_INDEX_TABLE} MATCH :match"
+        params["match"] = _fts5_query(phrases)
+    if set(doc_types) != set(DOC_TYPES):
+        # The type is in the rowid's low bits, so filtering never reads the stored columns
+        where += f" AND (rowid & {(1 << ROWID_BITS) - 1}) IN ({', '.join(str(DOC_TYPES[t][0]) for t in doc_types)})"
+    if cursor:
+        params["after_rank"], params["after_rowid"] = decode_search_cursor(cursor)
+        where += f" AND ({rank} > :after_rank OR ({rank} = :after_rank AND rowid > :after_rowid))"
+
+    # Rank all matches on the index alone, then load the stored text of one page
+    rows = (await db.execute(text(
+        f"SELECT page.rowid, page.rank, doc.doc_type, doc.doc_id, doc.title, doc.body, doc.created_at "
+        f"FROM (SELECT rowid, {rank} AS rank FROM {SEARCH_INDEX_TABLE} WHERE {where} "
+        f"ORDER BY rank, rowid LIMIT :limit) AS page "
+        f"JOIN {SEARCH_INDEX_TABLE} AS doc ON doc.rowid = page.rowid ORDER BY page.rank, page.rowid"
+    ), params)).all()
+
+    hits = []
+    for row in rows:
+        created_at = row.created_at
+        if isinstance(created_at, str):
+            created_at = datetime.datetime.fromisoformat(created_at)
+        hits.append(SearchHit(
+            doc_type=row.doc_type, doc_id=int(row.doc_id), title=row.title or "",
+            snippet=highlight(row.body or "", pieces), score=round(-float(row.rank), 6), created_at=created_at,
+        ))
+    next_cursor = encode_search_cursor(float(rows[-1].rank), int(rows[-1].rowid)) if len(rows) == limit else None
+    return hits, next_cursor
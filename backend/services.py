@@ -1,29 +1,104 @@
 import os
+import re
 import json
+import uuid
+import time
 import httpx
 import random
-from typing import List, Dict, Any
+import sqlite3
+import asyncio
+import datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple, Callable, Awaitable, TypeVar
 from fastapi import HTTPException
-import schemas
+from sqlalchemy import select, func
+import models, schemas
+from database import AsyncSessionLocal
+from telemetry import (
+    UpstreamTrace, span, LLM_LATENCY, LLM_TTFT, LLM_RETRIES, LLM_TOKENS, LLM_FIELD_REPAIRS,
+)
+from cache import make_cache_key, ip_positioning_cache, LLM_CACHE_PATH
+from pydantic import ValidationError
+from json_utils import IncrementalObjectParser, repair_json
+from scheduler import (
+    upstream_scheduler, backoff_delay, PRIORITY_INTERACTIVE,
+    OVERLOAD_STATUS_CODES, RETRYABLE_STATUS_CODES,
+)
 
 # Configuration
 DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
 DASHSCOPE_BASE_URL = os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
 QWEN_MODEL = os.getenv("QWEN_MODEL", "qwen-plus")
 
-class AIService:
-    @staticmethod
-    async def generate_ip_positioning(input_data: schemas.IPInput) -> schemas.IPPositioningResult:
-        """
-        Generate IP Positioning using Qwen (DashScope) API via OpenAI-compatible interface.
-        """
-        if not DASHSCOPE_API_KEY:
-            # Fallback to mock if no key provided, but strictly speaking we should error or warn.
-            # For this task, user asked to replace mock with real LLM. 
-            # If key is missing, we raise an error to prompt user configuration.
-            raise HTTPException(status_code=500, detail="DASHSCOPE_API_KEY is not set in environment variables.")
+# Upstream HTTP pool (one shared client per worker process)
+DASHSCOPE_MAX_CONNECTIONS = int(os.getenv("DASHSCOPE_MAX_CONNECTIONS", "20"))
+DASHSCOPE_MAX_KEEPALIVE = int(os.getenv("DASHSCOPE_MAX_KEEPALIVE", "10"))
+DASHSCOPE_KEEPALIVE_EXPIRY = float(os.getenv("DASHSCOPE_KEEPALIVE_EXPIRY", "30"))
+DASHSCOPE_CONNECT_TIMEOUT = float(os.getenv("DASHSCOPE_CONNECT_TIMEOUT", "5"))
+DASHSCOPE_READ_TIMEOUT = float(os.getenv("DASHSCOPE_READ_TIMEOUT", "60"))
+DASHSCOPE_HTTP2 = os.getenv("DASHSCOPE_HTTP2", "true").lower() in ("1", "true", "yes")
+
+# Single-flight lease table shared by all workers (defaults to the shared cache file; empty = per-worker only)
+SINGLEFLIGHT_LEASE_PATH = os.getenv("SINGLEFLIGHT_LEASE_PATH", LLM_CACHE_PATH)
+SINGLEFLIGHT_LEASE_TTL = float(os.getenv("SINGLEFLIGHT_LEASE_TTL", "30"))  # renewed by a live leader every TTL/3
+SINGLEFLIGHT_RESULT_TTL = float(os.getenv("SINGLEFLIGHT_RESULT_TTL", "5"))  # finished result stays joinable
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL", "0.1"))
+
+# Per-endpoint LLM budgets, e.g. {"ip.generate": {"max_tokens": 1500, "daily_tokens": 2000000}}
+# max_tokens caps each completion; daily_tokens rejects calls once the endpoint spent that much in 24h
+LLM_BUDGETS: Dict[str, Dict[str, int]] = json.loads(os.getenv("LLM_BUDGETS", "{}"))
+LLM_BUDGET_REFRESH_SECONDS = float(os.getenv("LLM_BUDGET_REFRESH_SECONDS", "10"))
 
-        system_prompt = """
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Prompts (module level so they can take part in the response cache key)
+class PromptTemplate:
+    """
+    A versioned prompt. The system message is built once and sent byte-for-byte
+    identical on every call, ahead of anything request-specific, so DashScope's
+    context cache can serve that shared prefix; only the user message varies.
+    Bump `version` whenever the wording changes (cache keys and usage rows follow it).
+    """
+
+    def __init__(self, name: str, version: int, system: str, user_template: str,
+                 temperature: float, max_tokens: int, json_output: bool = True):
+        self.name = name
+        self.version = f"{name}@v{version}"
+        self.user_template = user_template
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.json_output = json_output
+        self.system_message = {"role": "system", "content": system.strip()}
+
+    def messages(self, **values) -> List[Dict[str, str]]:
+        return [self.system_message, {"role": "user", "content": self.user_template.format(**values)}]
+
+    def payload(self, max_tokens: Optional[int] = None, **values) -> Dict[str, Any]:
+        payload = {
+            "model": QWEN_MODEL,
+            "messages": self.messages(**values),
+            "temperature": self.temperature,
+            "max_tokens": max_tokens or self.max_tokens,
+        }
+        if self.json_output:
+            payload["response_format"] = {"type": "json_object"}  # Qwen/OpenAI compatible JSON mode
+        return payload
+
+
+PROMPT_TEMPLATES: Dict[str, PromptTemplate] = {}
+
+def register_prompt(template: PromptTemplate) -> PromptTemplate:
+    PROMPT_TEMPLATES[template.name] = template
+    return template
+
+def get_prompt(name: str) -> PromptTemplate:
+    return PROMPT_TEMPLATES[name]
+
+IP_SYSTEM_PROMPT = """
 You are an expert AI Social Media Consultant. Your task is to analyze the user's input and generate a comprehensive IP Positioning Strategy.
 
 Output MUST be a valid JSON object matching the following structure exactly. Do NOT output any text other than the JSON.
@@ -63,76 +138,684 @@ CONSTRAINTS:
 2. Compliance: Do NOT generate content that violates advertising laws (e.g., guaranteed cures, absolute best, get rich quick). Add these to 'do_not_say'.
 3. If input is vague, use 'confidence_notes' to explain assumptions.
 """
-
-        user_prompt = f"""
+IP_USER_TEMPLATE = """
 Analyze the following IP Profile Input:
 
-Name/Brand: {input_data.name_or_brand or "Not specified"}
-Bio/Background: {input_data.bio}
-Target Direction: {input_data.target_direction}
-Style Preference: {input_data.style_preference}
-Target Audience (Optional): {input_data.target_audience or "Not specified"}
-Monetization Goals (Optional): {input_data.monetization or "Not specified"}
-Constraints/Boundaries (Optional): {input_data.constraints or "None"}
-Platform Preference: {input_data.platform_preference}
+Name/Brand: {name_or_brand}
+Bio/Background: {bio}
+Target Direction: {target_direction}
+Style Preference: {style_preference}
+Target Audience (Optional): {target_audience}
+Monetization Goals (Optional): {monetization}
+Constraints/Boundaries (Optional): {constraints}
+Platform Preference: {platform_preference}
 
 Generate the JSON strategy.
 """
+IP_POSITIONING_PROMPT = register_prompt(PromptTemplate(
+    "ip_positioning", 2, system=IP_SYSTEM_PROMPT, user_template=IP_USER_TEMPLATE,
+    temperature=0.7, max_tokens=2048,
+))
+# Follow-up turn asking only for the fields that failed validation (same cached prefix)
+IP_FIELD_REPAIR_TEMPLATE = """
+Some fields of your JSON were invalid or missing:
+{errors}
+
+Return a JSON object containing ONLY these keys, each following the JSON Structure above: {fields}
+"""
+IP_FIELD_REPAIR_PROMPT = register_prompt(PromptTemplate(
+    "ip_positioning_field_repair", 1, system=IP_SYSTEM_PROMPT, user_template=IP_FIELD_REPAIR_TEMPLATE,
+    temperature=0.3, max_tokens=1024,
+))
+
+class UpstreamHTTP:
+    """
+    Owns the long-lived httpx.AsyncClient used for every DashScope call in this worker.
+    Created in the FastAPI lifespan (see main.py) and closed on shutdown.
+    """
+    _client: Optional[httpx.AsyncClient] = None
+    _requests = 0
+    _new_connections = 0
+
+    @classmethod
+    def start(cls) -> httpx.AsyncClient:
+        if cls._client is None or cls._client.is_closed:
+            cls._client = httpx.AsyncClient(
+                http2=DASHSCOPE_HTTP2 and HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=DASHSCOPE_MAX_CONNECTIONS,
+                    max_keepalive_connections=DASHSCOPE_MAX_KEEPALIVE,
+                    keepalive_expiry=DASHSCOPE_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(
+                    DASHSCOPE_READ_TIMEOUT,
+                    connect=DASHSCOPE_CONNECT_TIMEOUT,
+                    pool=DASHSCOPE_CONNECT_TIMEOUT,
+                ),
+                event_hooks={"request": [cls._on_request]},
+            )
+        return cls._client
+
+    @classmethod
+    async def stop(cls):
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+
+    @classmethod
+    def client(cls) -> httpx.AsyncClient:
+        # Lazily start if used outside the app lifespan (scripts, tests)
+        return cls.start()
+
+    @classmethod
+    async def _on_request(cls, request: httpx.Request):
+        cls._requests += 1
+        # httpcore reports connection setup through the trace extension;
+        # a request that never connects rode on a pooled connection.
+        request.extensions["trace"] = UpstreamTrace(on_new_connection=cls._count_new_connection)
 
-        headers = {
-            "Authorization": f"Bearer {DASHSCOPE_API_KEY}",
-            "Content-Type": "application/json"
+    @classmethod
+    def _count_new_connection(cls):
+        cls._new_connections += 1
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        open_conns = 0
+        in_use = 0
+        pool = getattr(getattr(cls._client, "_transport", None), "_pool", None)
+        for conn in getattr(pool, "connections", []):
+            if conn.is_closed():
+                continue
+            open_conns += 1
+            if not conn.is_idle():
+                in_use += 1
+        return {
+            "http2": bool(DASHSCOPE_HTTP2 and HTTP2_AVAILABLE),
+            "max_connections": DASHSCOPE_MAX_CONNECTIONS,
+            "connections_open": open_conns,
+            "connections_in_use": in_use,
+            "requests": cls._requests,
+            "connections_created": cls._new_connections,
+            "connections_reused": max(cls._requests - cls._new_connections, 0),
         }
 
-        payload = {
-            "model": QWEN_MODEL,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            "temperature": 0.7,
-            "response_format": {"type": "json_object"} # Qwen/OpenAI compatible JSON mode if supported, otherwise prompt relies on it
+
+T = TypeVar("T")
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into a single upstream call.
+
+    Within a worker, callers for a key that is already in flight await the leader's
+    future. Across gunicorn workers, a small SQLite lease table elects one leader per
+    key; the leader stores its encoded result there for SINGLEFLIGHT_RESULT_TTL seconds
+    and followers in other workers poll until it appears. The leader renews its lease
+    while the call runs, so a slow call is not mistaken for a dead leader; the lease
+    only lapses (and another worker takes over) when the leader's process is gone.
+    Cross-worker sharing only applies when encode/decode are given, since the result
+    must survive JSON.
+    """
+
+    def __init__(self, lease_path: str = SINGLEFLIGHT_LEASE_PATH, lease_ttl: float = SINGLEFLIGHT_LEASE_TTL,
+                 result_ttl: float = SINGLEFLIGHT_RESULT_TTL, poll_interval: float = SINGLEFLIGHT_POLL_INTERVAL):
+        self.lease_path = lease_path
+        self.lease_ttl = lease_ttl
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._lease_ready = False
+        self.counters = {"leader_calls": 0, "coalesced_local": 0, "coalesced_remote": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]],
+                 encode: Optional[Callable[[T], Any]] = None, decode: Optional[Callable[[Any], T]] = None) -> T:
+        # Follow an in-flight call in this worker; if its leader was cancelled, try again
+        while key in self._inflight:
+            future = self._inflight[key]
+            try:
+                result = await asyncio.shield(future)
+                self.counters["coalesced_local"] += 1
+                return result
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    continue
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            if self.lease_path and encode is not None and decode is not None:
+                result = await self._do_with_lease(key, fn, encode, decode)
+            else:
+                self.counters["leader_calls"] += 1
+                result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved; followers (if any) re-raise it themselves
+            raise
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cross_worker": bool(self.lease_path),
+            "in_flight": len(self._inflight),
+            **self.counters,
         }
 
-        # Retry logic (Simple loop)
+    async def _do_with_lease(self, key: str, fn: Callable[[], Awaitable[T]],
+                             encode: Callable[[T], Any], decode: Callable[[Any], T]) -> T:
+        owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        while True:
+            state, payload = await asyncio.to_thread(self._acquire, key, owner)
+            if state == "acquired":
+                break
+            if state == "done":
+                self.counters["coalesced_remote"] += 1
+                return decode(json.loads(payload))
+            await asyncio.sleep(self.poll_interval)  # another worker is leading
+
+        self.counters["leader_calls"] += 1
+        heartbeat = asyncio.create_task(self._heartbeat(key, owner))
+        try:
+            result = await fn()
+        except BaseException:
+            heartbeat.cancel()
+            await asyncio.to_thread(self._release, key, owner, None)
+            raise
+        heartbeat.cancel()
+        await asyncio.to_thread(self._release, key, owner, json.dumps(encode(result), ensure_ascii=False))
+        return result
+
+    async def _heartbeat(self, key: str, owner: str):
+        """Extends the lease until cancelled; stops if another worker has taken it over."""
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                renewed = await asyncio.to_thread(self._renew, key, owner)
+            except sqlite3.Error as e:
+                print(f"Single-flight lease renewal failed: {e}")
+                continue
+            if not renewed:
+                return
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.lease_path, timeout=5.0, isolation_level=None)
+        if not self._lease_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS singleflight_leases ("
+                " key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL, result TEXT)"
+            )
+            self._lease_ready = True
+        return conn
+
+    def _acquire(self, key: str, owner: str) -> Tuple[str, Optional[str]]:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute(
+                "SELECT expires_at, result FROM singleflight_leases WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[0] > now:
+                conn.execute("COMMIT")
+                return ("done", row[1]) if row[1] is not None else ("held", None)
+            conn.execute(
+                "INSERT OR REPLACE INTO singleflight_leases (key, owner, expires_at, result) VALUES (?, ?, ?, NULL)",
+                (key, owner, now + self.lease_ttl),
+            )
+            conn.execute("DELETE FROM singleflight_leases WHERE expires_at < ?", (now,))
+            conn.execute("COMMIT")
+            return "acquired", None
+        finally:
+            conn.close()
+
+    def _renew(self, key: str, owner: str) -> bool:
+        conn = self._connect()
+        try:
+            # Fenced on owner: a lease that lapsed and was taken over stays with the new leader
+            renewed = conn.execute(
+                "UPDATE singleflight_leases SET expires_at = ? WHERE key = ? AND owner = ? AND result IS NULL",
+                (time.time() + self.lease_ttl, key, owner),
+            )
+            return renewed.rowcount == 1
+        finally:
+            conn.close()
+
+    def _release(self, key: str, owner: str, result: Optional[str]):
+        conn = self._connect()
+        try:
+            if result is None:
+                conn.execute("DELETE FROM singleflight_leases WHERE key = ? AND owner = ?", (key, owner))
+            else:
+                conn.execute(
+                    "UPDATE singleflight_leases SET result = ?, expires_at = ? WHERE key = ? AND owner = ?",
+                    (result, time.time() + self.result_ttl, key, owner),
+                )
+        finally:
+            conn.close()
+
+single_flight = SingleFlight()
+
+def normalize_ip_input(input_data: schemas.IPInput) -> Dict[str, Any]:
+    """Canonical form of an IPInput: stripped strings, blanks treated as not specified."""
+    normalized = {}
+    for field, value in input_data.model_dump().items():
+        if isinstance(value, str):
+            value = " ".join(value.split()) or None
+        normalized[field] = value
+    return normalized
+
+def ip_prompt_values(input_data: schemas.IPInput) -> Dict[str, Any]:
+    return {
+        "name_or_brand": input_data.name_or_brand or "Not specified",
+        "bio": input_data.bio,
+        "target_direction": input_data.target_direction,
+        "style_preference": input_data.style_preference,
+        "target_audience": input_data.target_audience or "Not specified",
+        "monetization": input_data.monetization or "Not specified",
+        "constraints": input_data.constraints or "None",
+        "platform_preference": input_data.platform_preference,
+    }
+
+def dashscope_headers() -> Dict[str, str]:
+    if not DASHSCOPE_API_KEY:
+        # Fallback to mock if no key provided, but strictly speaking we should error or warn.
+        # For this task, user asked to replace mock with real LLM. 
+        # If key is missing, we raise an error to prompt user configuration.
+        raise HTTPException(status_code=500, detail="DASHSCOPE_API_KEY is not set in environment variables.")
+    return {
+        "Authorization": f"Bearer {DASHSCOPE_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+class UsageLedger:
+    """
+    Token accounting for upstream LLM calls.
+    Every call (cache hits excluded) is recorded in `llm_usage` with its prompt /
+    completion / cached tokens and latency. Budgets from LLM_BUDGETS are enforced per
+    endpoint: `max_tokens` caps the completion, `daily_tokens` rejects calls with 429
+    once the trailing-24h spend (all workers, re-read every LLM_BUDGET_REFRESH_SECONDS)
+    reaches it.
+    """
+
+    def __init__(self, budgets: Dict[str, Dict[str, int]] = LLM_BUDGETS,
+                 refresh_seconds: float = LLM_BUDGET_REFRESH_SECONDS):
+        self.budgets = budgets
+        self.refresh_seconds = refresh_seconds
+        self._spent: Dict[str, Tuple[float, int]] = {}  # endpoint -> (read at, tokens in last 24h)
+        self.counters = {"calls": 0, "errors": 0, "rejected": 0,
+                         "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+
+    def max_tokens(self, endpoint: str, template: PromptTemplate) -> int:
+        cap = self.budgets.get(endpoint, {}).get("max_tokens")
+        return min(template.max_tokens, cap) if cap else template.max_tokens
+
+    async def check(self, endpoint: str):
+        limit = self.budgets.get(endpoint, {}).get("daily_tokens")
+        if not limit:
+            return
+        if await self._spent_today(endpoint) >= limit:
+            self.counters["rejected"] += 1
+            raise HTTPException(status_code=429, detail=f"Daily token budget for '{endpoint}' is exhausted.")
+
+    async def record(self, endpoint: str, template: PromptTemplate, usage: Optional[Dict[str, Any]],
+                     latency: float, status: str = "ok"):
+        usage = usage or {}
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+        cached_tokens = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        self.counters["calls"] += 1
+        self.counters["errors"] += status != "ok"
+        self.counters["prompt_tokens"] += prompt_tokens
+        self.counters["completion_tokens"] += completion_tokens
+        self.counters["cached_tokens"] += cached_tokens
+        LLM_TOKENS.labels(endpoint, "prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(endpoint, "completion").inc(completion_tokens)
+        LLM_TOKENS.labels(endpoint, "cached").inc(cached_tokens)
+        if endpoint in self._spent:
+            read_at, spent = self._spent[endpoint]
+            self._spent[endpoint] = (read_at, spent + prompt_tokens + completion_tokens)
+        try:
+            async with AsyncSessionLocal() as db:
+                db.add(models.LLMUsage(
+                    endpoint=endpoint, template=template.version, model=QWEN_MODEL, status=status,
+                    prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cached_tokens=cached_tokens,
+                    latency_ms=round(latency * 1000, 1),
+                ))
+                await db.commit()
+        except Exception as e:
+            print(f"Failed to record LLM usage: {e}")  # accounting must never fail the request
+
+    async def summary(self, hours: float = 24) -> List[Dict[str, Any]]:
+        """Per endpoint and template: calls, tokens, prefix-cache hit ratio and latency."""
+        since = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+        u = models.LLMUsage
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(
+                    u.endpoint, u.template, func.count().label("calls"),
+                    func.sum(u.prompt_tokens).label("prompt_tokens"),
+                    func.sum(u.completion_tokens).label("completion_tokens"),
+                    func.sum(u.cached_tokens).label("cached_tokens"),
+                    func.avg(u.latency_ms).label("avg_latency_ms"),
+                    func.max(u.latency_ms).label("max_latency_ms"),
+                ).where(u.created_at >= since).group_by(u.endpoint, u.template)
+            )).mappings().all()
+        summary = []
+        for row in rows:
+            row = dict(row)
+            row["cached_ratio"] = round(row["cached_tokens"] / row["prompt_tokens"], 3) if row["prompt_tokens"] else 0.0
+            row["avg_latency_ms"] = round(row["avg_latency_ms"] or 0, 1)
+            row["budget"] = self.budgets.get(row["endpoint"])
+            summary.append(row)
+        return sorted(summary, key=lambda r: -(r["prompt_tokens"] + r["completion_tokens"]))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"budgets": self.budgets, **self.counters}
+
+    async def _spent_today(self, endpoint: str) -> int:
+        read_at, spent = self._spent.get(endpoint, (0.0, 0))
+        if time.monotonic() - read_at > self.refresh_seconds:
+            since = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+            async with AsyncSessionLocal() as db:
+                spent = await db.scalar(
+                    select(func.coalesce(func.sum(models.LLMUsage.prompt_tokens + models.LLMUsage.completion_tokens), 0))
+                    .where(models.LLMUsage.endpoint == endpoint, models.LLMUsage.created_at >= since)
+                )
+            self._spent[endpoint] = (time.monotonic(), spent)
+        return spent
+
+
+usage_ledger = UsageLedger()
+
+class AIService:
+    # Answers rescued by re-requesting only their invalid fields (vs. failing over to a full retry)
+    repair_counters = {"field_repairs": 0, "field_repairs_failed": 0}
+
+    @staticmethod
+    def _ip_cache_key(input_data: schemas.IPInput) -> str:
+        return make_cache_key(
+            input=normalize_ip_input(input_data),
+            template=IP_POSITIONING_PROMPT.version,
+            model=QWEN_MODEL,
+            temperature=IP_POSITIONING_PROMPT.temperature,
+        )
+
+    @staticmethod
+    def _ip_payload(input_data: schemas.IPInput, endpoint: str) -> Dict[str, Any]:
+        return IP_POSITIONING_PROMPT.payload(
+            max_tokens=usage_ledger.max_tokens(endpoint, IP_POSITIONING_PROMPT),
+            **ip_prompt_values(input_data),
+        )
+
+    @staticmethod
+    async def generate_ip_positioning(input_data: schemas.IPInput, use_cache: bool = True, refresh_cache: bool = False,
+                                      priority: int = PRIORITY_INTERACTIVE,
+                                      endpoint: str = "ip.generate") -> schemas.IPPositioningResult:
+        """
+        Generate IP Positioning using Qwen (DashScope) API via OpenAI-compatible interface.
+        Results are cached by content hash; use_cache=False bypasses the cache entirely,
+        refresh_cache=True skips the lookup but stores the fresh answer.
+        `priority` orders the call in the upstream queue (interactive before batch);
+        `endpoint` names the budget the call is charged to.
+        """
+        headers = dashscope_headers()
+
+        cache_key = AIService._ip_cache_key(input_data)
+        if not use_cache or refresh_cache:
+            ip_positioning_cache.record_bypass()
+        else:
+            cached = await ip_positioning_cache.get(cache_key)
+            if cached is not None:
+                return schemas.IPPositioningResult(**cached)
+
+        async def call_upstream() -> schemas.IPPositioningResult:
+            await usage_ledger.check(endpoint)
+            result = await AIService._request_ip_positioning(
+                headers, AIService._ip_payload(input_data, endpoint), priority, endpoint
+            )
+            if use_cache:
+                await ip_positioning_cache.set(cache_key, result.model_dump())
+            return result
+
+        # Concurrent identical requests share one upstream call
+        return await single_flight.do(
+            f"ip:{cache_key}",
+            call_upstream,
+            encode=lambda result: result.model_dump(),
+            decode=lambda data: schemas.IPPositioningResult(**data),
+        )
+
+    @staticmethod
+    async def _request_ip_positioning(headers: Dict[str, str], payload: Dict[str, Any],
+                                      priority: int = PRIORITY_INTERACTIVE,
+                                      endpoint: str = "ip.generate") -> schemas.IPPositioningResult:
+        # Retry logic: each attempt queues for an upstream slot; overload/transport
+        # failures back off exponentially with jitter (or as told by Retry-After)
         max_retries = 2
         last_exception = None
 
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            for attempt in range(max_retries + 1):
+        client = UpstreamHTTP.client()
+        for attempt in range(max_retries + 1):
+            delay = 0.0
+            try:
+                content = await AIService._post_chat(client, headers, payload, priority, endpoint, IP_POSITIONING_PROMPT)
+
+                # Tolerant parse (fences, prose, trailing commas, truncation), then validate;
+                # fields that still fail are re-requested on their own rather than regenerating everything
+                result, _ = await AIService._salvage_ip_fields(client, headers, payload, repair_json(content), priority, endpoint)
+                return result
+            
+            except HTTPException:
+                raise  # Rejected by the upstream queue; retrying would only queue again
+            except httpx.HTTPStatusError as e:
+                last_exception = e
+                cause = f"http_{e.response.status_code}"
+                if e.response.status_code not in RETRYABLE_STATUS_CODES:
+                    break
+                delay = backoff_delay(attempt, e.response.headers.get("Retry-After"))
+            except httpx.TransportError as e:
+                last_exception = e
+                cause = "timeout" if isinstance(e, httpx.TimeoutException) else "transport"
+                if isinstance(e, httpx.TimeoutException):
+                    upstream_scheduler.record_overload()
+                delay = backoff_delay(attempt)
+            except json.JSONDecodeError as e:
+                last_exception = e
+                cause = "json_parse"
+            except ValueError as e:
+                last_exception = e
+                cause = "validation"
+            except Exception as e:
+                last_exception = e
+                cause = "other"
+            
+            if attempt < max_retries:
+                LLM_RETRIES.labels(endpoint, cause).inc()
+                await asyncio.sleep(delay)
+                continue # Retry
+    
+        # If we get here, all retries failed (each retried cause is counted in LLM_RETRIES)
+        print(f"IP positioning failed after {attempt + 1} attempts ({cause}): {str(last_exception)[:200]}")
+        raise HTTPException(status_code=502, detail=f"Failed to generate IP Positioning after retries. Error: {str(last_exception)}")
+
+    @staticmethod
+    async def _post_chat(client: httpx.AsyncClient, headers: Dict[str, str], payload: Dict[str, Any],
+                         priority: int, endpoint: str, template: PromptTemplate) -> str:
+        """One chat completion: waits for an upstream slot, records usage, returns the message content."""
+        with span("llm.chat_completion", endpoint=endpoint, template=template.version, model=QWEN_MODEL) as current:
+            async with upstream_scheduler.slot(priority):
+                started = time.monotonic()
                 try:
                     response = await client.post(f"{DASHSCOPE_BASE_URL}/chat/completions", headers=headers, json=payload)
-                    response.raise_for_status()
-                    
-                    data = response.json()
-                    content = data["choices"][0]["message"]["content"]
-                    
-                    # Clean up content if it contains markdown code blocks (despite prompt)
-                    if content.startswith("```json"):
-                        content = content[7:]
-                    if content.endswith("```"):
-                        content = content[:-3]
-                    
-                    result_dict = json.loads(content)
-                    
-                    # Validate against schema (Pydantic will do this)
-                    return schemas.IPPositioningResult(**result_dict)
-                
-                except httpx.HTTPStatusError as e:
-                    last_exception = e
-                    print(f"API Request failed (Attempt {attempt+1}): {e.response.text}")
-                except (json.JSONDecodeError, ValueError) as e:
-                    last_exception = e
-                    print(f"JSON Parse/Validation failed (Attempt {attempt+1}): {e}")
-                except Exception as e:
-                    last_exception = e
-                    print(f"Unknown error (Attempt {attempt+1}): {e}")
-                
-                if attempt < max_retries:
-                    continue # Retry
-        
-        # If we get here, all retries failed
-        raise HTTPException(status_code=502, detail=f"Failed to generate IP Positioning after retries. Error: {str(last_exception)}")
+                except httpx.TransportError as e:
+                    latency = time.monotonic() - started
+                    LLM_LATENCY.labels(endpoint, type(e).__name__).observe(latency)
+                    await usage_ledger.record(endpoint, template, None, latency, type(e).__name__)
+                    raise
+            latency = time.monotonic() - started
+            outcome = "ok" if not response.is_error else f"http_{response.status_code}"
+            LLM_LATENCY.labels(endpoint, outcome).observe(latency)
+            time_to_headers = response.request.extensions["trace"].time_to_headers()
+            if time_to_headers is not None:
+                LLM_TTFT.labels(endpoint, "unary").observe(time_to_headers)
+            if current is not None:
+                current.set_attribute("http.status_code", response.status_code)
+            if response.status_code in OVERLOAD_STATUS_CODES:
+                upstream_scheduler.record_overload()
+            else:
+                upstream_scheduler.record_success()
+            if response.is_error:
+                await usage_ledger.record(endpoint, template, None, latency, outcome)
+            response.raise_for_status()
+
+            data = response.json()
+            await usage_ledger.record(endpoint, template, data.get("usage"), latency)
+            return data["choices"][0]["message"]["content"]
+
+    @staticmethod
+    async def _salvage_ip_fields(client: httpx.AsyncClient, headers: Dict[str, str], payload: Dict[str, Any],
+                                 result_dict: Any, priority: int, endpoint: str) -> Tuple[schemas.IPPositioningResult, List[str]]:
+        """
+        Validate a parsed answer. If only some top-level fields are invalid or missing,
+        ask for just those in a follow-up turn (behind the same cached prompt prefix)
+        and merge them in. Returns the result and the names of the repaired fields;
+        raises ValueError when the answer cannot be salvaged (caller falls back to a full retry).
+        """
+        if not isinstance(result_dict, dict):
+            raise ValueError("Model output is not a JSON object")
+        try:
+            return schemas.IPPositioningResult(**result_dict), []
+        except ValidationError as e:
+            errors = e.errors()
+        bad_fields = sorted({str(error["loc"][0]) for error in errors if error["loc"]})
+        if not bad_fields or len(bad_fields) == len(schemas.IPPositioningResult.model_fields):
+            raise ValueError(f"Every field failed validation: {bad_fields}")
+
+        follow_up = {k: v for k, v in payload.items() if k not in ("stream", "stream_options")}
+        follow_up.update(
+            messages=payload["messages"] + [
+                {"role": "assistant", "content": json.dumps(result_dict, ensure_ascii=False)},
+                {"role": "user", "content": IP_FIELD_REPAIR_PROMPT.user_template.format(
+                    errors="\n".join(f"- {'.'.join(map(str, error['loc']))}: {error['msg']}" for error in errors),
+                    fields=", ".join(bad_fields),
+                )},
+            ],
+            temperature=IP_FIELD_REPAIR_PROMPT.temperature,
+            max_tokens=usage_ledger.max_tokens(endpoint, IP_FIELD_REPAIR_PROMPT),
+        )
+        fixed = repair_json(await AIService._post_chat(client, headers, follow_up, priority, endpoint, IP_FIELD_REPAIR_PROMPT))
+        if not isinstance(fixed, dict):
+            raise ValueError("Field repair output is not a JSON object")
+        merged = {**result_dict, **{field: fixed[field] for field in bad_fields if field in fixed}}
+        try:
+            result = schemas.IPPositioningResult(**merged)
+        except ValidationError:
+            AIService.repair_counters["field_repairs_failed"] += 1
+            LLM_FIELD_REPAIRS.labels("failed").inc()
+            raise
+        AIService.repair_counters["field_repairs"] += 1
+        LLM_FIELD_REPAIRS.labels("repaired").inc()
+        return result, bad_fields
+
+    @staticmethod
+    async def stream_ip_positioning(input_data: schemas.IPInput, use_cache: bool = True, refresh_cache: bool = False,
+                                    priority: int = PRIORITY_INTERACTIVE,
+                                    endpoint: str = "ip.generate.stream") -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Streaming variant of generate_ip_positioning.
+        Yields ("field", (name, value)) as each top-level field of the JSON completes,
+        then ("result", IPPositioningResult) once the whole document validates.
+        No retries: once fields have been pushed to the client a regeneration would contradict them.
+        """
+        headers = dashscope_headers()
+
+        cache_key = AIService._ip_cache_key(input_data)
+        if not use_cache or refresh_cache:
+            ip_positioning_cache.record_bypass()
+        else:
+            cached = await ip_positioning_cache.get(cache_key)
+            if cached is not None:
+                for name, value in cached.items():
+                    yield "field", (name, value)
+                yield "result", schemas.IPPositioningResult(**cached)
+                return
+
+        await usage_ledger.check(endpoint)
+        payload = AIService._ip_payload(input_data, endpoint)
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+
+        parser = IncrementalObjectParser()
+        client = UpstreamHTTP.client()
+        usage = None
+        status = "ok"
+        started = None
+        first_token = True
+        try:
+            async with upstream_scheduler.slot(priority):
+                started = time.monotonic()
+                async with client.stream("POST", f"{DASHSCOPE_BASE_URL}/chat/completions", headers=headers, json=payload) as response:
+                    if response.status_code in OVERLOAD_STATUS_CODES:
+                        upstream_scheduler.record_overload()
+                    elif not response.is_error:
+                        upstream_scheduler.record_success()
+                    if response.is_error:
+                        await response.aread()
+                        response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        try:
+                            chunk = json.loads(data)
+                        except ValueError:
+                            status = "bad_chunk"
+                            raise HTTPException(status_code=502, detail=f"Malformed stream chunk from upstream: {data[:200]}")
+                        if chunk.get("usage"):
+                            usage = chunk["usage"]
+                        if not chunk.get("choices"):
+                            continue  # trailing usage-only chunk
+                        delta = chunk["choices"][0].get("delta", {}).get("content") or ""
+                        if delta and first_token:
+                            LLM_TTFT.labels(endpoint, "stream").observe(time.monotonic() - started)
+                            first_token = False
+                        for name, value in parser.feed(delta):
+                            yield "field", (name, value)
+        except httpx.HTTPStatusError as e:
+            status = f"http_{e.response.status_code}"
+            raise HTTPException(status_code=502, detail=f"Failed to stream IP Positioning. Error: {str(e)}")
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+            raise HTTPException(status_code=502, detail=f"Failed to stream IP Positioning. Error: {str(e)}")
+        finally:
+            if started is not None:  # not recorded if the call never left the upstream queue
+                latency = time.monotonic() - started
+                LLM_LATENCY.labels(endpoint, status).observe(latency)
+                await usage_ledger.record(endpoint, IP_POSITIONING_PROMPT, usage, latency, status)
+
+        try:
+            result_dict = parser.fields if parser.done and not parser.broken else repair_json(parser.text)
+            result, repaired = await AIService._salvage_ip_fields(client, headers, payload, result_dict, priority, endpoint)
+        except (httpx.HTTPError, ValueError) as e:
+            raise HTTPException(status_code=502, detail=f"Streamed IP Positioning did not validate. Error: {str(e)}")
+        # Fields the parser skipped (not valid JSON as streamed) or that were repaired
+        values = result.model_dump()
+        for name in values:
+            if name not in parser.fields or name in repaired:
+                yield "field", (name, values[name])
+
+        if use_cache:
+            await ip_positioning_cache.set(cache_key, result.model_dump())
+        yield "result", result
 
     # --- KEEPING EXISTING MOCK METHODS FOR OTHER MODULES (Unchanged) ---
     
@@ -155,10 +838,12 @@ Generate the JSON strategy.
         }
 
     @staticmethod
-    def rewrite_script(transcript: str, style: str) -> str:
+    def rewrite_script(transcript: str, style: str, style_prompt: Optional[str] = None) -> str:
         """Mock AI rewriting"""
         prefix = ""
-        if style == "hook":
+        if style_prompt:
+            prefix = f"[{style_prompt}] "
+        elif style == "hook":
             prefix = "STOP SCROLLING! You won't believe this... "
         elif style == "professional":
             prefix = "In this analysis, we observe that... "
@@ -167,6 +852,11 @@ Generate the JSON strategy.
         
         return f"{prefix} (Rewritten content based on: {transcript[:50]}...)"
 
+# Video source normalization
+SHARE_URL_PATTERN = re.compile(r"https?://[^\s，。！]+")
+DOUYIN_VIDEO_PATH_PATTERN = re.compile(r"/(?:video|note|share/video|share/note)/(\d+)")
+TRACKING_PARAM_PREFIXES = ("utm_", "share_", "previous_page", "from", "enter_from", "u_code", "did", "iid")
+
 class DouyinService:
     @staticmethod
     def search_accounts(keyword: str) -> List[Dict]:
@@ -190,6 +880,31 @@ class DouyinService:
         ]
         return mock_accounts
 
+    @staticmethod
+    def source_key(url: str) -> str:
+        """
+        Canonical identity of a shared video, used to deduplicate transcripts.
+        Share texts ("复制打开抖音... https://v.douyin.com/xyz/") are reduced to their
+        URL; every Douyin URL form resolves to its video id where the id is in the URL.
+        """
+        match = SHARE_URL_PATTERN.search(url)
+        url = match.group(0) if match else url.strip()
+        parts = urlsplit(url if "://" in url else "https://" + url)
+        host = (parts.hostname or "").lower()
+        if host.endswith("douyin.com"):
+            video_id = DOUYIN_VIDEO_PATH_PATTERN.search(parts.path)
+            if video_id:
+                return f"douyin:{video_id.group(1)}"
+            query = dict(parse_qsl(parts.query))
+            for param in ("modal_id", "aweme_id", "item_id"):
+                if query.get(param, "").isdigit():
+                    return f"douyin:{query[param]}"
+            if host == "v.douyin.com":
+                # Short links only resolve to an id with a network round-trip; the code itself is stable
+                return f"douyin-short:{parts.path.strip('/')}"
+        query = sorted((k, v) for k, v in parse_qsl(parts.query) if not k.startswith(TRACKING_PARAM_PREFIXES))
+        return "url:" + urlunsplit(("https", host, parts.path.rstrip("/") or "/", urlencode(query), ""))
+
     @staticmethod
     def get_video_data(url: str) -> Dict:
         """Mock TikHub Video Data"""
@@ -197,9 +912,3 @@ class DouyinService:
             "title": "Amazing AI Tools",
             "transcript": "This is a transcript of the video content extracted from Douyin..."
         }
-
-class AvatarService:
-    @staticmethod
-    def create_video(text: str, avatar_id: str, voice: str) -> str:
-        """Mock Avatar Video Generation"""
-        return "https://demo-avatar-video.mp4"
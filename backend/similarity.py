@@ -0,0 +1,155 @@
+import os
+import zlib
+import asyncio
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+import models
+from search_index import text_pieces
+
+# Configuration
+SIMILARITY_DIM = int(os.getenv("SIMILARITY_DIM", "256"))  # embedding size; changing it needs `migrate.py --reembed`
+SIMILARITY_SHINGLE = int(os.getenv("SIMILARITY_SHINGLE", "3"))  # characters per shingle
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.85"))  # cosine above which scripts are near-duplicates
+SIMILARITY_MAX_RESULTS = int(os.getenv("SIMILARITY_MAX_RESULTS", "5"))
+SIMILARITY_BACKFILL_BATCH = int(os.getenv("SIMILARITY_BACKFILL_BATCH", "1000"))
+
+EMBEDDING_DTYPE = np.float32
+
+
+# --- Embedding ---
+
+def embed(transcript: Optional[str]) -> Optional[np.ndarray]:
+    """
+    Hashing-trick embedding of a transcript's set of character shingles: each shingle adds
+    +1 or -1 to one of SIMILARITY_DIM buckets (CRC32, so every process agrees), and the
+    result is L2-normalized. The dot product of two embeddings estimates how much of their
+    shingle sets overlap, so light edits, punctuation and whitespace barely move it.
+    """
+    normalized = " ".join(text_pieces(transcript or ""))
+    if len(normalized) < SIMILARITY_SHINGLE:
+        return None
+    shingles = {normalized[i:i + SIMILARITY_SHINGLE] for i in range(len(normalized) - SIMILARITY_SHINGLE + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint32, count=len(shingles))
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+    vector = np.bincount(hashes % SIMILARITY_DIM, weights=signs, minlength=SIMILARITY_DIM).astype(EMBEDDING_DTYPE)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else None
+
+
+def to_bytes(vector: Optional[np.ndarray]) -> Optional[bytes]:
+    return None if vector is None else vector.astype(EMBEDDING_DTYPE).tobytes()
+
+
+def from_bytes(data: Optional[bytes]) -> Optional[np.ndarray]:
+    if not data or len(data) != SIMILARITY_DIM * np.dtype(EMBEDDING_DTYPE).itemsize:
+        return None  # missing, or stored with another SIMILARITY_DIM
+    return np.frombuffer(data, dtype=EMBEDDING_DTYPE)
+
+
+def backfill_embeddings(bind, rebuild: bool = False) -> int:
+    """Embed scripts stored without an embedding (all of them with `rebuild`). Run from migrate."""
+    table = models.VideoScript.__table__
+    stmt = select(table.c.id, table.c.transcript).where(table.c.transcript.is_not(None))
+    if not rebuild:
+        stmt = stmt.where(table.c.embedding.is_(None))
+    count = 0
+    with bind.begin() as conn:
+        result = conn.execution_options(yield_per=SIMILARITY_BACKFILL_BATCH).execute(stmt)
+        for batch in result.partitions():
+            params = [{"id": row.id, "embedding": to_bytes(embed(row.transcript))} for row in batch]
+            conn.execute(text("UPDATE video_scripts SET embedding = :embedding WHERE id = :id"), params)
+            count += len(params)
+    return count
+
+
+# --- Index ---
+
+class SimilarityIndex:
+    """
+    Every script embedding as one (n, SIMILARITY_DIM) matrix in this worker, so a lookup
+    is a single matrix-vector product. Rows written since the last lookup (by any
+    process) are appended first, read by id; candidates are then re-checked against
+    their stored embedding, so a transcript refreshed elsewhere never matches stale.
+    Memory: SIMILARITY_DIM * 4 bytes per script (1 KiB at the default 256).
+    """
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.matrix = np.empty((0, SIMILARITY_DIM), dtype=EMBEDDING_DTYPE)
+        self.last_id = 0
+        self._lock = asyncio.Lock()
+
+    async def refresh(self, db: AsyncSession):
+        async with self._lock:
+            rows = (await db.execute(
+                select(models.VideoScript.id, models.VideoScript.embedding)
+                .where(models.VideoScript.id > self.last_id)
+                .order_by(models.VideoScript.id)
+            )).all()
+            if not rows:
+                return
+            self.last_id = rows[-1].id
+            vectors = [(row.id, from_bytes(row.embedding)) for row in rows]
+            vectors = [(id, vector) for id, vector in vectors if vector is not None]
+            if vectors:
+                self.ids = np.concatenate([self.ids, np.array([id for id, _ in vectors], dtype=np.int64)])
+                self.matrix = np.vstack([self.matrix, np.stack([vector for _, vector in vectors])])
+
+    def put(self, id: int, vector: Optional[np.ndarray]):
+        """Replace the embedding of a script this worker has re-transcribed."""
+        positions = np.flatnonzero(self.ids == id)
+        if positions.size and vector is not None:
+            self.matrix[positions[0]] = vector
+
+    def nearest(self, vector: np.ndarray, threshold: float, limit: int, exclude: Optional[int] = None) -> List[Tuple[int, float]]:
+        if not self.ids.size:
+            return []
+        scores = self.matrix @ vector
+        if exclude is not None:
+            scores[self.ids == exclude] = -1.0
+        candidates = np.flatnonzero(scores >= threshold)
+        best = candidates[np.argsort(-scores[candidates], kind="stable")][:limit]
+        return [(int(self.ids[i]), float(scores[i])) for i in best]
+
+
+similarity_index = SimilarityIndex()
+
+
+async def find_near_duplicates(db: AsyncSession, script: models.VideoScript, threshold: float = SIMILARITY_THRESHOLD,
+                               limit: int = SIMILARITY_MAX_RESULTS) -> List[Tuple[models.VideoScript, float]]:
+    """Other scripts whose transcript is at least `threshold` similar to this one's, most similar first."""
+    vector = from_bytes(script.embedding) if script.embedding else embed(script.transcript)
+    if vector is None:
+        return []
+    await similarity_index.refresh(db)
+    candidates = similarity_index.nearest(vector, threshold, limit, exclude=script.id)
+    if not candidates:
+        return []
+    rows = (await db.scalars(select(models.VideoScript).where(models.VideoScript.id.in_([id for id, _ in candidates])))).all()
+    stored = {row.id: row for row in rows}
+    matches = []
+    for id, _ in candidates:
+        candidate = stored.get(id)
+        current = from_bytes(candidate.embedding) if candidate else None
+        if current is not None:
+            score = float(current @ vector)
+            if score >= threshold:
+                matches.append((candidate, round(score, 4)))
+    return sorted(matches, key=lambda match: -match[1])
+
+
+async def latest_rewrites(db: AsyncSession, script_ids: List[int]) -> Dict[int, Dict[str, models.RewriteVersion]]:
+    """Newest rewrite per style for each script: {script_id: {style: RewriteVersion}}."""
+    if not script_ids:
+        return {}
+    rows = (await db.scalars(
+        select(models.RewriteVersion)
+        .where(models.RewriteVersion.script_id.in_(script_ids))
+        .order_by(models.RewriteVersion.id)
+    )).all()
+    latest: Dict[int, Dict[str, models.RewriteVersion]] = {}
+    for row in rows:
+        latest.setdefault(row.script_id, {})[row.style] = row
+    return latest
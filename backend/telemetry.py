@@ -0,0 +1,273 @@
+import os
+import time
+import importlib.util
+from contextlib import contextmanager
+from typing import Dict, Optional
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from starlette.routing import Match
+
+# Configuration
+# Under gunicorn, gunicorn_conf.py points PROMETHEUS_MULTIPROC_DIR at a shared directory so
+# every worker writes its samples there and /metrics reports the sum over all workers.
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# Tracing is on when an OTLP endpoint is configured and the OpenTelemetry SDK is installed
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "ai-media-workbench")
+
+# The SDK and exporter take tens of milliseconds to import; only load them when tracing is on
+OTEL_AVAILABLE = all(importlib.util.find_spec(name) is not None for name in ("opentelemetry.sdk", "opentelemetry.exporter.otlp"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LLM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+
+# HTTP server
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency (until the body is sent)",
+                         ["method", "route"], buckets=LATENCY_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being served", ["method", "route"],
+                       multiprocess_mode="livesum")
+
+# Upstream LLM
+LLM_CONNECT = Histogram("llm_upstream_connect_seconds", "New upstream connection setup (TCP + TLS)", buckets=LLM_BUCKETS)
+LLM_TTFT = Histogram("llm_upstream_ttft_seconds",
+                     "Time to first token (streams) or to response headers (non-streaming calls)",
+                     ["endpoint", "mode"], buckets=LLM_BUCKETS)
+LLM_LATENCY = Histogram("llm_upstream_duration_seconds", "Upstream call latency", ["endpoint", "outcome"],
+                        buckets=LLM_BUCKETS)
+LLM_RETRIES = Counter("llm_upstream_retries_total", "Upstream attempts retried, by cause", ["endpoint", "cause"])
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by the upstream", ["endpoint", "kind"])
+LLM_FIELD_REPAIRS = Counter("llm_field_repairs_total", "Answers salvaged by re-requesting invalid fields", ["outcome"])
+
+# Database
+DB_QUERY = Histogram("db_query_duration_seconds", "SQL statement latency", ["operation"], buckets=DB_BUCKETS)
+DB_COMMIT = Histogram("db_commit_duration_seconds", "Session commit latency (flush + COMMIT)", buckets=DB_BUCKETS)
+
+# Startup
+STARTUP_SECONDS = Gauge("app_startup_seconds", "Time spent in each startup phase of a worker", ["phase"],
+                        multiprocess_mode="liveall")
+
+_tracer = None
+_tracer_provider = None
+
+
+def render_metrics():
+    """Body and content type for /metrics, aggregated over all workers in multiprocess mode."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+# --- Tracing ---
+
+def start_tracing():
+    """Install the OTLP exporter in this worker (call after fork, from the lifespan)."""
+    global _tracer, _tracer_provider
+    if not (OTEL_EXPORTER_OTLP_ENDPOINT and OTEL_AVAILABLE) or _tracer is not None:
+        return
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+    _tracer_provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME, "service.instance.id": str(os.getpid())}))
+    _tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))  # endpoint read from OTEL_EXPORTER_OTLP_*
+    trace.set_tracer_provider(_tracer_provider)
+    _tracer = trace.get_tracer("workbench")
+
+
+def stop_tracing():
+    global _tracer, _tracer_provider
+    if _tracer_provider is not None:
+        _tracer_provider.shutdown()
+        _tracer = _tracer_provider = None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Child span of the current request when tracing is on; a no-op otherwise."""
+    if _tracer is None:
+        yield None
+        return
+    with _tracer.start_as_current_span(name, attributes={k: v for k, v in attributes.items() if v is not None}) as current:
+        yield current
+
+
+# --- Startup profile ---
+
+class StartupProfile:
+    """
+    Wall-clock phases of a worker's startup (imports, app setup, lifespan), reported
+    once it is ready. With gunicorn's preload_app the import phases run once in the
+    master; forked workers then only report the time from fork to ready.
+    """
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.preloaded = False
+        self.ready = False
+        self._last = time.perf_counter()
+
+    def mark(self, phase: str, since: Optional[float] = None):
+        now = time.perf_counter()
+        self.phases[phase] = now - (self._last if since is None else since)
+        self._last = now
+
+    def forked(self):
+        """Called in a freshly forked worker (gunicorn post_fork) of a preloaded app."""
+        self.phases = {}
+        self.preloaded = True
+        self._last = time.perf_counter()
+
+    def finish(self):
+        self.ready = True
+        for phase, seconds in self.phases.items():
+            STARTUP_SECONDS.labels(phase).set(seconds)
+        report = ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in self.phases.items())
+        print(f"Worker {os.getpid()} ready in {self.total():.3f}s{' (preloaded)' if self.preloaded else ''}: {report}")
+
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+    def as_dict(self):
+        return {"preloaded": self.preloaded, "total_seconds": round(self.total(), 4),
+                "phases": {phase: round(seconds, 4) for phase, seconds in self.phases.items()}}
+
+
+startup_profile = StartupProfile()
+
+
+# --- HTTP middleware ---
+
+def route_template(scope) -> str:
+    """Route path with placeholders (/api/ip/{id}), so label cardinality stays bounded."""
+    app = scope.get("app")
+    for route in getattr(getattr(app, "router", None), "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware (streaming bodies pass straight through): latency histogram,
+    request counter and in-flight gauge per route, and a server span per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        route = route_template(scope)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight = HTTP_IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            with span(f"{method} {route}", **{"http.method": method, "http.route": route}) as current:
+                await self.app(scope, receive, send_with_status)
+                if current is not None:
+                    current.set_attribute("http.status_code", status)
+        finally:
+            in_flight.dec()
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - started)
+
+
+# --- Upstream HTTP (httpcore trace extension) ---
+
+class UpstreamTrace:
+    """
+    Per-request httpcore trace callback. Measures setup of a new connection
+    (TCP connect, plus TLS for https) and the time until response headers arrive;
+    requests riding on a pooled connection see no connect events at all.
+    """
+
+    def __init__(self, on_new_connection=None):
+        self.started = time.perf_counter()
+        self.headers_at: Optional[float] = None
+        self.on_new_connection = on_new_connection
+        self._connect_started: Optional[float] = None
+        self._connect_done: Optional[float] = None
+
+    async def __call__(self, event_name: str, info):
+        if event_name == "connection.connect_tcp.started":
+            self._connect_started = time.perf_counter()
+        elif event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            if event_name == "connection.connect_tcp.complete" and self.on_new_connection:
+                self.on_new_connection()
+            self._connect_done = time.perf_counter()
+        elif event_name.endswith("send_request_headers.started") and self._connect_done and self._connect_started:
+            LLM_CONNECT.observe(self._connect_done - self._connect_started)
+            self._connect_started = self._connect_done = None
+        elif event_name.endswith("receive_response_headers.complete"):
+            self.headers_at = time.perf_counter()
+
+    def time_to_headers(self) -> Optional[float]:
+        return None if self.headers_at is None else self.headers_at - self.started
+
+
+# --- Database ---
+
+def instrument_engine(sync_engine):
+    """Statement timing (and a span per statement when tracing) for one engine."""
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+        if _tracer is not None:
+            context._query_span = _tracer.start_span(
+                f"db {statement.split(None, 1)[0].upper()}",
+                attributes={"db.system": conn.dialect.name, "db.statement": statement[:1000]},
+            )
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        DB_QUERY.labels(_operation(statement)).observe(time.perf_counter() - context._query_started)
+        query_span = getattr(context, "_query_span", None)
+        if query_span is not None:
+            query_span.end()
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        query_span = getattr(exception_context.execution_context, "_query_span", None)
+        if query_span is not None:
+            query_span.record_exception(exception_context.original_exception)
+            query_span.end()
+
+
+@event.listens_for(Session, "before_commit")
+def _before_commit(session):
+    session.info["commit_started"] = time.perf_counter()
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        DB_COMMIT.observe(time.perf_counter() - started)
+
+
+def _operation(statement: str) -> str:
+    keyword = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    return keyword if keyword in ("SELECT", "INSERT", "UPDATE", "DELETE", "PRAGMA", "WITH") else "OTHER"
@@ -0,0 +1,41 @@
+"""
+Run from backend/:  python -m pytest tests
+
+The modules read their configuration at import time, so the scratch database and
+stores are set up here, before any test module imports them.
+"""
+import os
+import sys
+import asyncio
+import tempfile
+import pytest
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix="workbench-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(SCRATCH_DIR, 'test.db')}"
+os.environ["LLM_CACHE_PATH"] = os.path.join(SCRATCH_DIR, "llm_cache.db")
+os.environ["MEDIA_STORE_DIR"] = os.path.join(SCRATCH_DIR, "media")
+os.environ["JOB_RUNNER_ENABLED"] = "false"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def schema():
+    from database import engine, migrate
+    migrate(engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def run(schema):
+    """Runs a coroutine on a fresh event loop; pooled async connections are closed with it."""
+    from database import async_engine
+
+    def runner(coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                await async_engine.dispose()
+        return asyncio.run(main())
+    return runner
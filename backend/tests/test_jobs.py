@@ -0,0 +1,163 @@
+import asyncio
+import uuid
+from sqlalchemy import update
+import models
+import jobs
+from database import AsyncSessionLocal
+from jobs import JobRunner, job_handler, submit_job, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED
+
+
+def runner_for(kind: str, name: str, **kwargs) -> JobRunner:
+    """A runner that only claims `kind`, so tests do not pick up each other's jobs."""
+    runner = JobRunner(concurrency=1, poll_interval=0.02, kinds=(kind,), **kwargs)
+    runner.worker_id = name
+    return runner
+
+
+def new_kind(handler) -> str:
+    kind = f"test.{uuid.uuid4().hex[:8]}"
+    job_handler(kind)(handler)
+    return kind
+
+
+async def get_job(job_id: str) -> models.Job:
+    async with AsyncSessionLocal() as db:
+        return await db.get(models.Job, job_id)
+
+
+def test_racing_runners_claim_each_job_once(run):
+    async def noop(db, payload):
+        return None
+
+    kind = new_kind(noop)
+    runners = [runner_for(kind, f"runner-{i}") for i in range(4)]
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            job_ids = [(await submit_job(db, kind, {"n": n})).id for n in range(5)]
+        claimed = []
+        while True:
+            results = await asyncio.gather(*(runner._claim() for runner in runners))
+            won = [job for job in results if job is not None]
+            if not won:
+                break
+            claimed.extend(won)
+        return job_ids, claimed
+
+    job_ids, claimed = run(scenario())
+    assert sorted(job.id for job in claimed) == sorted(job_ids)
+    assert all(job.status == JOB_RUNNING and job.attempts == 1 for job in claimed)
+    assert sum(runner.counters["claimed"] for runner in runners) == len(job_ids)
+
+
+def test_lost_lease_cancels_handler_and_fences_finish(run):
+    events = {}
+
+    async def slow(db, payload):
+        events["started"].set()
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            events["cancelled"] = True
+            raise
+        return {"done": True}
+
+    kind = new_kind(slow)
+    runner = runner_for(kind, "runner-a", lease_seconds=0.3)
+
+    async def scenario():
+        events["started"] = asyncio.Event()
+        async with AsyncSessionLocal() as db:
+            job_id = (await submit_job(db, kind, {})).id
+        job = await runner._claim()
+        running = asyncio.create_task(runner._run(job))
+        await asyncio.wait_for(events["started"].wait(), 5)
+        # The lease lapsed and another runner claimed the job
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(models.Job).where(models.Job.id == job_id).values(locked_by="runner-b"))
+            await db.commit()
+        await asyncio.wait_for(running, 5)
+        # A late write from the old owner is fenced out as well
+        await runner._finish(job_id, JOB_SUCCEEDED, result={"stale": True})
+        return await get_job(job_id)
+
+    job = run(scenario())
+    assert events.get("cancelled")
+    assert job.status == JOB_RUNNING and job.locked_by == "runner-b" and job.result is None
+
+
+def test_failing_renewal_cancels_handler_before_lease_expires(run, monkeypatch):
+    events = {}
+
+    async def slow(db, payload):
+        events["started"].set()
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            events["cancelled_at"] = asyncio.get_running_loop().time()
+            raise
+
+    kind = new_kind(slow)
+    runner = runner_for(kind, "runner-a", lease_seconds=0.3)
+
+    def unavailable():
+        raise RuntimeError("database unavailable")
+
+    async def scenario():
+        events["started"] = asyncio.Event()
+        async with AsyncSessionLocal() as db:
+            await submit_job(db, kind, {})
+        job = await runner._claim()
+        claimed_at = asyncio.get_running_loop().time()
+        running = asyncio.create_task(runner._run(job))
+        await asyncio.wait_for(events["started"].wait(), 5)
+        monkeypatch.setattr(jobs, "AsyncSessionLocal", unavailable)  # every lease renewal fails from now on
+        await asyncio.wait_for(running, 5)
+        return claimed_at
+
+    claimed_at = run(scenario())
+    assert events["cancelled_at"] - claimed_at < runner.lease_seconds
+
+
+def test_stop_requeues_running_job_without_using_an_attempt(run):
+    events = {}
+
+    async def slow(db, payload):
+        events["started"].set()
+        await asyncio.sleep(30)
+
+    kind = new_kind(slow)
+    runner = runner_for(kind, "runner-a")
+
+    async def scenario():
+        events["started"] = asyncio.Event()
+        runner.start()
+        runner.worker_id = "runner-a"
+        async with AsyncSessionLocal() as db:
+            job_id = (await submit_job(db, kind, {})).id
+        await asyncio.wait_for(events["started"].wait(), 5)
+        assert (await get_job(job_id)).attempts == 1
+        await runner.stop()
+        return await get_job(job_id)
+
+    job = run(scenario())
+    assert job.status == JOB_QUEUED
+    assert job.attempts == 0
+    assert job.locked_by is None and job.lease_expires_at is None
+
+
+def test_claim_skips_job_with_live_lease(run):
+    async def noop(db, payload):
+        return None
+
+    kind = new_kind(noop)
+    first, second = runner_for(kind, "runner-a"), runner_for(kind, "runner-b")
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            await submit_job(db, kind, {})
+        job = await first._claim()
+        return job, await second._claim()
+
+    job, stolen = run(scenario())
+    assert job is not None and stolen is None
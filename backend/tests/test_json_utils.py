@@ -0,0 +1,91 @@
+import json
+import pytest
+from json_utils import IncrementalObjectParser, repair_json
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"a": 1}', {"a": 1}),
+    ('```json\n{"a": 1}\n```', {"a": 1}),
+    ('Sure! {"a": 1} Hope this helps.', {"a": 1}),
+    # Brackets in leading prose are skipped, not parsed as the answer
+    ('Here is the result (see [docs]): {"positioning_one_liner": "x"}', {"positioning_one_liner": "x"}),
+    ('Note [1]: {"a": 1}', {"a": 1}),
+    ('Use {braces} like this: {"a": 1}', {"a": 1}),
+    # An array is returned when there is no object, and is not searched for one
+    ('[1, 2]', [1, 2]),
+    ('[{"a": 1}]', [{"a": 1}]),
+    # Faults the repair pass fixes
+    ('{"a": [1, 2,],}', {"a": [1, 2]}),
+    ('{"a": 1, // comment\n "b": /* x */ 2}', {"a": 1, "b": 2}),
+    ('{"a": "line\nbreak"}', {"a": "line\nbreak"}),
+    ('{"a": "trunc', {"a": "trunc"}),
+    ('{"a": 1, "b"', {"a": 1, "b": None}),
+    ('{"a": 1, "b":', {"a": 1, "b": None}),
+    ('{"a": {"b": [1', {"a": {"b": [1]}}),
+    ('see [1] then {"a": [1, 2', {"a": [1, 2]}),
+])
+def test_repair_json(text, expected):
+    assert repair_json(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "no json here", "broken [here", "{not json}"])
+def test_repair_json_gives_up(text):
+    with pytest.raises(json.JSONDecodeError):
+        repair_json(text)
+
+
+def feed_all(parser, text, size):
+    fields = []
+    for i in range(0, len(text), size):
+        fields.extend(parser.feed(text[i:i + size]))
+    return fields
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_incremental_parser_reports_fields_as_they_complete(size):
+    text = 'Here you go:\n```json\n{"s": "a \\"q\\" }", "n": -1.5e2, "b": true, "z": null, "o": {"x": [1, {"y": "]"}]}, "l": []}\n```'
+    parser = IncrementalObjectParser()
+    fields = feed_all(parser, text, size)
+    assert fields == [("s", 'a "q" }'), ("n", -150.0), ("b", True), ("z", None),
+                      ("o", {"x": [1, {"y": "]"}]}), ("l", [])]
+    assert parser.done and not parser.broken
+    assert parser.fields == dict(fields)
+
+
+def test_incremental_parser_field_arrives_with_its_closing_quote():
+    parser = IncrementalObjectParser()
+    assert parser.feed('{"a": "hel') == []
+    assert parser.feed('lo", "b": 1') == [("a", "hello")]
+    assert parser.feed("}") == [("b", 1)]
+    assert parser.done
+
+
+@pytest.mark.parametrize("text, fields", [
+    ('{"a": 1, "b": tru, "c": 3}', {"a": 1, "c": 3}),  # bad scalar
+    ('{"a": 1, "b": [1, 2,], "c": 3}', {"a": 1, "c": 3}),  # bad nested value
+    ('{"a": 1, "b\\x": 2, "c": 3}', {"a": 1, "c": 3}),  # bad key escape
+])
+def test_incremental_parser_skips_bad_fields_and_marks_broken(text, fields):
+    parser = IncrementalObjectParser()
+    assert dict(feed_all(parser, text, 4)) == fields
+    assert parser.done and parser.broken
+
+
+def test_incremental_parser_broken_stream_falls_back_to_repair():
+    parser = IncrementalObjectParser()
+    feed_all(parser, '{"a": 1, "b": [1, 2,], "c": 3}', 5)
+    assert parser.broken
+    assert repair_json(parser.text) == {"a": 1, "b": [1, 2], "c": 3}
+
+
+def test_incremental_parser_tolerates_trailing_comma():
+    parser = IncrementalObjectParser()
+    assert parser.feed('{"a": 1, "b": 2,}') == [("a", 1), ("b", 2)]
+    assert parser.done and not parser.broken
+
+
+def test_incremental_parser_truncated_stream_is_not_done():
+    parser = IncrementalObjectParser()
+    assert parser.feed('{"a": 1, "b": "cut') == [("a", 1)]
+    assert not parser.done
+    assert repair_json(parser.text) == {"a": 1, "b": "cut"}
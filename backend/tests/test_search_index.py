@@ -0,0 +1,120 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+import models
+import search_index  # noqa: F401  (registers the index sync hooks)
+from database import SessionLocal, AsyncSessionLocal
+from search_index import Phrase, highlight, parse_query, search, tokenize
+from routers import search as search_router
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("内容创作", "内容 容创 创作 作"),
+    ("内", "内"),
+    ("Hello World", "hello world"),
+    ("ＡＢＣ１２", "abc12"),  # NFKC: full-width letters and digits
+    ("用AI做内容", "用 ai 做内 内容 容"),  # a one-character run is its own token
+    ("AI内容, 创作!", "ai 内容 容 创作 作"),
+    ("snake_case", "snake case"),
+    ("ひらがな한국어", "ひら らが がな な한 한국 국어 어"),
+    ("  ...  ", ""),
+])
+def test_tokenize(value, expected):
+    assert tokenize(value) == expected
+
+
+@pytest.mark.parametrize("q, phrases, pieces", [
+    ("内容创作", [Phrase(["内容", "容创", "创作"])], ["内容创作"]),
+    ("内", [Phrase(["内"], prefix=True)], ["内"]),
+    ("内容 创作", [Phrase(["内容"]), Phrase(["创作"])], ["内容", "创作"]),
+    ("AI内容", [Phrase(["ai", "内容"])], ["ai", "内容"]),
+    ("AI内", [Phrase(["ai"]), Phrase(["内"], prefix=True)], ["ai", "内"]),
+    ("内AI", [Phrase(["内"], prefix=True), Phrase(["ai"])], ["内", "ai"]),
+    ("Video Script", [Phrase(["video"]), Phrase(["script"])], ["video", "script"]),
+    ("!!! ...", [], []),
+])
+def test_parse_query(q, phrases, pieces):
+    assert parse_query(q) == (phrases, pieces)
+
+
+@pytest.mark.parametrize("value, pieces, width, expected", [
+    ("我们专注内容创作", ["内容创作"], 160, "我们专注<mark>内容创作</mark>"),
+    ("Video <b>scripts</b>", ["video"], 160, "<mark>Video</mark> &lt;b&gt;scripts&lt;/b&gt;"),
+    ("no match here", ["内容"], 160, "no match here"),
+    ("0123456789内容0123456789", ["内容"], 9, "…789<mark>内容</mark>0123…"),
+    ("", ["内容"], 160, ""),
+])
+def test_highlight(value, pieces, width, expected):
+    assert highlight(value, pieces, width) == expected
+
+
+def add_scripts(transcripts):
+    """Insert transcripts through the ORM, so the index is written by its flush hooks."""
+    with SessionLocal() as db:
+        scripts = [models.VideoScript(source_type="upload", source_content="test", transcript=t) for t in transcripts]
+        db.add_all(scripts)
+        db.commit()
+        return [script.id for script in scripts]
+
+
+async def search_ids(q, limit=20):
+    async with AsyncSessionLocal() as db:
+        hits, _ = await search(db, q, ["transcript"], limit)
+    return {hit.doc_id for hit in hits}
+
+
+def test_search_matches_cjk_as_phrases(run):
+    phrase, reordered, spaced, mixed, single = add_scripts([
+        "我们专注短视频内容创作与分发",
+        "创作内容要先想清楚受众",  # same characters, other order
+        "内容 创作 分开写",
+        "用AI内容工具批量生成",
+        "首创",
+    ])
+    found = run(search_ids("内容创作"))
+    assert phrase in found and reordered not in found and spaced not in found
+    found = run(search_ids("内容 创作"))  # two terms: both must appear, anywhere
+    assert {phrase, reordered, spaced} <= found
+    assert run(search_ids("AI内容")) >= {mixed}
+    assert phrase not in run(search_ids("AI内容"))
+    # One character reaches the start, the middle and the end of a run
+    found = run(search_ids("创"))
+    assert {phrase, reordered, spaced, single} <= found
+    assert mixed not in found
+
+
+def test_search_cursor_pages_every_hit_once(run):
+    # Identical texts give identical ranks, so the keyset must break ties on rowid
+    ids = add_scripts([f"分页测试{'填充' * (i % 5)}" for i in range(23)] + ["分页测试"] * 4)
+    app = FastAPI()
+    app.include_router(search_router.router)
+
+    async def pages():
+        seen, cursor = [], None
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            while True:
+                params = {"q": "分页测试", "limit": 4, **({"cursor": cursor} if cursor else {})}
+                response = await client.get("/api/search", params=params)
+                assert response.status_code == 200
+                page = response.json()
+                seen.extend(hit["doc_id"] for hit in page)
+                scores = [hit["score"] for hit in page]
+                assert scores == sorted(scores, reverse=True)
+                cursor = response.headers.get("X-Next-Cursor")
+                if not cursor:
+                    return seen
+
+    seen = run(pages())
+    assert sorted(seen) == sorted(ids)
+
+
+def test_search_rejects_bad_cursor_and_empty_query(run):
+    app = FastAPI()
+    app.include_router(search_router.router)
+
+    async def get(params):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return (await client.get("/api/search", params=params)).status_code
+
+    assert run(get({"q": "内容", "cursor": "not-a-cursor"})) == 400
+    assert run(get({"q": "!!!"})) == 400
@@ -0,0 +1,24 @@
+"""
+Standalone job runner, for running background jobs beside the web workers.
+
+    JOB_RUNNER_ENABLED=false gunicorn -c gunicorn_conf.py main:app   # web only
+    python worker.py                                                 # jobs only
+"""
+import os
+os.environ["JOB_RUNNER_ENABLED"] = "true"
+
+import signal
+import asyncio
+from main import app, lifespan  # imports every router, registering all job handlers
+
+async def run():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    async with lifespan(app):
+        print("Job runner started; waiting for jobs")
+        await stop.wait()
+
+if __name__ == "__main__":
+    asyncio.run(run())
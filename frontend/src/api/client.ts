@@ -1,6 +1,6 @@
 import axios from 'axios';
 
-const API_BASE_URL = 'http://localhost:8000'; // Should be in .env
+export const API_BASE_URL = 'http://localhost:8000'; // Should be in .env
 
 export const apiClient = axios.create({
   baseURL: API_BASE_URL,
@@ -12,9 +12,13 @@ export const apiClient = axios.create({
 export const endpoints = {
   ip: {
     generate: '/api/ip/generate',
+    generateStream: '/api/ip/generate/stream',
     history: '/api/ip/history',
     detail: (id: number) => `/api/ip/${id}`,
     update: (id: number) => `/api/ip/${id}`,
+    batch: '/api/ip/batch',
+    batchDetail: (id: number) => `/api/ip/batch/${id}`,
+    batchResults: (id: number) => `/api/ip/batch/${id}/results`,
   },
   benchmark: {
     search: '/api/benchmark/search',
@@ -25,5 +29,7 @@ export const endpoints = {
   },
   avatar: {
     create: '/api/avatar/create',
+    render: (id: number) => `/api/avatar/renders/${id}`,
   },
+  search: '/api/search',
 };
@@ -1,5 +1,5 @@
 import React, { useState } from 'react';
-import { apiClient, endpoints } from '../api/client';
+import { apiClient, endpoints, API_BASE_URL } from '../api/client';
 import { Loader2, Play } from 'lucide-react';
 
 const AvatarGen: React.FC = () => {
@@ -11,12 +11,17 @@ const AvatarGen: React.FC = () => {
     if (!text) return;
     setLoading(true);
     try {
-      const response = await apiClient.post(endpoints.avatar.create, {
+      let { data: render } = await apiClient.post(`${endpoints.avatar.create}?wait=25`, {
         text,
         avatar_id: "avatar_001", // Mock ID
         voice_id: "voice_001"   // Mock ID
       });
-      setVideoUrl(response.data.video_url);
+      // Rendering takes minutes: long-poll the render until it finishes
+      while (render.status !== 'succeeded' && render.status !== 'failed') {
+        ({ data: render } = await apiClient.get(`${endpoints.avatar.render(render.id)}?wait=25`));
+      }
+      if (render.status === 'failed') throw new Error(render.error);
+      setVideoUrl(`${API_BASE_URL}${render.video_url}`);
     } catch (error) {
       console.error('Video generation failed', error);
       alert('Video generation failed');
@@ -74,7 +79,7 @@ const AvatarGen: React.FC = () => {
         <div className="bg-black rounded-xl overflow-hidden flex items-center justify-center relative aspect-video shadow-lg">
           {videoUrl ? (
             <div className="text-center">
-                {/* Mock Video Player */}
+                <video src={videoUrl} controls className="max-h-64 mx-auto mb-4" />
                 <div className="text-white mb-4">视频生成成功！</div>
                 <a 
                     href={videoUrl} 
@@ -84,7 +89,6 @@ const AvatarGen: React.FC = () => {
                 >
                     下载 / 观看
                 </a>
-                <p className="text-gray-500 text-xs mt-2">模拟链接: {videoUrl}</p>
             </div>
           ) : (
             <div className="text-gray-500 flex flex-col items-center">
@@ -26,12 +26,13 @@ const ScriptFactory: React.FC = () => {
     }
   };
 
-  const handleRewrite = async () => {
+  const handleRewrite = async (reuseDuplicates = true) => {
     if (!script) return;
     setLoadingRewrite(true);
     try {
       const response = await apiClient.post(endpoints.script.rewrite, {
-        script_id: script.id
+        script_id: script.id,
+        reuse_duplicates: reuseDuplicates
       });
       setRewrites(response.data);
     } catch (error) {
@@ -82,9 +83,14 @@ const ScriptFactory: React.FC = () => {
             <div className="bg-gray-50 p-4 rounded-lg h-64 overflow-y-auto text-sm text-gray-700 whitespace-pre-wrap border border-gray-200">
               {script.transcript}
             </div>
+            {script.near_duplicates && script.near_duplicates.length > 0 && (
+              <p className="mt-3 text-xs text-amber-600">
+                与已有稿件 #{script.near_duplicates[0].script_id} 高度相似（相似度 {Math.round(script.near_duplicates[0].similarity * 100)}%），改写时将直接复用其版本
+              </p>
+            )}
             <div className="mt-4">
               <button
-                onClick={handleRewrite}
+                onClick={() => handleRewrite()}
                 disabled={loadingRewrite}
                 className="w-full bg-purple-600 text-white py-2 px-4 rounded-lg hover:bg-purple-700 disabled:opacity-50 flex items-center justify-center gap-2"
               >
@@ -96,6 +102,18 @@ const ScriptFactory: React.FC = () => {
 
           {/* Rewritten Versions */}
           <div className="space-y-4">
+            {rewrites.length > 0 && rewrites[0].similarity != null && (
+              <div className="flex items-center justify-between text-xs text-gray-500">
+                <span>已复用相似稿件 #{rewrites[0].script_id} 的改写</span>
+                <button
+                  className="text-indigo-600 hover:underline disabled:opacity-50"
+                  disabled={loadingRewrite}
+                  onClick={() => handleRewrite(false)}
+                >
+                  重新生成
+                </button>
+              </div>
+            )}
             {rewrites.length > 0 ? (
               rewrites.map((ver) => (
                 <div key={ver.id} className="bg-white p-4 rounded-xl shadow-sm border border-gray-100">
@@ -58,12 +58,20 @@ export interface BenchmarkAccount {
   created_at: string;
 }
 
+export interface NearDuplicate {
+  script_id: number;
+  similarity: number;
+  source_content?: string;
+  rewrite_ids: number[];
+}
+
 export interface Script {
   id: number;
   source_type: string;
   source_content: string;
   transcript: string;
   created_at: string;
+  near_duplicates?: NearDuplicate[];
 }
 
 export interface RewriteVersion {
@@ -72,6 +80,7 @@ export interface RewriteVersion {
   style: string;
   content: string;
   created_at: string;
+  similarity?: number | null; // set when reused from a near-duplicate script
 }
 
 export interface AvatarResponse {